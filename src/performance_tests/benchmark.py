@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Offline benchmarks for the hot paths of the WireCloud platform.
+
+The benchmarks run in-process against a SQLite/locmem settings profile (see
+performance_tests/settings.py), seeding synthetic users, components and
+workspaces before timing each scenario and counting the database queries it
+makes. Results can be stored as a JSON baseline and compared against
+previous baselines, failing when a scenario makes more queries or becomes
+slower than allowed::
+
+    $ python -m performance_tests.benchmark --output results.json
+    $ python -m performance_tests.benchmark --baseline performance_tests/baseline.json
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import threading
+import time
+import zipfile
+
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'performance_tests.settings')
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+BASELINE_FORMAT_VERSION = 1
+
+BENCHMARK_VENDOR = 'Benchmark'
+
+WIDGET_TEMPLATE = '''<?xml version='1.0' encoding='UTF-8'?>
+<widget xmlns="http://wirecloud.conwet.fi.upm.es/ns/macdescription/1" vendor="{vendor}" name="{name}" version="{version}">
+  <details>
+    <title>{name}</title>
+    <email>benchmark@example.com</email>
+    <description>Synthetic widget used for benchmarking {name}</description>
+    <authors>benchmark</authors>
+  </details>
+  <preferences>
+    <preference name="text" type="text" label="text" description="text preference" default="initial text"/>
+    <preference name="number" type="number" label="number" description="number preference" default="2"/>
+    <preference name="password" type="password" label="password" description="password preference" default="" secure="true"/>
+  </preferences>
+  <persistentvariables>
+    <variable name="prop" type="text" label="prop" description="property" default="value"/>
+  </persistentvariables>
+  <wiring>
+    <outputendpoint name="output" type="text" label="Output" friendcode="benchmark"/>
+    <inputendpoint name="input" type="text" label="Input" friendcode="benchmark"/>
+  </wiring>
+  <contents src="index.html"/>
+  <rendering width="6" height="24"/>
+</widget>
+'''
+
+OPERATOR_TEMPLATE = '''<?xml version='1.0' encoding='UTF-8'?>
+<operator xmlns="http://wirecloud.conwet.fi.upm.es/ns/macdescription/1" vendor="{vendor}" name="{name}" version="{version}">
+  <details>
+    <title>{name}</title>
+    <email>benchmark@example.com</email>
+    <description>Synthetic operator used for benchmarking {name}</description>
+    <authors>benchmark</authors>
+  </details>
+  <preferences>
+    <preference name="prefix" type="text" label="Prefix" description="Prefix to concatenate" default=""/>
+  </preferences>
+  <wiring>
+    <outputendpoint name="output" type="text" label="output" friendcode="benchmark"/>
+    <inputendpoint name="input" type="text" label="input" friendcode="benchmark"/>
+  </wiring>
+  <scripts>
+    <script src="js/main.js"/>
+  </scripts>
+</operator>
+'''
+
+WIDGET_CODE = '''<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset="utf-8"/>
+    <title>{name}</title>
+    <script type="text/javascript" src="js/main.js"></script>
+  </head>
+  <body>
+    {body}
+  </body>
+</html>
+'''
+
+SCRIPT_CODE = b'(function () {\n    "use strict";\n    MashupPlatform.wiring.registerCallback("input", function (data) {\n        MashupPlatform.wiring.pushEvent("output", data);\n    });\n})();\n'
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def build_component(component_type, name, version):
+    """
+    Returns the contents of a synthetic wgt file.
+    """
+
+    f = BytesIO()
+    zf = zipfile.ZipFile(f, 'w')
+    if component_type == 'widget':
+        zf.writestr('config.xml', WIDGET_TEMPLATE.format(vendor=BENCHMARK_VENDOR, name=name, version=version))
+        zf.writestr('index.html', WIDGET_CODE.format(name=name, body='<p>%s</p>' % ('benchmark ' * 200)))
+    else:
+        zf.writestr('config.xml', OPERATOR_TEMPLATE.format(vendor=BENCHMARK_VENDOR, name=name, version=version))
+    zf.writestr('js/main.js', SCRIPT_CODE)
+    zf.close()
+
+    return f.getvalue()
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+
+    body = json.dumps({'data': ['benchmark'] * 100}).encode('utf-8')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubUpstream(object):
+    """
+    Local HTTP server used as the target of the proxy benchmarks.
+    """
+
+    def __enter__(self):
+        # Requests to the stub upstream should never go through the HTTP
+        # proxies configured on the environment
+        os.environ['NO_PROXY'] = ','.join(filter(None, (os.environ.get('NO_PROXY'), '127.0.0.1')))
+        self.server = HTTPServer(('127.0.0.1', 0), StubUpstreamHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def domain(self):
+        return '127.0.0.1:%s' % self.server.server_address[1]
+
+
+class Fixture(object):
+    """
+    Synthetic data used by the benchmarks.
+    """
+
+    def __init__(self, options):
+
+        from django.contrib.auth.models import Group, User
+        from wirecloud.commons.utils.wgt import WgtFile
+        from wirecloud.platform.localcatalogue.utils import install_component
+
+        self.options = options
+
+        self.owner = User.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark')
+        self.group = Group.objects.create(name='benchmark')
+        self.owner.groups.add(self.group)
+        for i in range(options.users):
+            user = User.objects.create_user('benchmark-user-%d' % i, 'benchmark-user-%d@example.com' % i, 'benchmark')
+            user.groups.add(self.group)
+
+        # Every fifth component is an operator, a third of the components
+        # are public and the rest are shared with the owner and their group
+        self.widgets = []
+        self.operators = []
+        for i in range(options.components):
+            component_type = 'operator' if i % 5 == 4 else 'widget'
+            contents = build_component(component_type, '%s-%d' % (component_type, i), '1.0')
+            public = i % 3 == 0
+            added, resource = install_component(WgtFile(BytesIO(contents)), executor_user=self.owner, public=public, users=[self.owner], groups=[self.group] if not public else [])
+            (self.widgets if component_type == 'widget' else self.operators).append(resource)
+
+        if len(self.widgets) == 0 or len(self.operators) == 0:
+            raise BenchmarkError('At least 5 components are required')
+
+        self.workspaces = [self.create_workspace(i) for i in range(options.workspaces)]
+        self.workspace = self.workspaces[0]
+
+    def create_workspace(self, index):
+
+        from wirecloud.platform.iwidget.utils import SaveIWidget
+        from wirecloud.platform.models import UserWorkspace, Workspace
+        from wirecloud.platform.wiring.utils import get_wiring_skeleton
+        from wirecloud.platform.workspace.utils import createTab
+
+        options = self.options
+        workspace = Workspace.objects.create(title='Benchmark %d' % index, name='benchmark-%d' % index, creator=self.owner, wiringStatus=get_wiring_skeleton(), public=True)
+        UserWorkspace.objects.create(user=self.owner, workspace=workspace)
+
+        for i in range(options.tabs):
+            tab = createTab('Tab %d' % i, workspace)
+            for j in range(options.widgets):
+                widget = self.widgets[(i * options.widgets + j) % len(self.widgets)]
+                SaveIWidget({'widget': widget.local_uri_part}, self.owner, tab, initial_variable_values={'text': 'value %d' % j})
+
+        wiring = workspace.wiringStatus
+        for i in range(options.operators):
+            operator = self.operators[i % len(self.operators)]
+            wiring['operators'][str(i + 1)] = {
+                'id': str(i + 1),
+                'name': operator.local_uri_part,
+                'preferences': {
+                    'prefix': {'hidden': False, 'readonly': False, 'value': {'users': {str(self.owner.id): 'prefix %d' % i}}},
+                },
+                'properties': {},
+            }
+        workspace.save()
+
+        return workspace
+
+
+def measure(func, iterations, setup=None):
+    """
+    Runs func the given number of times (after a warm-up run), returning
+    the number of queries made by the most expensive iteration and the
+    median and the minimum running time (in seconds).
+    """
+
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    if setup is not None:
+        setup()
+    func()
+
+    timings = []
+    queries = []
+    for i in range(iterations):
+        if setup is not None:
+            setup()
+
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        queries.append(len(context.captured_queries))
+
+    return {
+        'iterations': iterations,
+        'queries': max(queries),
+        'median': statistics.median(timings),
+        'min': min(timings),
+    }
+
+
+def check_response(response, status=200):
+
+    if response.status_code != status:
+        raise BenchmarkError('Unexpected response (%s): %s' % (response.status_code, response.content[:200]))
+
+    # Consume streaming responses so they are fully processed
+    if response.streaming:
+        b''.join(response.streaming_content)
+
+    return response
+
+
+def get_benchmarks(fixture, upstream):
+    """
+    Returns the list of scenarios to run as (name, func, setup) tuples.
+    """
+
+    from django.core.cache import cache
+    from django.test import Client
+    from django.urls import reverse
+
+    from wirecloud.commons.utils.version import Version
+    from wirecloud.commons.utils.wgt import WgtFile
+    from wirecloud.platform.localcatalogue.utils import install_component
+    from wirecloud.platform.workspace.utils import get_global_workspace_data
+
+    owner = fixture.owner
+    workspace = fixture.workspace
+    widget = fixture.widgets[0]
+    operator = fixture.operators[0]
+
+    client = Client()
+    client.force_login(owner)
+
+    workspace_collection_url = reverse('wirecloud.workspace_collection')
+    search_url = reverse('wirecloud_catalogue.resource_collection') + '?q=benchmark&maxresults=30'
+    widget_code_url = reverse('wirecloud.showcase_media', kwargs={'vendor': widget.vendor, 'name': widget.short_name, 'version': widget.version, 'file_path': 'index.html'}) + '?entrypoint=true'
+    operator_code_url = reverse('wirecloud.operator_code_entry', kwargs={'vendor': operator.vendor, 'name': operator.short_name, 'version': operator.version})
+    proxy_url = reverse('wirecloud|proxy', kwargs={'protocol': 'http', 'domain': upstream.domain, 'path': '/data'})
+    workspace_url = 'http://testserver' + reverse('wirecloud.workspace_view', kwargs={'owner': owner.username, 'name': workspace.name})
+
+    def workspace_data():
+        json.loads(get_global_workspace_data(workspace, owner).get_data())
+
+    # 10k versions taken from 500 different version strings
+    generator = random.Random(0)
+    available_versions = ['%d.%d.%d%s' % (generator.randint(0, 5), generator.randint(0, 20), generator.randint(0, 20), generator.choice(('', 'a1', 'b2', 'rc1', '-dev'))) for i in range(500)]
+    vstrings = [generator.choice(available_versions) for i in range(10000)]
+
+    install_counter = iter(range(1, sys.maxsize))
+    components_to_install = []
+
+    def prepare_component():
+        contents = build_component('widget', 'installed-widget', '1.%d' % next(install_counter))
+        components_to_install.append(WgtFile(BytesIO(contents)))
+
+    def install():
+        install_component(components_to_install.pop(), executor_user=owner, users=[owner])
+
+    return (
+        ('workspace_data.cold', workspace_data, cache.clear),
+        ('workspace_data.warm', workspace_data, None),
+        ('workspace_collection.read', lambda: check_response(client.get(workspace_collection_url, HTTP_ACCEPT='application/json')), None),
+        ('search_resources.cold', lambda: check_response(client.get(search_url, HTTP_ACCEPT='application/json')), cache.clear),
+        ('search_resources.warm', lambda: check_response(client.get(search_url, HTTP_ACCEPT='application/json')), None),
+        ('widget_code.cold', lambda: check_response(client.get(widget_code_url)), cache.clear),
+        ('widget_code.warm', lambda: check_response(client.get(widget_code_url)), None),
+        ('operator_code.cold', lambda: check_response(client.get(operator_code_url)), cache.clear),
+        ('operator_code.warm', lambda: check_response(client.get(operator_code_url)), None),
+        ('proxy_request', lambda: check_response(client.get(proxy_url, HTTP_REFERER=workspace_url)), None),
+        ('install_component', install, prepare_component),
+        ('version_sort.uncached', lambda: sorted(vstrings, key=Version), None),
+        ('version_sort.cached', lambda: sorted(vstrings, key=Version.parse), Version.parse.cache_clear),
+    )
+
+
+def compare(results, baseline, query_tolerance=0, time_tolerance=0.5, ignore_times=False):
+    """
+    Compares the results with a baseline, returning the list of detected
+    regressions.
+    """
+
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+
+        if result['queries'] > expected['queries'] + query_tolerance:
+            regressions.append('%s: %d queries (baseline: %d)' % (name, result['queries'], expected['queries']))
+
+        if not ignore_times and result['median'] > expected['median'] * (1 + time_tolerance):
+            regressions.append('%s: %.2f ms (baseline: %.2f ms)' % (name, result['median'] * 1000, expected['median'] * 1000))
+
+    return regressions
+
+
+def get_parameters(options):
+    return {name: getattr(options, name) for name in ('users', 'components', 'workspaces', 'tabs', 'widgets', 'operators')}
+
+
+def run(options):
+
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    try:
+        with StubUpstream() as upstream:
+            start = time.perf_counter()
+            fixture = Fixture(options)
+            log(options, 'Seeded synthetic data in %.2f s' % (time.perf_counter() - start))
+
+            results = {}
+            for name, func, setup in get_benchmarks(fixture, upstream):
+                if options.only and not any(name.startswith(prefix) for prefix in options.only):
+                    continue
+
+                results[name] = measure(func, options.iterations, setup)
+                log(options, '%-28s %6d queries %10.2f ms (min %.2f ms)' % (name, results[name]['queries'], results[name]['median'] * 1000, results[name]['min'] * 1000))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(settings.BENCHMARK_TMP_DIR, ignore_errors=True)
+
+    return results
+
+
+def log(options, msg):
+    if options.verbosity > 0:
+        print(msg)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Runs the WireCloud offline benchmarks')
+    parser.add_argument('--users', type=int, default=20, help='Number of synthetic users to create')
+    parser.add_argument('--components', type=int, default=40, help='Number of synthetic components to install (every fifth component is an operator)')
+    parser.add_argument('--workspaces', type=int, default=5, help='Number of synthetic workspaces to create')
+    parser.add_argument('--tabs', type=int, default=4, help='Number of tabs per workspace')
+    parser.add_argument('--widgets', type=int, default=5, help='Number of widgets per tab')
+    parser.add_argument('--operators', type=int, default=5, help='Number of operators per workspace')
+    parser.add_argument('-n', '--iterations', type=int, default=10, help='Number of timed runs of each benchmark')
+    parser.add_argument('--only', action='append', metavar='PREFIX', help='Only run the benchmarks whose name starts with the given prefix. Can be used several times')
+    parser.add_argument('-o', '--output', metavar='FILE', help='Store the results on the given file, using the baseline format')
+    parser.add_argument('-b', '--baseline', metavar='FILE', nargs='?', const=DEFAULT_BASELINE, help='Compare the results with the given baseline (performance_tests/baseline.json by default), failing on regressions')
+    parser.add_argument('--query-tolerance', type=int, default=0, help='Number of extra queries allowed before considering a benchmark has regressed')
+    parser.add_argument('--time-tolerance', type=float, default=0.5, help='Allowed slowdown ratio (e.g. 0.5 allows benchmarks to be 50%% slower than the baseline)')
+    parser.add_argument('--ignore-times', action='store_true', help='Only compare query counts with the baseline (useful on shared CI runners)')
+    parser.add_argument('-v', '--verbosity', type=int, default=1, choices=(0, 1))
+    options = parser.parse_args(argv)
+
+    if min(options.components, options.iterations) < 1 or min(options.users, options.workspaces, options.tabs, options.widgets, options.operators) < 0 or options.workspaces < 1:
+        parser.error('invalid benchmark parameters')
+
+    baseline = None
+    if options.baseline is not None:
+        with open(options.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        if baseline.get('version') != BASELINE_FORMAT_VERSION:
+            parser.error('unsupported baseline format: %s' % options.baseline)
+
+        if baseline['parameters'] != get_parameters(options):
+            parser.error('the baseline was generated using different parameters: %s' % json.dumps(baseline['parameters'], sort_keys=True))
+
+    results = run(options)
+
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'version': BASELINE_FORMAT_VERSION,
+                'parameters': get_parameters(options),
+                'results': results,
+            }, f, indent=4, sort_keys=True)
+            f.write('\n')
+
+    if baseline is not None:
+        regressions = compare(results, baseline['results'], options.query_tolerance, options.time_tolerance, options.ignore_times)
+        if len(regressions) > 0:
+            print('Performance regressions detected:', file=sys.stderr)
+            for regression in regressions:
+                print('  %s' % regression, file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
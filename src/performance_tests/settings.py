@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+# Settings used by the offline benchmarks (see benchmark.py). All the state
+# (database, cache, search indexes and deployed components) is created from
+# scratch on each run, so no external service is required.
+
+import os
+import tempfile
+
+from wirecloud.commons.utils.conf import load_default_wirecloud_conf
+from django.urls import reverse_lazy
+
+DEBUG = False
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_TMP_DIR = os.environ.get('WIRECLOUD_BENCHMARK_TMP_DIR') or tempfile.mkdtemp(prefix='wirecloud-benchmark-')
+load_default_wirecloud_conf(locals())
+
+# Static files are not compressed on the fly, this way the results do not
+# depend on the availability of the SCSS compilers
+COMPRESS_ENABLED = False
+USE_XSENDFILE = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_TMP_DIR, 'wirecloud.db'),
+        'TEST': {
+            'NAME': ':memory:',
+        },
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'wirecloud.platform.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'wirecloud.commons.haystack_backends.whoosh_backend.WhooshEngine',
+        'PATH': os.path.join(BENCHMARK_TMP_DIR, 'index'),
+    },
+}
+
+ALLOWED_HOSTS = ['*']
+THEME_ACTIVE = 'wirecloud.defaulttheme'
+LANGUAGE_CODE = 'en'
+DEFAULT_LANGUAGE = 'en'
+LANGUAGES = (
+    ('en', 'English'),
+)
+
+STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BENCHMARK_TMP_DIR, 'static')
+COMPRESS_ROOT = STATIC_ROOT
+
+SECRET_KEY = 'wirecloud-benchmarks-not-a-secret-key'
+ROOT_URLCONF = 'urls'
+FORCE_SCRIPT_NAME = ''
+
+LOGIN_URL = reverse_lazy('login')
+LOGOUT_URL = reverse_lazy('wirecloud.root')
+LOGIN_REDIRECT_URL = reverse_lazy('wirecloud.root')
+
+CATALOGUE_MEDIA_ROOT = os.path.join(BENCHMARK_TMP_DIR, 'catalogue', 'media')
+GADGETS_DEPLOYMENT_DIR = os.path.join(BENCHMARK_TMP_DIR, 'deployment', 'widgets')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+}
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+from wirecloud.commons.utils.version import Version
+
+
+def fill_version_key(apps, schema_editor):
+    CatalogueResource = apps.get_model('catalogue', 'CatalogueResource')
+
+    for resource in CatalogueResource.objects.only('id', 'version').iterator():
+        try:
+            version_key = Version(resource.version).get_sort_key()
+        except ValueError:
+            continue
+
+        CatalogueResource.objects.filter(pk=resource.pk).update(version_key=version_key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogue', '0002_alter_json_description'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogueresource',
+            name='version_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Version key'),
+        ),
+        migrations.RunPython(fill_version_key, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='catalogueresource',
+            index_together={('vendor', 'short_name', 'version_key')},
+        ),
+    ]
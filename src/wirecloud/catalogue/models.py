@@ -18,19 +18,145 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
-import random
+import hashlib
+import json
 from urllib.parse import urlparse
 
+from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.core.cache import cache
 from django.db import models
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 
 from wirecloud.commons.fields import JSONField
+from wirecloud.commons.utils.cache import get_cache_version, get_cache_versions, invalidate_cache_version, LRUCache
 from wirecloud.commons.utils.http import get_absolute_reverse_url
 from wirecloud.commons.utils.template.parsers import TemplateParser
 
 
+# Process-local layer of the processed info cache. Entries are keyed using
+# the resource cache version, so they become unreachable as soon as the
+# resource cache is invalidated by any process
+_processed_info_cache = LRUCache(getattr(settings, 'WIRECLOUD_PROCESSED_INFO_CACHE_SIZE', 1000))
+
+
+AVAILABILITY_VERSION_KEY = '_catalogue_availability_version'
+PUBLIC_RESOURCES_VERSION_KEY = '_catalogue_public_resources_version'
+
+
+def build_user_availability_version_key(user_id):
+    return '_catalogue_availability_version/%s' % user_id
+
+
+def invalidate_availability(user_ids=None):
+    """
+    Invalidates the cached availability of the resources for the given users
+    (all the users if not provided).
+    """
+
+    if user_ids is None:
+        invalidate_cache_version(AVAILABILITY_VERSION_KEY)
+    else:
+        for user_id in user_ids:
+            invalidate_cache_version(build_user_availability_version_key(user_id))
+
+
+def invalidate_public_resources():
+    invalidate_cache_version(PUBLIC_RESOURCES_VERSION_KEY)
+
+
+class CatalogueResourceManager(models.Manager):
+
+    def filter_available_for(self, user):
+
+        if not user.is_authenticated:
+            return self.filter(public=True)
+
+        return self.filter(models.Q(public=True) | models.Q(users=user) | models.Q(groups__in=user.groups.all()))
+
+    def get_public_ids(self):
+        """
+        Returns the set of ids of the public resources.
+        """
+
+        key = '_catalogue_public_resources/%s' % get_cache_version(PUBLIC_RESOURCES_VERSION_KEY)
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(self.filter(public=True).values_list('pk', flat=True))
+            cache.set(key, ids)
+
+        return ids
+
+    def get_granted_ids(self, user):
+        """
+        Returns the set of ids of the resources made available to the given
+        user, directly or through any of its groups. Public resources are not
+        included.
+        """
+
+        if not user.is_authenticated:
+            return frozenset()
+
+        user_version_key = build_user_availability_version_key(user.id)
+        versions = get_cache_versions((AVAILABILITY_VERSION_KEY, user_version_key))
+        key = '_catalogue_available_resources/%s/%s/%s' % (user.id, versions[AVAILABILITY_VERSION_KEY], versions[user_version_key])
+
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(self.filter(models.Q(users=user) | models.Q(groups__user=user)).values_list('pk', flat=True))
+            cache.set(key, ids)
+
+        return ids
+
+    def get_availability_version(self, user_id):
+        """
+        Returns a value that changes whenever the set of resources available
+        for the given user (see get_available_ids) may change. Useful for
+        building the keys of cached data depending on that availability.
+        """
+
+        user_version_key = build_user_availability_version_key(user_id)
+        versions = get_cache_versions((PUBLIC_RESOURCES_VERSION_KEY, AVAILABILITY_VERSION_KEY, user_version_key))
+        return '%s.%s.%s' % (versions[PUBLIC_RESOURCES_VERSION_KEY], versions[AVAILABILITY_VERSION_KEY], versions[user_version_key])
+
+    def get_latest_versions(self, components):
+        """
+        Returns a dict mapping each of the given (vendor, name) pairs to the
+        latest version available on the catalogue. Pairs without any version
+        are not included. Uses a single query.
+        """
+
+        components = set(components)
+        if len(components) == 0:
+            return {}
+
+        query = models.Q()
+        for vendor, name in components:
+            query |= models.Q(vendor=vendor, short_name=name)
+
+        latest_key = self.filter(vendor=models.OuterRef('vendor'), short_name=models.OuterRef('short_name')).order_by('-version_key').values('version_key')[:1]
+        resources = self.filter(query).filter(version_key=models.Subquery(latest_key)).order_by('pk')
+
+        result = {}
+        for resource in resources:
+            result.setdefault((resource.vendor, resource.short_name), resource)
+
+        return result
+
+    def get_available_ids(self, user, resources):
+        """
+        Returns the set of ids of the given resources (ids or instances) that
+        are available for the given user.
+        """
+
+        resource_ids = set(resource if isinstance(resource, int) else resource.pk for resource in resources)
+        if len(resource_ids) == 0:
+            return set()
+
+        return (resource_ids & self.get_public_ids()) | (resource_ids & self.get_granted_ids(user))
+
+
 class CatalogueResource(models.Model):
 
     RESOURCE_TYPES = ('widget', 'mashup', 'operator')
@@ -44,6 +170,8 @@ class CatalogueResource(models.Model):
     vendor = models.CharField(_('Vendor'), max_length=250)
     short_name = models.CharField(_('Name'), max_length=250)
     version = models.CharField(_('Version'), max_length=150)
+    # Sortable representation of the version, see Version.get_sort_key
+    version_key = models.CharField(_('Version key'), max_length=255, blank=True, default='', editable=False)
     type = models.SmallIntegerField(_('Type'), choices=TYPE_CHOICES, null=False, blank=False)
 
     # Person who added the resource to catalogue!
@@ -65,6 +193,8 @@ class CatalogueResource(models.Model):
 
     json_description = JSONField(_('JSON description'))
 
+    objects = CatalogueResourceManager()
+
     @property
     def local_uri_part(self):
 
@@ -76,22 +206,16 @@ class CatalogueResource(models.Model):
 
     @property
     def cache_version(self):
-        version = cache.get(self.cache_version_key)
-        if version is None:
-            version = random.randrange(1, 100000)
-            cache.set(self.cache_version_key, version)
-
-        return version
+        return get_cache_version(self.cache_version_key)
 
     def invalidate_cache(self):
-        try:
-            cache.incr(self.cache_version_key)
-        except ValueError:
-            pass
+        invalidate_cache_version(self.cache_version_key)
+
+        _processed_info_cache.delete_matching(lambda key: key.startswith('_catalogue_resource_info/%s/' % self.id))
 
     def is_available_for(self, user):
 
-        return self.public or self.users.filter(id=user.id).exists() or len(set(self.groups.all()) & set(user.groups.all())) > 0
+        return self.public or self.id in CatalogueResource.objects.get_granted_ids(user)
 
     def is_removable_by(self, user, vendor=False):
         from wirecloud.catalogue.utils import check_vendor_permissions
@@ -112,12 +236,41 @@ class CatalogueResource(models.Model):
     def get_processed_info(self, request=None, lang=None, process_urls=True, translate=True, process_variables=False, url_pattern_name='wirecloud_catalogue.media'):
 
         if translate and lang is None:
-            from django.utils import translation
             lang = translation.get_language()
         else:
             lang = None
 
-        parser = self.get_template(request, url_pattern_name=url_pattern_name)
+        template_uri = self.get_template_url(request=request, url_pattern_name=url_pattern_name)
+
+        if self.pk is None:
+            return self._build_processed_info(template_uri, lang, process_urls, process_variables)
+
+        # The parser always translates the description, falling back to the
+        # active language when no language is provided
+        options = json.dumps([
+            lang if lang is not None else translation.get_language(),
+            process_urls,
+            process_variables,
+            template_uri if process_urls else None,
+        ])
+        key = '_catalogue_resource_info/%s/%s/%s' % (self.id, self.cache_version, hashlib.sha1(options.encode('utf-8')).hexdigest())
+
+        # Processed info is stored serialized, so every call returns a fresh
+        # copy that callers are free to modify
+        data = _processed_info_cache.get(key)
+        if data is None:
+            data = cache.get(key)
+            if data is None:
+                data = json.dumps(self._build_processed_info(template_uri, lang, process_urls, process_variables))
+                cache.set(key, data)
+
+            _processed_info_cache.set(key, data)
+
+        return json.loads(data)
+
+    def _build_processed_info(self, template_uri, lang, process_urls, process_variables):
+
+        parser = TemplateParser(self.json_description, base=template_uri)
         processed_info = parser.get_resource_processed_info(lang=lang, process_urls=process_urls, translate=True, process_variables=process_variables)
 
         # Fix for already imported widgets that don't have the macversion
@@ -135,6 +288,7 @@ class CatalogueResource(models.Model):
 
     class Meta:
         unique_together = ("short_name", "vendor", "version")
+        index_together = ("vendor", "short_name", "version_key")
 
     def __str__(self):
         return self.local_uri_part
@@ -20,13 +20,14 @@
 
 from urllib.parse import urljoin
 
-from django.db.models import Q
+from django.contrib.auth.models import Group, User
+from django.db.models import Prefetch, Q
 from haystack import indexes
 
 from wirecloud.catalogue.models import CatalogueResource, get_template_url
 from wirecloud.commons.haystack_fields import BooleanField
 from wirecloud.commons.haystack_queryparser import ParseSQ
-from wirecloud.commons.search_indexes import buildSearchResults, SearchQuerySet
+from wirecloud.commons.search_indexes import buildSearchResults, get_related_ids, SearchQuerySet
 from wirecloud.commons.utils.version import Version
 
 
@@ -63,9 +64,20 @@ class ResourceIndex(indexes.SearchIndex, indexes.Indexable):
     input_friendcodes = indexes.MultiValueField()
     output_friendcodes = indexes.MultiValueField()
 
+    # Resources have no modification date and their permissions and
+    # visibility can be updated at any time, so no watermark_field is defined
+    # and the incremental updates of the indexes process all the resources
+    # (see the updatesearchindexes command)
+
     def get_model(self):
         return self.model
 
+    def index_queryset(self, using=None):
+        return self.get_model()._default_manager.prefetch_related(
+            Prefetch('users', queryset=User.objects.only('id')),
+            Prefetch('groups', queryset=Group.objects.only('id')),
+        )
+
     def should_update(self, instance, **kwargs):
         if instance.template_uri == "":
             self.remove_object(instance, **kwargs)
@@ -94,8 +106,8 @@ class ResourceIndex(indexes.SearchIndex, indexes.Indexable):
         types = ["_widget_", "_mashup_", "_operator_"]
 
         self.prepared_data["type"] = types[object.type]
-        self.prepared_data["users"] = tuple(object.users.all().values_list('id', flat=True))
-        self.prepared_data["groups"] = tuple(object.groups.all().values_list('id', flat=True))
+        self.prepared_data["users"] = get_related_ids(object, 'users')
+        self.prepared_data["groups"] = get_related_ids(object, 'groups')
 
         self.prepared_data["version_sortable"] = buildVersionSortable(object.version)
         self.prepared_data['vendor_name'] = '%s/%s' % (object.vendor, object.short_name)
@@ -110,7 +122,7 @@ class ResourceIndex(indexes.SearchIndex, indexes.Indexable):
 def buildVersionSortable(version, length=5):
 
     code = 0
-    ver = Version(version)
+    ver = Version.parse(version)
 
     code += ver.version[0] * 1000 * 1000
     code += ver.version[1] * 1000 if len(ver.version) > 1 else 0
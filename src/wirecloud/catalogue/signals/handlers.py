@@ -17,11 +17,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.db.models.signals import pre_delete, post_save
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, pre_delete, pre_save, post_delete, post_save
 from django.dispatch import receiver
 
-from wirecloud.catalogue.models import CatalogueResource
+from wirecloud.catalogue.models import CatalogueResource, invalidate_availability, invalidate_public_resources
 from wirecloud.catalogue.utils import wgt_deployer
+from wirecloud.commons.utils.version import Version
+
+
+@receiver(pre_save, sender=CatalogueResource)
+def update_version_key(sender, instance, **kwargs):
+    # pre_save is also sent when loading fixtures
+    try:
+        instance.version_key = Version.parse(instance.version).get_sort_key()
+    except ValueError:
+        instance.version_key = ''
 
 
 @receiver(pre_delete, sender=CatalogueResource)
@@ -40,3 +51,55 @@ def delete_file_on_resource_deletion(sender, instance, **kwargs):
 def delete_files_on_resource_trahsing(sender, instance, created, raw, **kwargs):
     if not created and instance.template_uri == "":
         delete_file_on_resource_deletion(sender, instance)
+
+
+@receiver(post_save, sender=CatalogueResource)
+def invalidate_cache_on_resource_update(sender, instance, created, raw, **kwargs):
+    # Cached processed info is built from the json_description field
+    if not created:
+        instance.invalidate_cache()
+
+
+@receiver(post_save, sender=CatalogueResource)
+def invalidate_public_resources_on_resource_update(sender, instance, **kwargs):
+    invalidate_public_resources()
+
+
+@receiver(post_delete, sender=CatalogueResource)
+def invalidate_availability_on_resource_deletion(sender, instance, **kwargs):
+    invalidate_public_resources()
+    invalidate_availability()
+
+
+@receiver(m2m_changed, sender=CatalogueResource.users.through)
+def invalidate_availability_on_user_grant(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if reverse:
+        # instance is the user
+        invalidate_availability((instance.id,))
+    elif pk_set is None:
+        invalidate_availability()
+    else:
+        invalidate_availability(pk_set)
+
+
+@receiver(m2m_changed, sender=CatalogueResource.groups.through)
+def invalidate_availability_on_group_grant(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_availability()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_availability_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if not reverse:
+        # instance is the user
+        invalidate_availability((instance.id,))
+    elif pk_set is None:
+        invalidate_availability()
+    else:
+        invalidate_availability(pk_set)
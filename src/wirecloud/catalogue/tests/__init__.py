@@ -1,4 +1,4 @@
 from wirecloud.catalogue.tests.commands import AddToCatalogueCommandTestCase # noqa
-from wirecloud.catalogue.tests.tests import CatalogueAPITestCase, WGTDeploymentTestCase, CatalogueSearchTestCase, CatalogueMediaTestCase # noqa
+from wirecloud.catalogue.tests.tests import CatalogueAPITestCase, WGTDeploymentTestCase, CatalogueSearchTestCase, CatalogueMediaTestCase, CatalogueResourceTestCase # noqa
 from wirecloud.catalogue.tests.utils import CatalogueUtilsTestCase # noqa
 from wirecloud.catalogue.tests.selenium import * # noqa
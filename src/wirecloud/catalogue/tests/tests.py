@@ -24,7 +24,7 @@ import json
 import os
 from unittest.mock import MagicMock, Mock, patch
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, Group, User
 from django.http import Http404
 from django.test import Client, TestCase, TransactionTestCase
 from django.test.utils import override_settings
@@ -34,8 +34,9 @@ import wirecloud.catalogue.utils
 from wirecloud.catalogue.models import CatalogueResource
 from wirecloud.catalogue.utils import get_resource_data
 from wirecloud.catalogue.views import serve_catalogue_media
-from wirecloud.commons.utils.template import TemplateParseException
+from wirecloud.commons.utils.template import TemplateParseException, TemplateParser
 from wirecloud.commons.utils.testcases import uses_extra_resources, WirecloudTestCase
+from wirecloud.commons.utils.version import Version
 from wirecloud.commons.utils.wgt import InvalidContents
 
 
@@ -398,6 +399,27 @@ class CatalogueAPITestCase(WirecloudTestCase, TransactionTestCase):
         self.assertEqual(len(result_json['resources']), 1)
         self.assertEqual(result_json['resources'][0]['lastVersion'], '1.10')
 
+    def test_last_version_query_uses_a_single_query(self):
+
+        self.client.login(username='test', password='admin')
+        resources = json.dumps([
+            {'name': 'widget1', 'vendor': 'Test'},
+            {'name': 'widget2', 'vendor': 'Test'},
+            {'name': 'awidget', 'vendor': 'Test'},
+            {'name': 'inexistantwidget', 'vendor': 'Test'},
+        ])
+        url = reverse('wirecloud_catalogue.resource_versions')
+        # Warm up the session
+        self.client.get(reverse('wirecloud_catalogue.resource_collection'), HTTP_ACCEPT='application/json')
+
+        with self.assertNumQueries(2):
+            # session + latest versions
+            result = self.client.post(url, resources, **self.basic_request_meta)
+
+        self.assertEqual(result.status_code, 200)
+        result_json = json.loads(result.content.decode('utf-8'))
+        self.assertEqual(len(result_json['resources']), 3)
+
     @uses_extra_resources(('Wirecloud_Test_1.0.wgt',), shared=True, public=True)
     def test_resource_entry_get(self):
 
@@ -858,3 +880,155 @@ class CatalogueMediaTestCase(TestCase):
             self.assertEqual(response.status_code, 302)
             self.assertEqual(response['Location'], reverse('wirecloud_catalogue.media', kwargs={"vendor": 'Wirecloud', "name": 'Test', "version": '1.0', "file_path": 'manage.py'}))
             self.assertTrue(response['Location'].endswith('manage.py'))
+
+
+class CatalogueResourceTestCase(WirecloudTestCase, TestCase):
+
+    fixtures = ('catalogue_test_data',)
+    tags = ('wirecloud-catalogue', 'wirecloud-catalogue-noselenium', 'wirecloud-noselenium')
+    populate = False
+    use_search_indexes = False
+
+    def test_get_processed_info_is_cached(self):
+
+        resource = CatalogueResource.objects.get(pk=1)
+        with patch('wirecloud.catalogue.models.TemplateParser', wraps=TemplateParser) as parser_mock:
+            info1 = resource.get_processed_info()
+            info2 = CatalogueResource.objects.get(pk=1).get_processed_info()
+
+        self.assertEqual(parser_mock.call_count, 1)
+        self.assertEqual(info1, info2)
+
+    def test_get_processed_info_returns_copies(self):
+
+        resource = CatalogueResource.objects.get(pk=1)
+        info = resource.get_processed_info()
+        info['title'] = 'modified'
+
+        self.assertNotEqual(resource.get_processed_info()['title'], 'modified')
+
+    def test_get_processed_info_uses_options_as_cache_key(self):
+
+        resource = CatalogueResource.objects.get(pk=1)
+        with patch('wirecloud.catalogue.models.TemplateParser', wraps=TemplateParser) as parser_mock:
+            info = resource.get_processed_info(process_variables=True)
+            resource.get_processed_info(process_urls=False)
+
+        self.assertEqual(parser_mock.call_count, 2)
+        self.assertIn('variables', info)
+
+    def test_get_processed_info_invalidated_on_save(self):
+
+        resource = CatalogueResource.objects.get(pk=1)
+        resource.get_processed_info()
+
+        resource.json_description['title'] = 'New title'
+        resource.save()
+
+        self.assertEqual(CatalogueResource.objects.get(pk=1).get_processed_info()['title'], 'New title')
+
+    def test_is_available_for_uses_cached_grants(self):
+
+        user = User.objects.create_user('availability-user')
+        resource = CatalogueResource.objects.get(pk=1)
+        resource.public = False
+        resource.save()
+
+        self.assertFalse(resource.is_available_for(user))
+
+        resource.users.add(user)
+        self.assertTrue(resource.is_available_for(user))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(resource.is_available_for(user))
+
+        resource.users.remove(user)
+        self.assertFalse(resource.is_available_for(user))
+
+    def test_is_available_for_group_grants(self):
+
+        user = User.objects.create_user('availability-user')
+        group = Group.objects.create(name='availability-group')
+        resource = CatalogueResource.objects.get(pk=1)
+        resource.public = False
+        resource.save()
+
+        resource.groups.add(group)
+        self.assertFalse(resource.is_available_for(user))
+
+        user.groups.add(group)
+        self.assertTrue(resource.is_available_for(user))
+
+        group.user_set.remove(user)
+        self.assertFalse(resource.is_available_for(user))
+
+        group.user_set.add(user)
+        resource.groups.clear()
+        self.assertFalse(resource.is_available_for(user))
+
+    def test_get_available_ids(self):
+
+        user = User.objects.create_user('availability-user')
+        group = Group.objects.create(name='availability-group')
+        resource1 = CatalogueResource.objects.get(pk=1)
+        resource2 = CatalogueResource.objects.get(pk=2)
+        resources = [resource1, 2, 3, 1000]
+
+        # Fill the caches
+        self.assertEqual(CatalogueResource.objects.get_available_ids(user, resources), {1, 2, 3})
+
+        resource1.public = False
+        resource1.save()
+        self.assertEqual(CatalogueResource.objects.get_public_ids() & {1, 2, 3}, {2, 3})
+        self.assertEqual(CatalogueResource.objects.get_available_ids(user, resources), {2, 3})
+
+        resource2.public = False
+        resource2.save()
+        self.assertEqual(CatalogueResource.objects.get_available_ids(user, resources), {3})
+
+        resource2.users.add(user)
+        self.assertEqual(CatalogueResource.objects.get_granted_ids(user), {2})
+        self.assertEqual(CatalogueResource.objects.get_available_ids(user, resources), {2, 3})
+
+        resource1.groups.add(group)
+        self.assertEqual(CatalogueResource.objects.get_available_ids(user, resources), {2, 3})
+
+        group.user_set.add(user)
+        self.assertEqual(CatalogueResource.objects.get_granted_ids(user), {1, 2})
+        self.assertEqual(CatalogueResource.objects.get_available_ids(user, resources), {1, 2, 3})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(CatalogueResource.objects.get_available_ids(user, resources), {1, 2, 3})
+
+        anonymous = AnonymousUser()
+        self.assertEqual(CatalogueResource.objects.get_available_ids(anonymous, resources), {3})
+
+        resource1.public = True
+        resource1.save()
+        self.assertEqual(CatalogueResource.objects.get_available_ids(anonymous, resources), {1, 3})
+
+    def test_get_available_ids_resource_deletion(self):
+
+        user = User.objects.create_user('availability-user')
+        resource = CatalogueResource.objects.get(pk=1)
+        resource.users.add(user)
+        self.assertEqual(CatalogueResource.objects.get_available_ids(user, [1]), {1})
+
+        resource.delete()
+        self.assertEqual(CatalogueResource.objects.get_available_ids(user, [1]), set())
+
+    def test_get_latest_versions(self):
+
+        latest_versions = CatalogueResource.objects.get_latest_versions((('Test', 'widget1'), ('Test', 'widget2'), ('Test', 'inexistantwidget')))
+
+        self.assertEqual(set(latest_versions.keys()), {('Test', 'widget1'), ('Test', 'widget2')})
+        self.assertEqual(latest_versions[('Test', 'widget1')].version, '1.10')
+
+    def test_version_key_updated_on_save(self):
+
+        resource = CatalogueResource.objects.get(pk=1)
+        resource.version = '1.11a1'
+        resource.save()
+
+        self.assertEqual(CatalogueResource.objects.get(pk=1).version_key, Version('1.11a1').get_sort_key())
+        self.assertEqual(CatalogueResource.objects.get_latest_versions((('Test', 'widget1'),))[('Test', 'widget1')].version, '1.11a1')
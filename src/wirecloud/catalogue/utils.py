@@ -38,7 +38,6 @@ from wirecloud.commons.utils.downloader import download_http_content, download_l
 from wirecloud.commons.utils.html import clean_html
 from wirecloud.commons.utils.http import get_absolute_reverse_url, force_trailing_slash
 from wirecloud.commons.utils.template import ObsoleteFormatError, TemplateParser, TemplateFormatError, TemplateParseException
-from wirecloud.commons.utils.version import Version
 from wirecloud.commons.utils.wgt import InvalidContents, WgtDeployer, WgtFile
 
 
@@ -330,19 +329,7 @@ def get_resource_group_data(resources, user, request=None):
 
 def get_latest_resource_version(name, vendor):
 
-    resources = CatalogueResource.objects.filter(vendor=vendor, short_name=name)
-    if resources.count() > 0:
-        newest_version = Version(resources[0].version)
-        newest_resource = resources[0]
-        for resource in resources[1:]:
-            current_version = Version(resource.version)
-            if current_version > newest_version:
-                newest_version = current_version
-                newest_resource = resource
-
-        return newest_resource
-
-    return None
+    return CatalogueResource.objects.get_latest_versions(((vendor, name),)).get((vendor, name))
 
 
 def update_resource_catalogue_cache(orm=None):
@@ -37,7 +37,7 @@ import markdown
 
 from wirecloud.catalogue.models import CatalogueResource
 import wirecloud.catalogue.utils as catalogue_utils
-from wirecloud.catalogue.utils import get_latest_resource_version, get_resource_data, get_resource_group_data
+from wirecloud.catalogue.utils import get_resource_data, get_resource_group_data
 from wirecloud.commons.utils.downloader import download_local_file
 from wirecloud.commons.utils.wgt import InvalidContents, WgtFile
 from wirecloud.commons.baseviews import Resource
@@ -55,7 +55,8 @@ def serve_catalogue_media(request, vendor, name, version, file_path):
 
     base_dir = catalogue_utils.wgt_deployer.get_base_dir(vendor, name, version)
 
-    response = build_downloadfile_response(request, file_path, base_dir)
+    # -dev versions can be redeployed using the same version
+    response = build_downloadfile_response(request, file_path, base_dir, immutable='-dev' not in version)
     if response.status_code == 302:
         response['Location'] = reverse('wirecloud_catalogue.media', kwargs={"vendor": vendor, "name": name, "version": version, "file_path": response['Location']})
 
@@ -214,9 +215,11 @@ class ResourceVersionCollection(Resource):
 
         resources = parse_json_request(request)
 
+        latest_versions = CatalogueResource.objects.get_latest_versions((g["vendor"], g["name"]) for g in resources)
+
         result = []
         for g in resources:
-            latest_resource_version = get_latest_resource_version(g["name"], g["vendor"])
+            latest_resource_version = latest_versions.get((g["vendor"], g["name"]))
             if latest_resource_version:
                 # the resource is still in the catalogue
                 g["lastVersion"] = latest_resource_version.version
@@ -235,7 +238,7 @@ class ResourceChangelogEntry(Resource):
         from_version = request.GET.get('from')
         if from_version is not None:
             try:
-                from_version = Version(from_version)
+                from_version = Version.parse(from_version)
             except ValueError:
                 return build_error_response(request, 422, _("Missing parameter: template_uri or file"))
 
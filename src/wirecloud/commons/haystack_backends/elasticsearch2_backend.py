@@ -65,7 +65,12 @@ class GroupedSearchQuery(Elasticsearch2SearchQuery):
                         "aggs": {
                             "items": {"top_hits": {"size": 5}},
                         }
-                    }
+                    },
+                    # Number of groups, so they can be counted without
+                    # running the query again
+                    "total_groups": {
+                        "cardinality": {"field": self.grouping_field},
+                    },
                 },
                 "result_class": GroupedSearchResult
             }
@@ -223,8 +228,11 @@ class GroupedElasticsearch2SearchBackend(Elasticsearch2SearchBackend):
             return res
 
         res["matches"] = raw_results["hits"]["total"]
-        groups = raw_results["aggregations"]["items"]["buckets"][self.start_offset:]
-        res["hits"] = len(groups)
+        groups = raw_results["aggregations"]["items"]["buckets"][self.start_offset:self.end_offset]
+        if "total_groups" in raw_results["aggregations"]:
+            res["hits"] = raw_results["aggregations"]["total_groups"]["value"]
+        else:
+            res["hits"] = len(groups)
 
         for group in groups:
             results.append(result_class(group))
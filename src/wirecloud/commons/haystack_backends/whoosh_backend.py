@@ -4,6 +4,8 @@
 # See https://gist.github.com/3750774 for the current version of this code
 # See http://wiki.apache.org/Whoosh/FieldCollapsing for the Whoosh feature documentation
 
+from contextlib import contextmanager
+import threading
 import warnings
 
 from django.conf import settings
@@ -15,9 +17,137 @@ from haystack.models import SearchResult
 from haystack.query import SearchQuerySet
 from haystack.utils import get_model_ct
 from haystack.utils.app_loading import haystack_get_model
+from whoosh.index import TOC
 from whoosh.query import And, Or, Term
 from whoosh.sorting import FieldFacet
 
+from wirecloud.commons.utils.cache import LRUCache
+
+
+class SearcherPool(object):
+    """
+    Thread-safe pool of Whoosh searchers. Searchers are reused between
+    searches until the index is updated, avoiding reopening the index
+    segments on each search. The document sets matching the narrow queries
+    are also cached for each version of the index.
+    """
+
+    def __init__(self, max_idle=8, max_filters=100):
+
+        self.max_idle = max_idle
+        self.max_filters = max_filters
+
+        self._lock = threading.Lock()
+        self._version = None
+        self._idle = []
+        self._filters = LRUCache(max_filters)
+
+    def get_version(self, searcher):
+        """
+        Returns the version of the index used by a searcher. The modification
+        time of the TOC file is taken into account, as generation numbers
+        start again from zero when the index is recreated.
+        """
+
+        generation = searcher.reader().generation()
+        try:
+            modified = searcher._ix.storage.file_modified(TOC._filename(searcher._ix.indexname, generation))
+        except Exception:
+            # The TOC file has been replaced, this searcher is outdated
+            return None
+
+        return (generation, modified)
+
+    def acquire(self, index):
+
+        searcher = None
+        with self._lock:
+            while len(self._idle) > 0:
+                candidate = self._idle.pop()
+                if candidate.up_to_date():
+                    searcher = candidate
+                    break
+
+                candidate.close()
+
+        if searcher is None:
+            searcher = index.searcher()
+
+        version = self.get_version(searcher)
+        with self._lock:
+            if version != self._version and version is not None:
+                # The index has been updated, discard the old searchers
+                self._version = version
+                for candidate in self._idle:
+                    candidate.close()
+                self._idle = []
+                self._filters.clear()
+
+        return searcher, version
+
+    def release(self, searcher, version):
+
+        with self._lock:
+            if version is not None and version == self._version and len(self._idle) < self.max_idle:
+                self._idle.append(searcher)
+                return
+
+        searcher.close()
+
+    @contextmanager
+    def searcher(self, index):
+
+        searcher, version = self.acquire(index)
+        try:
+            yield searcher, version
+        finally:
+            self.release(searcher, version)
+
+    def get_filter(self, searcher, version, query_string, parse):
+        """
+        Returns the set of document numbers matching a narrow query.
+        """
+
+        key = (version, query_string)
+        docs = self._filters.get(key) if version is not None else None
+        if docs is None:
+            docs = set(searcher.docs_for_query(parse(query_string)))
+
+            with self._lock:
+                if version is not None and version == self._version:
+                    self._filters.set(key, docs)
+
+        return docs
+
+    def clear(self):
+
+        with self._lock:
+            for searcher in self._idle:
+                searcher.close()
+            self._version = None
+            self._idle = []
+            self._filters.clear()
+
+
+_searcher_pools = {}
+_searcher_pools_lock = threading.Lock()
+
+
+def get_searcher_pool(backend):
+    """
+    Returns the searcher pool to use for the index of a backend. Haystack
+    creates a backend instance per thread, so pools are shared through the
+    storage of the index.
+    """
+
+    key = backend.path if backend.use_file_storage else id(backend.storage)
+    with _searcher_pools_lock:
+        pool = _searcher_pools.get(key)
+        if pool is None:
+            pool = _searcher_pools[key] = SearcherPool()
+
+    return pool
+
 
 class GroupedSearchQuery(WhooshSearchQuery):
 
@@ -37,12 +167,6 @@ class GroupedSearchQuery(WhooshSearchQuery):
         self.grouping_field = field_name
         self.group_order_by = order_by
 
-    def get_count(self):
-        if self.grouping_field is not None:
-            return len(self.get_results())
-        else:
-            return super(GroupedSearchQuery, self).get_count()
-
     def get_total_document_count(self):
         """Return the total number of matching documents rather than document groups
         If the query has not been run, this will execute the query and store the results.
@@ -200,9 +324,6 @@ class GroupedWhooshSearchBackend(WhooshSearchBackend):
         if query_facets is not None:
             warnings.warn("Whoosh does not handle query faceting.", Warning, stacklevel=2)
 
-        narrowed_results = None
-        self.index = self.index.refresh()
-
         if limit_to_registered_models is None:
             limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
 
@@ -215,121 +336,132 @@ class GroupedWhooshSearchBackend(WhooshSearchBackend):
         else:
             model_choices = []
 
-        narrow_searcher = None
+        pool = get_searcher_pool(self)
+        with pool.searcher(self.index) as (searcher, version):
+            narrowed_results = None
 
-        if narrow_queries is not None:
-            # Potentially expensive? I don't see another way to do it in Whoosh...
-            narrow_searcher = self.index.searcher()
+            if narrow_queries is not None:
+                for nq in narrow_queries:
+                    recent_narrowed_results = pool.get_filter(searcher, version, force_text(nq), self.parser.parse)
 
-            for nq in narrow_queries:
-                recent_narrowed_results = narrow_searcher.search(self.parser.parse(force_text(nq)),
-                                                                 limit=None)
+                    if narrowed_results is None:
+                        narrowed_results = recent_narrowed_results
+                    else:
+                        narrowed_results = narrowed_results & recent_narrowed_results
 
-                if len(recent_narrowed_results) <= 0:
-                    return {
-                        'results': [],
-                        'hits': 0,
-                    }
+                    if len(narrowed_results) == 0:
+                        return {
+                            'results': [],
+                            'hits': 0,
+                        }
 
-                if narrowed_results:
-                    narrowed_results.filter(recent_narrowed_results)
-                else:
-                    narrowed_results = recent_narrowed_results
+            if searcher.doc_count():
+                return self._search(searcher, query_string, model_choices, narrowed_results, sort_by, reverse, start_offset, end_offset, result_class, **kwargs)
 
-        self.index = self.index.refresh()
+        if self.include_spelling:
+            if spelling_query:
+                spelling_suggestion = self.create_spelling_suggestion(spelling_query)
+            else:
+                spelling_suggestion = self.create_spelling_suggestion(query_string)
+        else:
+            spelling_suggestion = None
 
-        if self.index.doc_count():
-            parsed_query = self.parser.parse(query_string)
-            if len(model_choices) > 0:
-                narrow_model = [Term(DJANGO_CT, rm) for rm in model_choices]
-                parsed_query = And([Or(narrow_model), parsed_query])
+        return {
+            'results': [],
+            'hits': 0,
+            'spelling_suggestion': spelling_suggestion,
+        }
 
-            searcher = self.index.searcher()
+    def _search(self, searcher, query_string, model_choices, narrowed_results, sort_by, reverse, start_offset, end_offset, result_class, **kwargs):
 
-            # In the event of an invalid/stopworded query, recover gracefully.
-            if parsed_query is None:
-                return {
-                    'results': [],
-                    'hits': 0,
-                }
+        parsed_query = self.parser.parse(query_string)
+        if len(model_choices) > 0:
+            narrow_model = [Term(DJANGO_CT, rm) for rm in model_choices]
+            parsed_query = And([Or(narrow_model), parsed_query])
 
-            page_num, page_length = self.calculate_page(start_offset, end_offset)
+        # In the event of an invalid/stopworded query, recover gracefully.
+        if parsed_query is None:
+            return {
+                'results': [],
+                'hits': 0,
+            }
 
-            collapse_field = kwargs.get("collapse")
-            collapse_limit = kwargs.get("collapse_limit")
+        page_num, page_length = self.calculate_page(start_offset, end_offset)
 
-            search_kwargs = {
-                'pagelen': page_length,
-                'sortedby': sort_by,
-                'reverse': reverse
-            }
+        collapse_field = kwargs.get("collapse")
+        collapse_limit = kwargs.get("collapse_limit")
 
-            if collapse_field is not None:
-                search_kwargs['collapse'] = FieldFacet(collapse_field)
-                search_kwargs['collapse_limit'] = 1
+        search_kwargs = {
+            'pagelen': page_length,
+            'sortedby': sort_by,
+            'reverse': reverse
+        }
 
-                if kwargs.get("collapse_order") is not None:
-                    order = kwargs.get("collapse_order")
-                    collapse_order = FieldFacet(order.replace('-', ''), reverse=order.find('-') > -1)
-                    search_kwargs['collapse_order'] = collapse_order
+        if collapse_field is not None:
+            search_kwargs['collapse'] = FieldFacet(collapse_field)
+            search_kwargs['collapse_limit'] = 1
 
-            # Handle the case where the results have been narrowed.
-            if narrowed_results is not None:
-                search_kwargs['filter'] = narrowed_results
+            if kwargs.get("collapse_order") is not None:
+                order = kwargs.get("collapse_order")
+                collapse_order = FieldFacet(order.replace('-', ''), reverse=order.find('-') > -1)
+                search_kwargs['collapse_order'] = collapse_order
 
-            try:
-                raw_page = searcher.search_page(parsed_query, page_num, **search_kwargs)
-            except ValueError:
-                if not self.silently_fail:
-                    raise
-
-                return {
-                    'results': [],
-                    'hits': 0,
-                    'spelling_suggestion': None,
-                }
-
-            # Because as of Whoosh 2.5.1, it will return the wrong page of
-            # results if you request something too high. :(
-            grouped_results = None
-            if raw_page.pagenum < page_num:
-                return {
-                    'results': [],
-                    'hits': 0,
-                    'spelling_suggestion': None,
-                }
-            if collapse_field is not None and collapse_limit > 1:
-                search_kwargs = {
-                    'sortedby': collapse_order
-                }
-                grouped_results = []
-                for result in raw_page:
-                    query = And([Term(collapse_field, result[collapse_field]), parsed_query])
-                    results = searcher.search(query, limit=collapse_limit, **search_kwargs)
-
-                    grouped_results.append(results)
-
-            results = self._process_results(raw_page, result_class=result_class, collapse_field=collapse_field, grouped_results=grouped_results)
-            searcher.close()
-
-            if hasattr(narrow_searcher, 'close'):
-                narrow_searcher.close()
-
-            return results
-        else:
-            if self.include_spelling:
-                if spelling_query:
-                    spelling_suggestion = self.create_spelling_suggestion(spelling_query)
-                else:
-                    spelling_suggestion = self.create_spelling_suggestion(query_string)
+        # Handle the case where the results have been narrowed.
+        if narrowed_results is not None:
+            search_kwargs['filter'] = narrowed_results
+
+        try:
+            if collapse_field is not None:
+                # Collect all the groups in a single pass, so they can be
+                # counted without running the query again. Only the
+                # groups of the requested page are expanded
+                del search_kwargs['pagelen']
+                raw_results = searcher.search(parsed_query, limit=None, **search_kwargs)
+                total_groups = raw_results.scored_length()
+                raw_page = raw_results[start_offset:end_offset]
             else:
-                spelling_suggestion = None
+                total_groups = None
+                raw_page = searcher.search_page(parsed_query, page_num, **search_kwargs)
+        except ValueError:
+            if not self.silently_fail:
+                raise
+
+            return {
+                'results': [],
+                'hits': 0,
+                'spelling_suggestion': None,
+            }
 
+        # Because as of Whoosh 2.5.1, it will return the wrong page of
+        # results if you request something too high. :(
+        grouped_results = None
+        if collapse_field is None and raw_page.pagenum < page_num:
             return {
                 'results': [],
                 'hits': 0,
-                'spelling_suggestion': spelling_suggestion,
+                'spelling_suggestion': None,
+            }
+        if collapse_field is not None and collapse_limit > 1:
+            search_kwargs = {
+                'sortedby': collapse_order,
+                'filter': narrowed_results,
             }
+            grouped_results = []
+            for result in raw_page:
+                query = And([Term(collapse_field, result[collapse_field]), parsed_query])
+                results = searcher.search(query, limit=collapse_limit, **search_kwargs)
+
+                grouped_results.append(results)
+
+        return self._process_results(raw_page, result_class=result_class, collapse_field=collapse_field, grouped_results=grouped_results, total_groups=total_groups)
+
+    def clear(self, *args, **kwargs):
+        super(GroupedWhooshSearchBackend, self).clear(*args, **kwargs)
+        get_searcher_pool(self).clear()
+
+    def delete_index(self):
+        super(GroupedWhooshSearchBackend, self).delete_index()
+        get_searcher_pool(self).clear()
 
     def build_schema(self, fields):
 
@@ -349,7 +481,7 @@ class GroupedWhooshSearchBackend(WhooshSearchBackend):
 
         return res
 
-    def _process_results(self, raw_results, result_class=None, collapse_field=None, grouped_results=None, **kwargs):
+    def _process_results(self, raw_results, result_class=None, collapse_field=None, grouped_results=None, total_groups=None, **kwargs):
         if GroupedSearchResult is not result_class:
             return super(GroupedWhooshSearchBackend, self)._process_results(raw_results, result_class=result_class, **kwargs)
 
@@ -363,7 +495,8 @@ class GroupedWhooshSearchBackend(WhooshSearchBackend):
             matches += len(group)
             results.append(result_class(collapse_field, group))
 
-        res["hits"] = hits
+        # hits is the total number of groups, not only the ones on this page
+        res["hits"] = hits if total_groups is None else total_groups
         res['matches'] = matches
         return res
 
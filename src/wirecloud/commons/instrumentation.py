@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import connections
+
+
+logger = logging.getLogger('wirecloud.instrumentation')
+
+DEFAULT_INSTRUMENTATION_OPTIONS = {
+    'ENABLED': False,
+    'SERVER_TIMING': None,
+    'BUDGETS': {},
+    'ENDPOINT_BUDGETS': {},
+    'MAX_ENDPOINTS': 200,
+}
+
+# Measures supported by the budgets:
+# - time: wall time spent processing the request (in seconds)
+# - queries: number of database queries
+# - query_time: time spent running database queries (in seconds)
+# - size: response size (in bytes)
+BUDGET_MEASURES = ('time', 'queries', 'query_time', 'size')
+
+OTHER_ENDPOINTS_LABEL = '_other'
+UNRESOLVED_ENDPOINT_LABEL = '_unresolved'
+
+_MISSING = object()
+
+
+class InstrumentedCache(object):
+    """
+    Wraps a cache backend counting the hits and misses of the read
+    operations made through it. Any other operation is delegated to the
+    wrapped cache.
+    """
+
+    def __init__(self, cache, request_stats):
+
+        self._cache = cache
+        self._request_stats = request_stats
+
+    def get(self, key, default=None, version=None):
+
+        value = self._cache.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._request_stats.cache_misses += 1
+            return default
+
+        self._request_stats.cache_hits += 1
+        return value
+
+    def get_many(self, keys, version=None):
+
+        keys = list(keys)
+        values = self._cache.get_many(keys, version=version)
+        self._request_stats.cache_hits += len(values)
+        self._request_stats.cache_misses += len(keys) - len(values)
+        return values
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+
+        value = self.get(key, version=version)
+        if value is None:
+            value = self._cache.get_or_set(key, default, timeout=timeout, version=version)
+        return value
+
+    def has_key(self, key, version=None):
+
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def __contains__(self, key):
+
+        return self.has_key(key)
+
+    def __getattr__(self, name):
+
+        return getattr(self._cache, name)
+
+
+# RequestStats installed on each thread, used for cleaning up the ones of
+# requests not finished properly (e.g. if process_response was not called)
+_installed = threading.local()
+
+
+class RequestStats(object):
+    """
+    Measures of a request being processed.
+    """
+
+    def __init__(self):
+
+        self.start = time.perf_counter()
+        self.time = None
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.size = 0
+        self._connections = ()
+        self._cache = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper (see Connection.execute_wrapper)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+    def install(self):
+
+        leftover = getattr(_installed, 'request_stats', None)
+        if leftover is not None:
+            leftover.uninstall()
+        _installed.request_stats = self
+
+        self._connections = tuple(connections[alias] for alias in connections)
+        for connection in self._connections:
+            connection.execute_wrappers.append(self)
+
+        # django.core.cache.caches stores a cache instance per thread, so
+        # wrapping it only affects to the current request
+        self._cache = caches[DEFAULT_CACHE_ALIAS]
+        caches._caches.caches[DEFAULT_CACHE_ALIAS] = InstrumentedCache(self._cache, self)
+
+    def uninstall(self):
+
+        for connection in self._connections:
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+        self._connections = ()
+
+        if self._cache is not None and isinstance(caches._caches.caches.get(DEFAULT_CACHE_ALIAS), InstrumentedCache):
+            caches._caches.caches[DEFAULT_CACHE_ALIAS] = self._cache
+        self._cache = None
+
+        if getattr(_installed, 'request_stats', None) is self:
+            _installed.request_stats = None
+
+    def finish(self, response):
+
+        self.uninstall()
+        self.time = time.perf_counter() - self.start
+
+        if getattr(response, 'streaming', False) is True:
+            self.size = int(response.get('Content-Length', 0))
+        else:
+            self.size = len(response.content)
+
+    def to_dict(self):
+
+        return {
+            'time': round(self.time, 6),
+            'queries': self.queries,
+            'query_time': round(self.query_time, 6),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'size': self.size,
+        }
+
+    def get_server_timing(self):
+
+        return ', '.join((
+            'app;dur=%.1f' % (self.time * 1000),
+            'db;dur=%.1f;desc="%d queries"' % (self.query_time * 1000, self.queries),
+            'cache;desc="%d hits, %d misses"' % (self.cache_hits, self.cache_misses),
+        ))
+
+
+class EndpointStats(object):
+
+    __slots__ = ('count', 'time', 'max_time', 'queries', 'max_queries', 'query_time', 'cache_hits', 'cache_misses', 'size', 'max_size', 'over_budget')
+
+    def __init__(self):
+
+        self.count = 0
+        self.time = 0.0
+        self.max_time = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.size = 0
+        self.max_size = 0
+        self.over_budget = 0
+
+    def add(self, request_stats, over_budget):
+
+        self.count += 1
+        self.time += request_stats.time
+        self.max_time = max(self.max_time, request_stats.time)
+        self.queries += request_stats.queries
+        self.max_queries = max(self.max_queries, request_stats.queries)
+        self.query_time += request_stats.query_time
+        self.cache_hits += request_stats.cache_hits
+        self.cache_misses += request_stats.cache_misses
+        self.size += request_stats.size
+        self.max_size = max(self.max_size, request_stats.size)
+        if over_budget:
+            self.over_budget += 1
+
+    def to_dict(self):
+
+        return {
+            'count': self.count,
+            'avg_time': round(self.time / self.count, 6),
+            'max_time': round(self.max_time, 6),
+            'avg_queries': round(self.queries / self.count, 2),
+            'max_queries': self.max_queries,
+            'avg_query_time': round(self.query_time / self.count, 6),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'avg_size': round(self.size / self.count),
+            'max_size': self.max_size,
+            'over_budget': self.over_budget,
+        }
+
+
+class Instrumentation(object):
+    """
+    Per-process collector of the measures of the requests processed by the
+    InstrumentationMiddleware.
+    """
+
+    def __init__(self, enabled=False, server_timing=False, budgets={}, endpoint_budgets={}, max_endpoints=200):
+
+        self.enabled = enabled
+        self.server_timing = server_timing
+        self.budgets = budgets
+        self.endpoint_budgets = endpoint_budgets
+        self.max_endpoints = max_endpoints
+
+        self._lock = threading.Lock()
+        self.clear()
+
+    @classmethod
+    def from_settings(cls):
+
+        options = dict(DEFAULT_INSTRUMENTATION_OPTIONS)
+        options.update(getattr(settings, 'WIRECLOUD_INSTRUMENTATION', {}))
+
+        server_timing = options['SERVER_TIMING']
+        if server_timing is None:
+            server_timing = settings.DEBUG
+
+        return cls(
+            enabled=options['ENABLED'],
+            server_timing=server_timing,
+            budgets=options['BUDGETS'],
+            endpoint_budgets=options['ENDPOINT_BUDGETS'],
+            max_endpoints=options['MAX_ENDPOINTS'],
+        )
+
+    def clear(self):
+
+        with self._lock:
+            self._endpoints = {}
+
+    def get_budget(self, endpoint):
+
+        budget = dict(self.budgets)
+        budget.update(self.endpoint_budgets.get(endpoint, {}))
+        return budget
+
+    def check_budget(self, endpoint, request_stats):
+        """
+        Logs the measures of the request exceeding the configured budgets.
+        Returns True if any budget was exceeded.
+        """
+
+        budget = self.get_budget(endpoint)
+        offenders = [measure for measure in BUDGET_MEASURES if budget.get(measure) is not None and getattr(request_stats, measure) > budget[measure]]
+        if len(offenders) > 0:
+            logger.warning('%s exceeded its budget (%s): %s', endpoint, ', '.join('%s > %s' % (measure, budget[measure]) for measure in offenders), request_stats.to_dict())
+
+        return len(offenders) > 0
+
+    def record(self, endpoint, request_stats):
+
+        over_budget = self.check_budget(endpoint, request_stats)
+
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                if len(self._endpoints) >= self.max_endpoints:
+                    endpoint = OTHER_ENDPOINTS_LABEL
+                stats = self._endpoints.setdefault(endpoint, EndpointStats())
+            stats.add(request_stats, over_budget)
+
+    def get_stats(self):
+
+        with self._lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self._endpoints.items()}
+
+
+def get_endpoint_name(request):
+
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return '%s %s' % (request.method, UNRESOLVED_ENDPOINT_LABEL)
+
+    return '%s %s' % (request.method, resolver_match.view_name)
+
+
+_instrumentation = None
+
+
+def get_instrumentation():
+
+    global _instrumentation
+
+    if _instrumentation is None:
+        _instrumentation = Instrumentation.from_settings()
+
+    return _instrumentation
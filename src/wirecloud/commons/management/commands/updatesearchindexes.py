@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import json
+import os
+import time
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections as db_connections, models
+from haystack import connections
+from haystack.constants import DEFAULT_ALIAS
+from haystack.exceptions import SkipDocument
+from haystack.query import SearchQuerySet
+from haystack.utils import get_model_ct
+
+from wirecloud.commons.search_indexes import invalidate_search_results
+
+
+# Number of indexed documents read on each request while looking for the
+# documents of removed instances
+REMOVAL_BATCH_SIZE = 1000
+
+
+class PreparedDocumentIndex(object):
+    """
+    Wraps a search index for writing documents already prepared by the
+    workers through the update method of the search backends.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def full_prepare(self, document):
+        return document
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+
+def init_worker():
+
+    # Required when the worker processes are spawned instead of forked
+    django.setup()
+
+
+def prepare_documents(using, model_label, pks):
+
+    model = apps.get_model(model_label)
+    index = connections[using].get_unified_index().get_index(model)
+
+    documents = []
+    for instance in index.index_queryset(using=using).filter(pk__in=pks):
+        try:
+            documents.append(index.full_prepare(instance))
+        except SkipDocument:
+            pass
+
+    return documents
+
+
+def build_watermark_filter(model, field_name, timestamp):
+
+    field = model._meta.get_field(field_name)
+    if isinstance(field, models.DateTimeField):
+        value = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        if not settings.USE_TZ:
+            value = value.astimezone().replace(tzinfo=None)
+    else:
+        # WireCloud stores dates as milliseconds since epoch
+        value = int(timestamp * 1000)
+
+    return models.Q(**{'%s__gte' % field_name: value})
+
+
+class Command(BaseCommand):
+
+    help = 'Updates the search indexes used by WireCloud'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--using',
+            action='store',
+            dest='using',
+            default=DEFAULT_ALIAS,
+            help='Search connection to update'
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            dest='clear',
+            help='Remove all the documents from the search indexes before updating them'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store',
+            dest='incremental',
+            metavar='FILE',
+            default=None,
+            help='Only index the instances modified since the previous run. The time of each run is stored on the given file'
+        )
+        parser.add_argument(
+            '-b', '--batch-size',
+            action='store',
+            dest='batch_size',
+            type=int,
+            default=500,
+            help='Number of instances to process on each batch'
+        )
+        parser.add_argument(
+            '-w', '--workers',
+            action='store',
+            dest='workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of processes used for preparing the documents to index'
+        )
+
+    def handle(self, *args, **options):
+
+        self.verbosity = int(options.get('verbosity', 1))
+        self.using = options['using']
+        batch_size = options['batch_size']
+        workers = options['workers']
+        watermarks_file = options['incremental']
+
+        if options['clear'] and watermarks_file is not None:
+            raise CommandError('--clear and --incremental options cannot be used together')
+
+        if batch_size < 1 or workers < 1:
+            raise CommandError('--batch-size and --workers must be positive numbers')
+
+        watermarks = self.read_watermarks(watermarks_file) if watermarks_file is not None else {}
+        start = time.time()
+
+        backend = connections[self.using].get_backend()
+        unified_index = connections[self.using].get_unified_index()
+
+        if options['clear']:
+            self.log('Removing all documents from the search indexes')
+            backend.clear(commit=True)
+
+        # Collect the ids of the instances to index before starting the
+        # worker processes, so they don't inherit open database connections
+        batches = []
+        for model in sorted(unified_index.get_indexed_models(), key=lambda model: model._meta.label):
+            index = unified_index.get_index(model)
+            queryset = index.index_queryset(using=self.using)
+
+            if watermarks_file is not None:
+                removed = self.remove_deleted_documents(backend, model, queryset)
+                self.log('Removed %d deleted %s' % (removed, model._meta.verbose_name_plural), level=2)
+
+            since = watermarks.get(self.get_watermark_key(model))
+            watermark_field = getattr(index, 'watermark_field', None)
+            if since is not None and watermark_field is not None:
+                queryset = queryset.filter(build_watermark_filter(model, watermark_field, since))
+
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+            self.log('Indexing %d %s' % (len(pks), model._meta.verbose_name_plural), level=2)
+            batches += [(model, pks[i:i + batch_size]) for i in range(0, len(pks), batch_size)]
+
+        if workers > 1 and len(batches) > 1:
+            db_connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+                total = self.write_documents(backend, unified_index, batches, self.prepare_in_parallel(executor, workers, batches))
+        else:
+            results = (prepare_documents(self.using, model._meta.label, pks) for model, pks in batches)
+            total = self.write_documents(backend, unified_index, batches, results)
+
+        invalidate_search_results()
+
+        if watermarks_file is not None:
+            for model in unified_index.get_indexed_models():
+                watermarks[self.get_watermark_key(model)] = start
+            self.write_watermarks(watermarks_file, watermarks)
+
+        self.log('%d documents indexed' % total)
+
+    def remove_deleted_documents(self, backend, model, queryset):
+        """
+        Removes the documents of the instances that are not available anymore
+        on the database. Indexed documents are retrieved in batches and their
+        ids are checked against the database batch by batch.
+        """
+
+        results = SearchQuerySet(using=self.using).models(model)
+        pk_field = model._meta.pk
+
+        deleted_ids = []
+        total = results.count()
+        for start in range(0, total, REMOVAL_BATCH_SIZE):
+            indexed_ids = set(result.pk for result in results[start:start + REMOVAL_BATCH_SIZE])
+            existing_ids = set(str(pk) for pk in queryset.filter(pk__in=[pk_field.to_python(pk) for pk in indexed_ids]).values_list('pk', flat=True))
+            deleted_ids += sorted(indexed_ids - existing_ids)
+
+        # Documents are removed once all the batches have been read, so the
+        # offsets used for reading them are not affected
+        for pk in deleted_ids:
+            backend.remove('%s.%s' % (get_model_ct(model), pk))
+
+        return len(deleted_ids)
+
+    def prepare_in_parallel(self, executor, workers, batches):
+        """
+        Prepares the documents of each batch using the worker processes,
+        yielding them in order. The number of batches waiting to be written
+        is limited to keep memory usage bounded.
+        """
+
+        pending = deque()
+        for model, pks in batches:
+            pending.append(executor.submit(prepare_documents, self.using, model._meta.label, pks))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+    def write_documents(self, backend, unified_index, batches, results):
+
+        total = 0
+        for (model, pks), documents in zip(batches, results):
+            if len(documents) > 0:
+                backend.update(PreparedDocumentIndex(unified_index.get_index(model)), documents)
+            total += len(documents)
+
+        return total
+
+    def get_watermark_key(self, model):
+        return '%s/%s' % (self.using, model._meta.label)
+
+    def read_watermarks(self, path):
+
+        if not os.path.exists(path):
+            return {}
+
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            raise CommandError('Error reading %s: %s' % (path, e))
+
+    def write_watermarks(self, path, watermarks):
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(watermarks, f, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def log(self, msg, level=1):
+        """
+        Small log helper
+        """
+        if self.verbosity >= level:
+            self.stdout.write(msg)
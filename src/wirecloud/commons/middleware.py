@@ -19,25 +19,44 @@
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
 from importlib import import_module
+import re
+import threading
 
 from django.contrib.auth.middleware import get_user
-from django.urls import reverse
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import get_script_prefix, reverse
 from django.utils import translation
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.functional import SimpleLazyObject
 from django.utils.translation import ugettext as _
 
 from wirecloud.commons.exceptions import HttpBadCredentials
+from wirecloud.commons.instrumentation import get_endpoint_name, get_instrumentation, RequestStats
 
 
 class URLMiddleware(MiddlewareMixin):
 
     _middleware = None
     _path_mapping = None
+    _path_regex = None
+    _path_groups = None
 
     def __init__(self, get_response=None):
         self.get_response = get_response
         self._middleware = {}
+        self._lock = threading.Lock()
+
+        # Instances created by the Django request handlers load all the
+        # middleware groups at startup
+        if get_response is not None:
+            self.initialize()
+
+    def initialize(self):
+        from django.conf import settings
+
+        self.compile_path_mapping()
+        for group in set(settings.URL_MIDDLEWARE_CLASSES) | {'default'}:
+            self.get_group_middleware(group)
 
     def load_middleware(self, group):
         """
@@ -53,7 +72,7 @@ class URLMiddleware(MiddlewareMixin):
             'process_response': [],
             'process_exception': [],
         }
-        for middleware_path in settings.URL_MIDDLEWARE_CLASSES[group]:
+        for middleware_path in settings.URL_MIDDLEWARE_CLASSES.get(group, ()):
             try:
                 mw_module, mw_classname = middleware_path.rsplit('.', 1)
             except ValueError:
@@ -88,65 +107,142 @@ class URLMiddleware(MiddlewareMixin):
         # as a flag for initialization being complete.
         self._middleware[group] = middleware
 
-    def get_matched_middleware(self, path, middleware_method):
+    def get_group_middleware(self, group):
+
+        middleware = self._middleware.get(group)
+        if middleware is None:
+            with self._lock:
+                if group not in self._middleware:
+                    self.load_middleware(group)
+            middleware = self._middleware[group]
+
+        return middleware
+
+    def compile_path_mapping(self):
+        """
+        Builds a regular expression matching the path prefixes of all the
+        URL groups at once.
+        """
 
-        if self._path_mapping is None:
+        with self._lock:
+            if self._path_regex is not None:
+                return
 
             from django.conf import settings
 
-            self._path_mapping = {
+            path_mapping = {
                 '/api/': 'api'
             }
 
             if 'wirecloud.platform' in settings.INSTALLED_APPS:
-                proxy_path = reverse('wirecloud|proxy', kwargs={'protocol': 'a', 'domain': 'a', 'path': ''})[:-len('a/a')]
-                self._path_mapping[proxy_path] = 'proxy'
+                # Prefixes are matched against request.path_info, so the
+                # script prefix is not included
+                proxy_path = reverse('wirecloud|proxy', kwargs={'protocol': 'a', 'domain': 'a', 'path': ''})[len(get_script_prefix()) - 1:-len('a/a')]
+                path_mapping[proxy_path] = 'proxy'
+
+            # Longest prefixes first, so nested prefixes are matched correctly
+            prefixes = sorted(path_mapping, key=len, reverse=True)
+            self._path_mapping = path_mapping
+            self._path_groups = tuple(path_mapping[prefix] for prefix in prefixes)
+            self._path_regex = re.compile('|'.join('(%s)' % re.escape(prefix) for prefix in prefixes))
+
+    def get_group(self, path):
+
+        if self._path_regex is None:
+            self.compile_path_mapping()
+
+        match = self._path_regex.match(path)
+        return self._path_groups[match.lastindex - 1] if match is not None else 'default'
+
+    def get_request_middleware(self, request):
+        """
+        Returns the middleware dispatch table to use for the given request.
+        The table is resolved once per request and stored on it.
+        """
+
+        middleware = request.__dict__.get('_url_middleware')
+        if middleware is None:
+            middleware = self.get_group_middleware(self.get_group(request.path_info))
+            request._url_middleware = middleware
 
-        group = 'default'
-        for path_mapping in self._path_mapping:
-            if path.startswith(path_mapping):
-                group = self._path_mapping[path_mapping]
-                break
+        return middleware
 
-        if group not in self._middleware:
-            self.load_middleware(group)
+    def get_matched_middleware(self, path, middleware_method):
 
-        return self._middleware[group][middleware_method]
+        return self.get_group_middleware(self.get_group(path))[middleware_method]
 
     def process_request(self, request):
-        matched_middleware = self.get_matched_middleware(request.path, 'process_request')
+        matched_middleware = self.get_request_middleware(request)['process_request']
         for middleware in matched_middleware:
             response = middleware(request)
             if response:
                 return response
 
     def process_view(self, request, view_func, view_args, view_kwargs):
-        matched_middleware = self.get_matched_middleware(request.path, 'process_view')
+        matched_middleware = self.get_request_middleware(request)['process_view']
         for middleware in matched_middleware:
             response = middleware(request, view_func, view_args, view_kwargs)
             if response:
                 return response
 
     def process_template_response(self, request, response):
-        matched_middleware = self.get_matched_middleware(request.path, 'process_template_response')
+        matched_middleware = self.get_request_middleware(request)['process_template_response']
         for middleware in matched_middleware:
             response = middleware(request, response)
         return response
 
     def process_response(self, request, response):
-        matched_middleware = self.get_matched_middleware(request.path, 'process_response')
+        matched_middleware = self.get_request_middleware(request)['process_response']
         for middleware in matched_middleware:
             response = middleware(request, response)
         return response
 
     def process_exception(self, request, exception):
-        matched_middleware = self.get_matched_middleware(request.path, 'process_exception')
+        matched_middleware = self.get_request_middleware(request)['process_exception']
         for middleware in matched_middleware:
             response = middleware(request, exception)
             if response:
                 return response
 
 
+class InstrumentationMiddleware(object):
+    """
+    Records the wall time, the database queries, the cache hits/misses and
+    the response size of each request. See the WIRECLOUD_INSTRUMENTATION
+    setting.
+    """
+
+    def __init__(self, instrumentation=None):
+
+        self.instrumentation = instrumentation if instrumentation is not None else get_instrumentation()
+        if not self.instrumentation.enabled and not self.instrumentation.server_timing:
+            raise MiddlewareNotUsed()
+
+    def process_request(self, request):
+
+        # Installing the new RequestStats also uninstalls any leftover of a
+        # previous request processed by this thread
+        request._instrumentation = RequestStats()
+        request._instrumentation.install()
+
+    def process_response(self, request, response):
+
+        request_stats = getattr(request, '_instrumentation', None)
+        if request_stats is None:
+            return response
+
+        request_stats.finish(response)
+        del request._instrumentation
+
+        if self.instrumentation.enabled:
+            self.instrumentation.record(get_endpoint_name(request), request_stats)
+
+        if self.instrumentation.server_timing:
+            response['Server-Timing'] = request_stats.get_server_timing()
+
+        return response
+
+
 class LocaleMiddleware(MiddlewareMixin):
     """
     Parse a request and decide what translation object to install in the
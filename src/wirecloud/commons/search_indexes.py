@@ -18,13 +18,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import inspect
+import json
+
+from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.core.cache import cache
 from haystack import indexes
 from haystack.query import SearchQuerySet as HaystackSearchQuerySet
 from haystack import connections
 
 from wirecloud.commons.haystack_fields import BooleanField
 from wirecloud.commons.haystack_queryparser import ParseSQ
+from wirecloud.commons.utils.cache import get_cache_version, invalidate_cache_version
+
+
+SEARCH_RESULTS_VERSION_KEY = '_search_results_version'
 
 
 # Binds Haystack SearchQuerySet to the custom GroupedSearchQuerySets
@@ -60,21 +70,82 @@ def get_search_engine(indexname):
     return get_available_search_engines().get(indexname)
 
 
+def normalize_query_param(value):
+
+    if isinstance(value, (set, frozenset)):
+        return sorted(json.dumps(normalize_query_param(item), sort_keys=True) for item in value)
+    elif isinstance(value, (list, tuple)):
+        return [normalize_query_param(item) for item in value]
+    elif isinstance(value, dict):
+        return {str(key): normalize_query_param(item) for key, item in value.items()}
+    elif inspect.isclass(value):
+        return '%s.%s' % (value.__module__, value.__qualname__)
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    else:
+        return str(value)
+
+
+def get_search_results_cache_key(query):
+    """
+    Returns the cache key to use for storing the results of a search query.
+    The key depends on the final query string (including the user and group
+    filters) and the rest of the search parameters (models, ordering,
+    grouping, page limits, ...).
+    """
+
+    params = query.build_params()
+    params['query_string'] = query.build_query()
+    params['using'] = query._using
+
+    digest = hashlib.sha1(json.dumps(normalize_query_param(params), sort_keys=True).encode('utf-8')).hexdigest()
+    return '_search_results/%s/%s' % (get_cache_version(SEARCH_RESULTS_VERSION_KEY), digest)
+
+
+def invalidate_search_results():
+
+    invalidate_cache_version(SEARCH_RESULTS_VERSION_KEY)
+
+
+def get_search_results(sqs, low, high):
+    """
+    Returns the results of the requested slice together with the total
+    number of hits. Both values are obtained from a single execution of the
+    query and are cached for a short time, so paging through the results
+    does not run the query again.
+    """
+
+    query = sqs.query._clone()
+    query.set_limits(low=low, high=high)
+
+    timeout = getattr(settings, 'WIRECLOUD_SEARCH_RESULTS_CACHE_TIMEOUT', 10)
+    if timeout > 0:
+        key = get_search_results_cache_key(query)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+
+    entry = (list(query.get_results()), query.get_count())
+
+    if timeout > 0:
+        cache.set(key, entry, timeout)
+
+    return entry
+
+
 # Clean search results
 def buildSearchResults(sqs, pagenum, maxresults, clean, request=None):
-    # Count how many docs there are
-    total = sqs._clone().count()
+    res, total = get_search_results(sqs, (pagenum - 1) * maxresults, pagenum * maxresults)
 
     # If the selected page is out of bounds, get the last page
     if total == 0:
         pagenum = 1
-    elif pagenum > total // maxresults:
+    elif pagenum > total // maxresults and len(res) == 0:
         pagenum = total // maxresults
         if (total % maxresults) != 0:
             pagenum += 1
 
-    sqs.query.set_limits(low=(pagenum - 1) * maxresults, high=pagenum * maxresults)
-    res = sqs.query.get_results()
+        res, total = get_search_results(sqs, (pagenum - 1) * maxresults, pagenum * maxresults)
 
     results = [clean(result, request) for result in res]
 
@@ -82,6 +153,19 @@ def buildSearchResults(sqs, pagenum, maxresults, clean, request=None):
     return prepare_search_response(results, total, pagenum, maxresults)
 
 
+def get_related_ids(instance, field_name):
+    """
+    Returns the ids of the instances related through a many-to-many field,
+    using the prefetched instances if available.
+    """
+
+    prefetched = getattr(instance, '_prefetched_objects_cache', {})
+    if field_name in prefetched:
+        return tuple(related.pk for related in prefetched[field_name])
+
+    return tuple(getattr(instance, field_name).values_list('id', flat=True))
+
+
 # Build response structure
 def prepare_search_response(search_results, hits, pagenum, maxresults):
     search_result = {}
@@ -121,6 +205,9 @@ class UserIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return self.model
 
+    def index_queryset(self, using=None):
+        return self.get_model()._default_manager.select_related('organization')
+
     def prepare(self, object):
         self.prepared_data = super(UserIndex, self).prepare(object)
 
@@ -170,6 +257,9 @@ class GroupIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return self.model
 
+    def index_queryset(self, using=None):
+        return self.get_model()._default_manager.select_related('organization')
+
     def prepare(self, object):
         self.prepared_data = super(GroupIndex, self).prepare(object)
 
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 # Copyright (c) 2017 CoNWeT Lab., Universidad Politécnica de Madrid
-# Copyright (c) 2019 Future Internet Consulting and Development Solutions S.L.
+# Copyright (c) 2019-2024 Future Internet Consulting and Development Solutions S.L.
 
 # This file is part of Wirecloud.
 
@@ -20,16 +20,36 @@
 
 import inspect
 from importlib import import_module
+import logging
+import threading
+import time
 
 from haystack import signals, indexes
+from haystack.exceptions import NotHandled
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections, models, transaction
 
 from wirecloud.catalogue.models import CatalogueResource
 from wirecloud.commons.models import Organization
+from wirecloud.commons.search_indexes import invalidate_search_results
 from wirecloud.platform.models import UserWorkspace, Workspace
 
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_QUEUE_OPTIONS = {
+    'ENABLED': True,
+    'DELAY': 0,
+}
+
+# Saves only updating these fields do not require updating the search indexes
+IGNORED_FIELDS = {
+    # last_modified is updated each time a workspace is edited (e.g. moving a
+    # widget). Its indexed value is refreshed on the next relevant update
+    Workspace: frozenset(('last_modified', 'wiringStatus')),
+}
+
+
 class WirecloudSignalProcessor(signals.BaseSignalProcessor):
 
     def __init__(self, connections, connection_router):
@@ -45,8 +65,138 @@ class WirecloudSignalProcessor(signals.BaseSignalProcessor):
                 continue
             self.models += [cls.model for name, cls in mod.__dict__.items() if inspect.isclass(cls) and issubclass(cls, indexes.SearchIndex) and issubclass(cls, indexes.Indexable)]
 
+        options = dict(DEFAULT_INDEX_QUEUE_OPTIONS)
+        options.update(getattr(settings, 'WIRECLOUD_SEARCH_INDEX_QUEUE', {}))
+        self.deferred = options['ENABLED']
+        self.delay = options['DELAY']
+
+        self._local = threading.local()
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._worker = None
+
         super(WirecloudSignalProcessor, self).__init__(connections, connection_router)
 
+    def handle_save(self, sender, instance, **kwargs):
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and frozenset(update_fields) <= IGNORED_FIELDS.get(sender, frozenset()):
+            return
+
+        if not self.deferred:
+            super(WirecloudSignalProcessor, self).handle_save(sender, instance, **kwargs)
+            invalidate_search_results()
+            return
+
+        self.enqueue(sender, instance.pk, kwargs.get('using'))
+
+    def handle_delete(self, sender, instance, **kwargs):
+
+        if not self.deferred:
+            super(WirecloudSignalProcessor, self).handle_delete(sender, instance, **kwargs)
+            invalidate_search_results()
+            return
+
+        self.enqueue(sender, instance.pk, kwargs.get('using'))
+
+    def enqueue(self, model, pk, using=None):
+        """
+        Marks an instance as dirty. Dirty instances are processed in batches
+        once the current transaction is committed, so repeated saves of the
+        same instance only update the search indexes once.
+        """
+
+        batch = getattr(self._local, 'batch', None)
+        if batch is None:
+            batch = self._local.batch = {}
+
+        batch[(model, pk)] = None
+        transaction.on_commit(self.commit_batch, using=using)
+
+    def commit_batch(self):
+
+        batch = getattr(self._local, 'batch', None)
+        if not batch:
+            return
+
+        self._local.batch = {}
+        if self.delay > 0:
+            with self._condition:
+                self._pending.update(batch)
+                self.start_worker()
+                self._condition.notify()
+        else:
+            self.flush(batch)
+
+    def start_worker(self):
+
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self.run_worker, name='wirecloud-search-index-updater', daemon=True)
+            self._worker.start()
+
+    def run_worker(self):
+
+        while True:
+            with self._condition:
+                while len(self._pending) == 0:
+                    self._condition.wait()
+
+            # Wait for more changes so repeated saves are coalesced
+            time.sleep(self.delay)
+
+            with self._condition:
+                batch = self._pending
+                self._pending = {}
+
+            try:
+                self.flush(batch)
+            except Exception:
+                logger.exception('Error updating the search indexes')
+            finally:
+                connections.close_all()
+
+    def flush(self, batch):
+        """
+        Updates the search indexes using the current state of the dirty
+        instances. Instances no longer available in the database are removed
+        from the indexes.
+        """
+
+        pks_by_model = {}
+        for model, pk in batch:
+            pks_by_model.setdefault(model, set()).add(pk)
+
+        for model, pks in pks_by_model.items():
+            for using in self.connection_router.for_write(model=model):
+                try:
+                    index = self.connections[using].get_unified_index().get_index(model)
+                except NotHandled:
+                    continue
+
+                instances = list(index.index_queryset(using=using).filter(pk__in=pks))
+
+                updated = [instance for instance in instances if index.should_update(instance)]
+                if len(updated) > 0:
+                    self.connections[using].get_backend().update(index, updated)
+
+                for pk in pks - set(instance.pk for instance in instances):
+                    index.remove_object(model(pk=pk), using=using)
+
+        if len(batch) > 0:
+            invalidate_search_results()
+
+    def flush_pending(self):
+        """
+        Synchronously processes the changes waiting to be processed by the
+        background worker.
+        """
+
+        with self._condition:
+            batch = self._pending
+            self._pending = {}
+
+        self.flush(batch)
+
     def handle_org(self, *args, **kwargs):
         kwargs["instance"] = kwargs['instance'].user
         kwargs["sender"] = User
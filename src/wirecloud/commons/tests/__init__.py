@@ -1,18 +1,19 @@
 from wirecloud.commons.tests.admin_commands import BaseAdminCommandTestCase, ConvertCommandTestCase, StartprojectCommandTestCase
 from wirecloud.commons.tests.basic_views import BasicViewTestCase
-from wirecloud.commons.tests.commands import CreateOrganizationCommandTestCase
+from wirecloud.commons.tests.commands import CreateOrganizationCommandTestCase, UpdateSearchIndexesCommandTestCase
 from wirecloud.commons.tests.fields import JSONFieldTestCase
-from wirecloud.commons.tests.middleware import LocaleMiddlewareTestCase, URLMiddlewareTestCase
-from wirecloud.commons.tests.search_indexes import QueryParserTestCase, SearchAPITestCase, GroupIndexTestCase, UserGroupIndexTestCase, UserIndexTestCase
+from wirecloud.commons.tests.middleware import InstrumentationMiddlewareTestCase, LocaleMiddlewareTestCase, URLMiddlewareTestCase
+from wirecloud.commons.tests.search_indexes import BuildSearchResultsTestCase, QueryParserTestCase, SearchAPITestCase, GroupIndexTestCase, SearcherPoolTestCase, SignalProcessorTestCase, UserGroupIndexTestCase, UserIndexTestCase
 from wirecloud.commons.tests.template import TemplateUtilsTestCase
-from wirecloud.commons.tests.utils import GeneralUtilsTestCase, HTMLCleanupTestCase, WGTTestCase, HTTPUtilsTestCase
+from wirecloud.commons.tests.utils import CacheUtilsTestCase, GeneralUtilsTestCase, HTMLCleanupTestCase, WGTTestCase, HTTPUtilsTestCase
 
 __all__ = (
-    "BaseAdminCommandTestCase", "BasicViewTestCase", "ConvertCommandTestCase",
+    "BaseAdminCommandTestCase", "BasicViewTestCase", "BuildSearchResultsTestCase", "CacheUtilsTestCase", "ConvertCommandTestCase",
     "CreateOrganizationCommandTestCase", "GeneralUtilsTestCase",
     "GroupIndexTestCase", "HTMLCleanupTestCase", "HTTPUtilsTestCase",
     "JSONFieldTestCase", "LocaleMiddlewareTestCase", "QueryParserTestCase",
-    "ResetSearchIndexesCommandTestCase", "SearchAPITestCase",
-    "StartprojectCommandTestCase", "TemplateUtilsTestCase", "URLMiddlewareTestCase",
+    "ResetSearchIndexesCommandTestCase", "SearchAPITestCase", "SearcherPoolTestCase",
+    "SignalProcessorTestCase",
+    "StartprojectCommandTestCase", "TemplateUtilsTestCase", "UpdateSearchIndexesCommandTestCase", "URLMiddlewareTestCase",
     "UserGroupIndexTestCase", "UserIndexTestCase", "WGTTestCase"
 )
@@ -19,12 +19,25 @@
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
 import io
+import json
+import os
+import shutil
 import sys
-from unittest.mock import patch
+import tempfile
+import time
+from unittest.mock import Mock, patch
 
+from django.contrib.auth.models import User
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.test import TestCase
+from django.utils import timezone
+from haystack.query import SearchQuerySet
+
+from wirecloud.catalogue.models import CatalogueResource
+from wirecloud.commons.search_indexes import searchUser
+from wirecloud.commons.utils.testcases import WirecloudTestCase
+from wirecloud.platform.models import Workspace
 
 
 # Avoid nose to repeat these tests (they are run through wirecloud/commons/tests/__init__.py)
@@ -82,3 +95,103 @@ class CreateOrganizationCommandTestCase(TestCase):
         self.assertEqual(self.options['stdout'].read(), '')
         self.options['stderr'].seek(0)
         self.assertEqual(self.options['stderr'].read(), '')
+
+
+class UpdateSearchIndexesCommandTestCase(WirecloudTestCase, TestCase):
+
+    fixtures = ('user_search_test_data',)
+    tags = ('wirecloud-commands', 'wirecloud-command-updatesearchindexes', 'wirecloud-noselenium')
+    populate = False
+
+    def setUp(self):
+        super(UpdateSearchIndexesCommandTestCase, self).setUp()
+        call_command('clear_index', interactive=False, verbosity=0)
+        self.options = {"stdout": io.StringIO(), "stderr": io.StringIO(), "workers": 1}
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def get_output(self):
+        self.options['stdout'].seek(0)
+        output = self.options['stdout'].read()
+        self.options['stdout'] = io.StringIO()
+        return output
+
+    def test_updatesearchindexes(self):
+        call_command('updatesearchindexes', batch_size=3, **self.options)
+
+        self.assertIn('11 documents indexed', self.get_output())
+        self.assertEqual(searchUser(Mock(), "", 1, 20)["total"], 10)
+
+    def test_updatesearchindexes_clear(self):
+        call_command('updatesearchindexes', **self.options)
+        User.objects.filter(username="dahlia").delete()
+
+        call_command('updatesearchindexes', clear=True, **self.options)
+
+        self.assertIn('10 documents indexed', self.get_output())
+        self.assertEqual(searchUser(Mock(), "", 1, 20)["total"], 9)
+
+    def test_updatesearchindexes_incremental(self):
+        watermarks_file = os.path.join(self.tmp_dir, 'watermarks.json')
+        with open(watermarks_file, 'w') as f:
+            json.dump({"default/platform.Workspace": time.time() + 3600}, f)
+
+        Workspace.objects.create(creator=User.objects.get(username="dahlia"), name="workspace")
+
+        # Workspaces are only indexed if they have been updated since the
+        # previous run
+        call_command('updatesearchindexes', incremental=watermarks_file, **self.options)
+        self.assertIn('11 documents indexed', self.get_output())
+
+        with open(watermarks_file, 'r') as f:
+            watermarks = json.load(f)
+        self.assertLess(watermarks["default/platform.Workspace"], time.time())
+        self.assertIn("default/auth.User", watermarks)
+
+        Workspace.objects.filter(name="workspace").update(last_modified=int(time.time() * 1000) + 1000)
+
+        call_command('updatesearchindexes', incremental=watermarks_file, **self.options)
+        self.assertIn('12 documents indexed', self.get_output())
+
+    def test_updatesearchindexes_incremental_removes_deleted_instances(self):
+        watermarks_file = os.path.join(self.tmp_dir, 'watermarks.json')
+        workspace = Workspace.objects.create(creator=User.objects.get(username="dahlia"), name="workspace")
+        call_command('updatesearchindexes', incremental=watermarks_file, **self.options)
+        self.assertEqual(SearchQuerySet().models(Workspace).filter(django_id=workspace.pk).count(), 1)
+
+        # Delete the workspace without sending signals
+        Workspace.objects.filter(pk=workspace.pk)._raw_delete('default')
+
+        call_command('updatesearchindexes', incremental=watermarks_file, verbosity=2, **self.options)
+        self.assertIn('Removed 1 deleted workspaces', self.get_output())
+        self.assertEqual(SearchQuerySet().models(Workspace).filter(django_id=workspace.pk).count(), 0)
+
+    @patch('wirecloud.commons.management.commands.updatesearchindexes.REMOVAL_BATCH_SIZE', 3)
+    def test_updatesearchindexes_incremental_removes_deleted_instances_in_batches(self):
+        watermarks_file = os.path.join(self.tmp_dir, 'watermarks.json')
+        creator = User.objects.get(username="dahlia")
+        workspaces = [Workspace.objects.create(creator=creator, name="workspace%d" % i) for i in range(5)]
+        call_command('updatesearchindexes', incremental=watermarks_file, **self.options)
+
+        # Delete some workspaces without sending signals
+        Workspace.objects.filter(pk__in=(workspaces[0].pk, workspaces[4].pk))._raw_delete('default')
+
+        call_command('updatesearchindexes', incremental=watermarks_file, verbosity=2, **self.options)
+        self.assertIn('Removed 2 deleted workspaces', self.get_output())
+        self.assertEqual(SearchQuerySet().models(Workspace).filter(django_id__in=[workspace.pk for workspace in workspaces]).count(), 3)
+
+    def test_updatesearchindexes_incremental_indexes_all_resources(self):
+        description = {"type": "mashup", "vendor": "Wirecloud", "name": "mashup", "version": "1.0", "title": "Mashup", "wiring": {"inputs": [], "outputs": []}}
+        CatalogueResource.objects.create(vendor="Wirecloud", short_name="mashup", version="1.0", type=1, creation_date=timezone.now(), template_uri="Wirecloud_mashup_1.0.wgt", json_description=json.dumps(description))
+        watermarks_file = os.path.join(self.tmp_dir, 'watermarks.json')
+        call_command('updatesearchindexes', incremental=watermarks_file, **self.options)
+        self.assertIn('12 documents indexed', self.get_output())
+
+        # Resources don't have a modification date, but their permissions
+        # can be updated, so they are indexed on every run
+        call_command('updatesearchindexes', incremental=watermarks_file, verbosity=2, **self.options)
+        self.assertIn('Indexing 1 catalogue resources', self.get_output())
+
+    def test_updatesearchindexes_clear_and_incremental(self):
+        with self.assertRaises(CommandError):
+            call_command('updatesearchindexes', clear=True, incremental=os.path.join(self.tmp_dir, 'watermarks.json'), **self.options)
@@ -17,13 +17,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+import threading
 from unittest.mock import patch, Mock
 
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
 from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connection
 from django.http import HttpResponse
 from django.test import override_settings, TestCase
+from django.urls import reverse, set_script_prefix
 
-from wirecloud.commons.middleware import LocaleMiddleware, URLMiddleware
+from wirecloud.commons.instrumentation import Instrumentation, InstrumentedCache, RequestStats
+from wirecloud.commons.middleware import InstrumentationMiddleware, LocaleMiddleware, URLMiddleware
 
 
 # Avoid nose to repeat these tests (they are run through wirecloud/commons/tests/__init__.py)
@@ -120,7 +127,7 @@ class URLMiddlewareTestCase(TestCase):
         ]
     })
     def test_invalid_module(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         self.assertRaises(ImproperlyConfigured, self.middleware.process_request, request)
 
     @override_settings(URL_MIDDLEWARE_CLASSES={
@@ -129,7 +136,7 @@ class URLMiddlewareTestCase(TestCase):
         ]
     })
     def test_inexistent_module(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         self.assertRaises(ImproperlyConfigured, self.middleware.process_request, request)
 
     @override_settings(URL_MIDDLEWARE_CLASSES={
@@ -138,7 +145,7 @@ class URLMiddlewareTestCase(TestCase):
         ]
     })
     def test_inexistent_class(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         self.assertRaises(ImproperlyConfigured, self.middleware.process_request, request)
 
     @override_settings(URL_MIDDLEWARE_CLASSES={
@@ -147,7 +154,7 @@ class URLMiddlewareTestCase(TestCase):
         ]
     })
     def test_broken_middleware(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         self.assertRaises(ImproperlyConfigured, self.middleware.process_request, request)
 
     @override_settings(URL_MIDDLEWARE_CLASSES={
@@ -157,7 +164,7 @@ class URLMiddlewareTestCase(TestCase):
         ]
     })
     def test_notused_middleware(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         OneMiddleware.process_request.reset_mock()
         self.middleware.process_request(request)
 
@@ -170,7 +177,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_middleware_is_cached(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         self.middleware.process_request(request)
 
         from django.conf import settings
@@ -192,12 +199,12 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_middleware_is_applied_taking_into_account_request_path(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         self.middleware.process_request(request)
 
         OneMiddleware.process_request.reset_mock()
         AnotherMiddleware.process_request.reset_mock()
-        request = Mock(path='/my/workspace', GET={})
+        request = Mock(path_info='/my/workspace', GET={})
         self.middleware.process_request(request)
 
         OneMiddleware.process_request.assert_not_called()
@@ -217,7 +224,7 @@ class URLMiddlewareTestCase(TestCase):
     )
     @patch("wirecloud.commons.middleware.reverse", return_value="/cdp/")
     def test_proxy_middleware_is_enabled_if_platform_is_used(self, reverse):
-        request = Mock(path='/cdp/version', GET={})
+        request = Mock(path_info='/cdp/version', GET={})
         OneMiddleware.process_request.reset_mock()
         AnotherMiddleware.process_request.reset_mock()
         self.middleware.process_request(request)
@@ -239,7 +246,7 @@ class URLMiddlewareTestCase(TestCase):
     )
     @patch("wirecloud.commons.middleware.reverse", return_value="/cdp/")
     def test_proxy_middleware_is_disabled_if_platform_is_not_used(self, reverse):
-        request = Mock(path='/cdp/version', GET={})
+        request = Mock(path_info='/cdp/version', GET={})
         OneMiddleware.process_request.reset_mock()
         AnotherMiddleware.process_request.reset_mock()
         self.middleware.process_request(request)
@@ -255,7 +262,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_process_request(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         OneMiddleware.process_request.reset_mock()
         AnotherMiddleware.process_request.reset_mock()
         self.middleware.process_request(request)
@@ -271,7 +278,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_process_request_short_circuit(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         OneMiddleware.process_request.reset_mock()
         AnotherMiddleware.process_request.reset_mock()
         self.middleware.process_request(request)
@@ -287,7 +294,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_process_view(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         view_func = Mock()
         view_args = []
         view_kwargs = {}
@@ -306,7 +313,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_process_view_short_circuit(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         view_func = Mock()
         view_args = []
         view_kwargs = {}
@@ -324,7 +331,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_process_template_response(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         response = HttpResponse()
         short_circuit_response = ShortCircuitMiddleware.process_template_response()
         OneMiddleware.process_template_response.reset_mock()
@@ -341,7 +348,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_process_response(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         response = HttpResponse()
         short_circuit_response = ShortCircuitMiddleware.process_response()
         OneMiddleware.process_response.reset_mock()
@@ -359,7 +366,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_process_exception(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         exception = Mock()
         OneMiddleware.process_exception.reset_mock()
         AnotherMiddleware.process_exception.reset_mock()
@@ -376,7 +383,7 @@ class URLMiddlewareTestCase(TestCase):
         ],
     })
     def test_process_exception_short_circuit(self):
-        request = Mock(path='/api/version', GET={})
+        request = Mock(path_info='/api/version', GET={})
         exception = Mock()
         OneMiddleware.process_exception.reset_mock()
         AnotherMiddleware.process_exception.reset_mock()
@@ -384,3 +391,214 @@ class URLMiddlewareTestCase(TestCase):
 
         OneMiddleware.process_exception.assert_not_called()
         AnotherMiddleware.process_exception.assert_called_once_with(request, exception)
+
+    @override_settings(
+        INSTALLED_APPS=["wirecloud.platform"],
+        URL_MIDDLEWARE_CLASSES={
+            'api': [
+                'wirecloud.commons.tests.middleware.OneMiddleware',
+            ],
+            'proxy': [
+                'wirecloud.commons.tests.middleware.AnotherMiddleware',
+            ],
+        }
+    )
+    @patch("wirecloud.commons.middleware.reverse", return_value="/api/cdp/a/a")
+    def test_longest_prefix_is_used(self, reverse):
+        self.assertEqual(self.middleware.get_group('/api/cdp/http/example.com/'), 'proxy')
+        self.assertEqual(self.middleware.get_group('/api/version'), 'api')
+        self.assertEqual(self.middleware.get_group('/admin/api/'), 'default')
+
+    @override_settings(
+        INSTALLED_APPS=["wirecloud.platform"],
+        URL_MIDDLEWARE_CLASSES={
+            'api': [
+                'wirecloud.commons.tests.middleware.OneMiddleware',
+            ],
+            'proxy': [
+                'wirecloud.commons.tests.middleware.AnotherMiddleware',
+            ],
+        }
+    )
+    def test_script_prefix_is_ignored(self):
+        set_script_prefix('/wirecloud/')
+        self.addCleanup(set_script_prefix, '/')
+        middleware = URLMiddleware(Mock())
+
+        self.assertEqual(middleware.get_group('/cdp/http/example.com/'), 'proxy')
+        self.assertEqual(middleware.get_group('/api/version'), 'api')
+
+    @override_settings(URL_MIDDLEWARE_CLASSES={
+        'api': [
+            'wirecloud.commons.tests.middleware.OneMiddleware',
+        ],
+    })
+    def test_group_is_resolved_once_per_request(self):
+        request = Mock(path_info='/api/version', GET={})
+        OneMiddleware.process_request.reset_mock()
+        OneMiddleware.process_response.reset_mock()
+
+        with patch.object(self.middleware, 'get_group', wraps=self.middleware.get_group) as get_group:
+            self.middleware.process_request(request)
+            self.middleware.process_response(request, HttpResponse())
+
+        get_group.assert_called_once_with('/api/version')
+        OneMiddleware.process_request.assert_called_once_with(request)
+        OneMiddleware.process_response.assert_called_once()
+
+    @override_settings(URL_MIDDLEWARE_CLASSES={
+        'api': [
+            'wirecloud.commons.tests.middleware.OneMiddleware',
+        ],
+        'proxy': [
+            'wirecloud.commons.tests.middleware.AnotherMiddleware',
+        ],
+    })
+    def test_groups_are_loaded_eagerly(self):
+        middleware = URLMiddleware(Mock())
+
+        self.assertEqual(set(middleware._middleware), {'api', 'proxy', 'default'})
+        self.assertIsNotNone(middleware._path_regex)
+
+    @override_settings(URL_MIDDLEWARE_CLASSES={
+        'api': [
+            'wirecloud.commons.tests.middleware.OneMiddleware',
+        ],
+    })
+    def test_groups_are_loaded_once(self):
+        with patch.object(self.middleware, 'load_middleware', wraps=self.middleware.load_middleware) as load_middleware:
+            threads = [threading.Thread(target=self.middleware.get_group_middleware, args=('api',)) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        load_middleware.assert_called_once_with('api')
+
+
+class InstrumentationMiddlewareTestCase(TestCase):
+
+    tags = ('wirecloud-instrumentation-middleware', 'wirecloud-middleware', 'wirecloud-noselenium')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('instrumentation-staff', 'staff@example.com', 'test', is_staff=True)
+        cls.user = User.objects.create_user('instrumentation-user', 'user@example.com', 'test')
+
+    def setUp(self):
+        super(InstrumentationMiddlewareTestCase, self).setUp()
+        self.instrumentation = Instrumentation(enabled=True, server_timing=True, budgets={'queries': 100}, endpoint_budgets={'GET wirecloud.instrumentation': {'queries': 0}})
+        for module in ('wirecloud.commons.middleware', 'wirecloud.commons.views'):
+            patcher = patch(module + '.get_instrumentation', return_value=self.instrumentation)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.url = reverse('wirecloud.instrumentation')
+
+    def test_middleware_not_used_when_disabled(self):
+        self.assertRaises(MiddlewareNotUsed, InstrumentationMiddleware, Instrumentation())
+
+    def test_database_queries_are_counted(self):
+        request_stats = RequestStats()
+        request_stats.install()
+        try:
+            User.objects.count()
+            User.objects.count()
+        finally:
+            request_stats.uninstall()
+        User.objects.count()
+
+        self.assertEqual(request_stats.queries, 2)
+        self.assertGreater(request_stats.query_time, 0)
+
+    def test_cache_hits_and_misses_are_counted(self):
+        cache.set('instrumentation/a', 1)
+        cache.delete('instrumentation/b')
+
+        request_stats = RequestStats()
+        request_stats.install()
+        try:
+            self.assertIsInstance(caches['default'], InstrumentedCache)
+            self.assertEqual(cache.get('instrumentation/a'), 1)
+            self.assertEqual(cache.get('instrumentation/b', 2), 2)
+            self.assertEqual(cache.get_many(['instrumentation/a', 'instrumentation/b']), {'instrumentation/a': 1})
+        finally:
+            request_stats.uninstall()
+
+        self.assertNotIsInstance(caches['default'], InstrumentedCache)
+        self.assertEqual(request_stats.cache_hits, 2)
+        self.assertEqual(request_stats.cache_misses, 2)
+
+    def test_leftover_request_stats_are_uninstalled(self):
+        middleware = InstrumentationMiddleware(self.instrumentation)
+        # process_response is not called for the first request (e.g. due to
+        # an exception on other middleware)
+        middleware.process_request(Mock())
+        leftover = caches['default']._request_stats
+
+        request = Mock()
+        middleware.process_request(request)
+        try:
+            self.assertNotIn(leftover, connection.execute_wrappers)
+            self.assertIs(caches['default']._request_stats, request._instrumentation)
+        finally:
+            request._instrumentation.uninstall()
+
+        self.assertNotIn(request._instrumentation, connection.execute_wrappers)
+        self.assertNotIsInstance(caches['default'], InstrumentedCache)
+
+    def test_requests_are_recorded(self):
+        self.client.login(username='instrumentation-staff', password='test')
+
+        with self.assertLogs('wirecloud.instrumentation', level='WARNING') as logs:
+            response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {})
+        self.assertTrue(response['Server-Timing'].startswith('app;dur='))
+        self.assertIn('GET wirecloud.instrumentation exceeded its budget (queries > 0)', logs.output[0])
+
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        stats = json.loads(response.content.decode('utf-8'))['GET wirecloud.instrumentation']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['over_budget'], 1)
+        self.assertGreater(stats['max_queries'], 0)
+        self.assertEqual(stats['max_size'], 2)
+
+    def test_endpoint_labels_are_bounded(self):
+        self.instrumentation.max_endpoints = 1
+        request_stats = RequestStats()
+        request_stats.finish(HttpResponse('a'))
+
+        self.instrumentation.record('GET a', request_stats)
+        self.instrumentation.record('GET b', request_stats)
+
+        self.assertEqual(set(self.instrumentation.get_stats()), {'GET a', '_other'})
+
+    def test_stats_require_staff_users(self):
+        self.client.login(username='instrumentation-user', password='test')
+
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_stats_can_be_reset(self):
+        self.client.login(username='instrumentation-staff', password='test')
+        self.client.get(self.url, HTTP_ACCEPT='application/json')
+
+        response = self.client.delete(self.url)
+
+        self.assertEqual(response.status_code, 204)
+        # Only the reset request is recorded
+        self.assertEqual(set(self.instrumentation.get_stats()), {'DELETE wirecloud.instrumentation'})
+
+    def test_stats_disabled(self):
+        self.instrumentation.enabled = False
+        self.client.login(username='instrumentation-staff', password='test')
+
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('Server-Timing', response)
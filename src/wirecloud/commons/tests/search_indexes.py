@@ -24,10 +24,16 @@ from unittest.mock import Mock, patch
 from django.contrib.auth.models import Group, User
 from django.test import TestCase
 from django.urls import reverse
+from whoosh.fields import ID, Schema
+from whoosh.filedb.filestore import RamStorage
+from whoosh.query import Term
 
+from wirecloud.commons.haystack_backends.whoosh_backend import SearcherPool
 from wirecloud.commons.haystack_queryparser import NoMatchingBracketsFound, ParseSQ
-from wirecloud.commons.search_indexes import cleanUserGroupResults, cleanUserResults, cleanGroupResults, searchGroup, searchUser, searchUserGroup, GROUP_CONTENT_FIELDS, USER_CONTENT_FIELDS
+from wirecloud.commons.signals import WirecloudSignalProcessor
+from wirecloud.commons.search_indexes import buildSearchResults, invalidate_search_results, cleanUserGroupResults, cleanUserResults, cleanGroupResults, searchGroup, searchUser, searchUserGroup, GROUP_CONTENT_FIELDS, USER_CONTENT_FIELDS
 from wirecloud.commons.utils.testcases import WirecloudTestCase
+from wirecloud.platform.models import Workspace
 
 
 # Avoid nose to repeat these tests (they are run through wirecloud/commons/tests/__init__.py)
@@ -390,3 +396,215 @@ class UserGroupIndexTestCase(WirecloudTestCase, TestCase):
                 "type": "group"
             }
         )
+
+
+class BuildSearchResultsTestCase(WirecloudTestCase, TestCase):
+
+    fixtures = ()
+    tags = ('wirecloud-search-api', 'wirecloud-noselenium')
+    populate = False
+    use_search_indexes = False
+
+    def build_sqs(self, total):
+        sqs = Mock()
+        query = sqs.query._clone.return_value
+        query._using = "default"
+        query.build_query.return_value = "query"
+        query.build_params.side_effect = lambda: {
+            "models": {User},
+            "start_offset": query.set_limits.call_args[1]["low"],
+            "end_offset": query.set_limits.call_args[1]["high"],
+        }
+
+        def get_results():
+            limits = query.set_limits.call_args[1]
+            return list(range(limits["low"], min(limits["high"], total)))
+
+        query.get_results.side_effect = get_results
+        query.get_count.return_value = total
+        return sqs, query
+
+    def test_single_query_execution(self):
+        sqs, query = self.build_sqs(12)
+
+        result = buildSearchResults(sqs, 2, 5, lambda result, request: result)
+
+        self.assertEqual(result["results"], [5, 6, 7, 8, 9])
+        self.assertEqual(result["total"], 12)
+        self.assertEqual(result["pagecount"], 3)
+        self.assertEqual(query.get_results.call_count, 1)
+        self.assertEqual(query.get_count.call_count, 1)
+
+    def test_out_of_bounds_page(self):
+        sqs, query = self.build_sqs(12)
+
+        result = buildSearchResults(sqs, 10, 5, lambda result, request: result)
+
+        self.assertEqual(result["pagenum"], 3)
+        self.assertEqual(result["results"], [10, 11])
+
+    def test_results_are_cached(self):
+        sqs, query = self.build_sqs(12)
+        buildSearchResults(sqs, 1, 5, lambda result, request: result)
+
+        result = buildSearchResults(sqs, 1, 5, lambda result, request: result)
+        self.assertEqual(result["results"], [0, 1, 2, 3, 4])
+        self.assertEqual(query.get_results.call_count, 1)
+
+        # Other pages are not served from the cache
+        buildSearchResults(sqs, 2, 5, lambda result, request: result)
+        self.assertEqual(query.get_results.call_count, 2)
+
+        # Index updates invalidate cached results
+        invalidate_search_results()
+        buildSearchResults(sqs, 1, 5, lambda result, request: result)
+        self.assertEqual(query.get_results.call_count, 3)
+
+    def test_results_cache_disabled(self):
+        sqs, query = self.build_sqs(12)
+
+        with self.settings(WIRECLOUD_SEARCH_RESULTS_CACHE_TIMEOUT=0):
+            buildSearchResults(sqs, 1, 5, lambda result, request: result)
+            buildSearchResults(sqs, 1, 5, lambda result, request: result)
+
+        self.assertEqual(query.get_results.call_count, 2)
+
+
+class SearcherPoolTestCase(TestCase):
+
+    tags = ('wirecloud-search-api', 'wirecloud-noselenium')
+
+    def setUp(self):
+        self.index = RamStorage().create_index(Schema(id=ID(stored=True), public=ID))
+        self.add_document("1", "true")
+        self.pool = SearcherPool()
+
+    def add_document(self, id, public):
+        writer = self.index.writer()
+        writer.add_document(id=id, public=public)
+        writer.commit()
+
+    def parse(self, query_string):
+        return Term("public", query_string)
+
+    def test_searchers_are_reused(self):
+        with self.pool.searcher(self.index) as (searcher1, version1):
+            pass
+
+        with self.pool.searcher(self.index) as (searcher2, version2):
+            pass
+
+        self.assertIs(searcher1, searcher2)
+        self.assertEqual(version1, version2)
+
+    def test_concurrent_searchers(self):
+        with self.pool.searcher(self.index) as (searcher1, version1):
+            with self.pool.searcher(self.index) as (searcher2, version2):
+                self.assertIsNot(searcher1, searcher2)
+
+    def test_searchers_are_reopened_on_index_updates(self):
+        with self.pool.searcher(self.index) as (searcher1, version1):
+            self.assertEqual(searcher1.doc_count(), 1)
+
+        self.add_document("2", "false")
+
+        with self.pool.searcher(self.index) as (searcher2, version2):
+            self.assertIsNot(searcher1, searcher2)
+            self.assertNotEqual(version1, version2)
+            self.assertEqual(searcher2.doc_count(), 2)
+
+        self.assertTrue(searcher1.is_closed)
+
+    def test_filters_are_cached_per_version(self):
+        parse = Mock(side_effect=self.parse)
+
+        with self.pool.searcher(self.index) as (searcher, version):
+            self.assertEqual(len(self.pool.get_filter(searcher, version, "true", parse)), 1)
+            self.assertEqual(len(self.pool.get_filter(searcher, version, "true", parse)), 1)
+
+        self.assertEqual(parse.call_count, 1)
+
+        self.add_document("2", "true")
+
+        with self.pool.searcher(self.index) as (searcher, version):
+            self.assertEqual(len(self.pool.get_filter(searcher, version, "true", parse)), 2)
+
+        self.assertEqual(parse.call_count, 2)
+
+
+class SignalProcessorTestCase(WirecloudTestCase, TestCase):
+
+    fixtures = ('user_search_test_data',)
+    tags = ('wirecloud-search-api', 'wirecloud-noselenium')
+    populate = False
+    use_search_indexes = False
+
+    def setUp(self):
+        super(SignalProcessorTestCase, self).setUp()
+        self.connections = {"default": Mock()}
+        self.connection_router = Mock()
+        self.connection_router.for_write.return_value = ("default",)
+        self.index = self.connections["default"].get_unified_index().get_index()
+        self.index.should_update.return_value = True
+        self.index.index_queryset.side_effect = lambda using=None: User.objects.all()
+        self.processor = WirecloudSignalProcessor(self.connections, self.connection_router)
+        self.addCleanup(self.processor.teardown)
+
+    @patch("wirecloud.commons.signals.transaction.on_commit")
+    def test_ignored_fields_updates(self, on_commit_mock):
+        self.processor.handle_save(Workspace, Mock(pk=1), update_fields=("last_modified",))
+        self.processor.handle_save(Workspace, Mock(pk=1), update_fields=("wiringStatus", "last_modified"))
+
+        on_commit_mock.assert_not_called()
+
+    @patch("wirecloud.commons.signals.transaction.on_commit")
+    def test_updates_are_coalesced(self, on_commit_mock):
+        user = User.objects.get(username="dahlia")
+
+        self.processor.handle_save(User, user)
+        self.processor.handle_save(User, user, update_fields=("last_login",))
+        self.processor.handle_save(User, user)
+        self.connections["default"].get_backend().update.assert_not_called()
+
+        on_commit_mock.call_args[0][0]()
+        self.connections["default"].get_backend().update.assert_called_once_with(self.index, [user])
+
+        # Remaining callbacks have nothing to process
+        on_commit_mock.call_args[0][0]()
+        self.connections["default"].get_backend().update.assert_called_once()
+
+    @patch("wirecloud.commons.signals.transaction.on_commit")
+    def test_deleted_instances_are_removed(self, on_commit_mock):
+        user = User.objects.get(username="dahlia")
+        user_id = user.id
+        User.objects.filter(pk=user_id).delete()
+
+        self.processor.handle_delete(User, user)
+        on_commit_mock.call_args[0][0]()
+
+        self.connections["default"].get_backend().update.assert_not_called()
+        self.index.remove_object.assert_called_once()
+        self.assertEqual(self.index.remove_object.call_args[0][0].pk, user_id)
+
+    @patch("wirecloud.commons.signals.transaction.on_commit")
+    def test_delayed_updates(self, on_commit_mock):
+        user = User.objects.get(username="dahlia")
+        self.processor.delay = 1
+
+        with patch.object(self.processor, "start_worker") as start_worker_mock:
+            self.processor.handle_save(User, user)
+            on_commit_mock.call_args[0][0]()
+
+            start_worker_mock.assert_called_once_with()
+            self.connections["default"].get_backend().update.assert_not_called()
+
+        self.processor.flush_pending()
+        self.connections["default"].get_backend().update.assert_called_once_with(self.index, [user])
+
+    def test_not_deferred_updates(self):
+        user = User.objects.get(username="dahlia")
+        self.processor.deferred = False
+
+        self.processor.handle_save(User, user)
+
+        self.index.update_object.assert_called_once_with(user, using="default")
@@ -17,22 +17,33 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+import gzip
 from io import BytesIO
+import json
 import os
+import random
+import shutil
+import tempfile
+import time
 from unittest.mock import DEFAULT, patch, Mock, ANY
 import zipfile
 
+from django.core.cache import cache
 from django.http import Http404, UnreadablePostError
+from django.test import RequestFactory
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.utils import translation
+from django.utils.translation import ugettext_lazy
 
-from wirecloud.commons.exceptions import ErrorResponse
+from wirecloud.commons.exceptions import ErrorResponse, HttpBadCredentials
+from wirecloud.commons.utils.cache import _build_single_flight_lock_key, build_api_token_cache_key, cache_api_token_auth, get_many_or_set_single_flight, get_or_set_single_flight, invalidate_api_tokens, LRUCache
 from wirecloud.commons.utils.html import clean_html, filter_changelog
 from wirecloud.commons.utils.http import build_downloadfile_response, build_sendfile_response, get_absolute_static_url, get_current_domain, get_current_scheme, get_content_type, normalize_boolean_param, produces, validate_url_param
 from wirecloud.commons.utils.log import SkipUnreadablePosts
 from wirecloud.commons.utils.mimeparser import best_match, InvalidMimeType, parse_mime_type
 from wirecloud.commons.utils.version import Version
-from wirecloud.commons.utils.wgt import WgtFile
+from wirecloud.commons.utils.wgt import MEDIA_MANIFEST_FILENAME, WgtDeployer, WgtFile
 from wirecloud.platform.core.plugins import get_version_hash
 
 
@@ -40,6 +51,27 @@ from wirecloud.platform.core.plugins import get_version_hash
 __test__ = False
 
 
+MEDIA_INDEX_CODE = b'<html><body>' + b'hello world! ' * 100 + b'</body></html>'
+
+
+def deploy_media_wgt(testcase, extra_files={}):
+
+    root_dir = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, root_dir)
+
+    f = BytesIO()
+    zf = zipfile.ZipFile(f, 'w')
+    zf.writestr('config.xml', '<?xml version="1.0" ?><widget xmlns="http://wirecloud.conwet.fi.upm.es/ns/macdescription/1" vendor="Wirecloud" name="Media" version="1.0"><details><title>Media</title><email>a@example.com</email></details><contents src="index.html"/><rendering width="1" height="1"/></widget>')
+    zf.writestr('index.html', MEDIA_INDEX_CODE)
+    for name, contents in extra_files.items():
+        zf.writestr(name, contents)
+    zf.close()
+
+    deployer = WgtDeployer(root_dir)
+    deployer.deploy(WgtFile(f))
+    return deployer, deployer.get_base_dir('Wirecloud', 'Media', '1.0')
+
+
 class HTMLCleanupTestCase(TestCase):
 
     tags = ('wirecloud-utils', 'wirecloud-html-cleanup', 'wirecloud-noselenium')
@@ -242,6 +274,58 @@ class GeneralUtilsTestCase(TestCase):
         self.assertFalse(Version('1') != '1.0')
         self.assertFalse(Version('1') != Version('1'))
 
+    def test_version_sort_key(self):
+
+        versions = ['0.0.1', '0.1', '1.0a1-dev', '1.0-dev', '1.0a1', '1.0a2', '1.0a10', '1.0b1', '1.0rc1', '1', '1.0.1', '1.1', '1.10', '2.0', '10']
+        keys = [Version(version).get_sort_key() for version in versions]
+
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(Version('1').get_sort_key(), Version('1.0.0').get_sort_key())
+        self.assertTrue(all(key.isdigit() for key in keys))
+
+    def test_version_parse_returns_shared_instances(self):
+
+        self.assertIs(Version.parse('1.0.1'), Version.parse('1.0.1'))
+        self.assertEqual(Version.parse('1.0.1'), Version('1.0.1'))
+        self.assertRaises(ValueError, Version.parse, '0.a')
+
+    def test_version_instances_are_immutable(self):
+
+        version = Version.parse('1.0')
+
+        with self.assertRaises(AttributeError):
+            version.vstring = '2.0'
+
+        with self.assertRaises(AttributeError):
+            version.other = 5
+
+        self.assertEqual(version, '1.0')
+
+    def test_version_hash(self):
+
+        self.assertEqual(hash(Version('1')), hash(Version('1.0.0')))
+        self.assertEqual(len({Version('1'), Version('1.0'), Version('1.1')}), 2)
+
+    def test_version_parse_sort(self):
+
+        # Sort 10k versions taken from 500 different version strings (see
+        # the version_sort scenarios of performance_tests/benchmark.py)
+        generator = random.Random(0)
+        available = ['%d.%d.%d%s' % (generator.randint(0, 5), generator.randint(0, 20), generator.randint(0, 20), generator.choice(('', 'a1', 'b2', 'rc1', '-dev'))) for i in range(500)]
+        vstrings = [generator.choice(available) for i in range(10000)]
+
+        expected = sorted(vstrings, key=Version)
+
+        Version.parse.cache_clear()
+        result = sorted(vstrings, key=Version.parse)
+        cache_info = Version.parse.cache_info()
+
+        self.assertEqual([Version(vstring) for vstring in result], [Version(vstring) for vstring in expected])
+        # Each version string is only parsed once
+        self.assertEqual(cache_info.misses, len(set(vstrings)))
+        self.assertEqual(cache_info.hits, len(vstrings) - len(set(vstrings)))
+
     def test_version_invalid_values(self):
 
         self.assertRaises(ValueError, Version, '-0')
@@ -251,6 +335,230 @@ class GeneralUtilsTestCase(TestCase):
         self.assertRaises(ValueError, Version('1.0').__eq__, {})
 
 
+class CacheUtilsTestCase(TestCase):
+
+    tags = ('wirecloud-utils', 'wirecloud-general-utils', 'wirecloud-cache-utils', 'wirecloud-noselenium')
+
+    def test_lrucache_get_set(self):
+
+        cache = LRUCache()
+        cache.set('a', 1)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('b', 2), 2)
+
+    def test_lrucache_evicts_least_recently_used(self):
+
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_lrucache_delete_matching(self):
+
+        cache = LRUCache()
+        cache.set('a/1', 1)
+        cache.set('a/2', 2)
+        cache.set('b/1', 3)
+        cache.delete_matching(lambda key: key.startswith('a/'))
+
+        self.assertEqual(len(cache), 1)
+        self.assertIn('b/1', cache)
+
+    def test_single_flight_computes_once(self):
+
+        cache.delete('single_flight/a')
+        compute = Mock(return_value=5)
+
+        self.assertEqual(get_or_set_single_flight('single_flight/a', compute), 5)
+        self.assertEqual(get_or_set_single_flight('single_flight/a', compute), 5)
+        self.assertEqual(compute.call_count, 1)
+        self.assertIsNone(cache.get(_build_single_flight_lock_key(('single_flight/a',))))
+
+    def test_single_flight_lock_released_on_error(self):
+
+        cache.delete('single_flight/a')
+        compute = Mock(side_effect=KeyError('a'))
+
+        self.assertRaises(KeyError, get_or_set_single_flight, 'single_flight/a', compute)
+        self.assertIsNone(cache.get(_build_single_flight_lock_key(('single_flight/a',))))
+
+    def test_single_flight_serves_stale(self):
+
+        cache.delete('single_flight/a')
+        cache.set('single_flight/stale', 3)
+        lock_key = _build_single_flight_lock_key(('single_flight/a',))
+        cache.set(lock_key, True)
+        self.addCleanup(cache.delete, lock_key)
+        compute = Mock(return_value=5)
+
+        self.assertEqual(get_or_set_single_flight('single_flight/a', compute, stale_key='single_flight/stale'), 3)
+        compute.assert_not_called()
+
+    def test_single_flight_stale_timeout(self):
+
+        cache.delete('single_flight/a')
+        compute = Mock(return_value=5)
+
+        with patch('wirecloud.commons.utils.cache.cache') as cache_mock:
+            cache_mock.get_many.return_value = {}
+            cache_mock.add.return_value = True
+            get_or_set_single_flight('single_flight/a', compute, timeout=300, stale_key='single_flight/stale', stale_timeout=10)
+
+        cache_mock.set.assert_any_call('single_flight/a', 5, 300)
+        cache_mock.set.assert_any_call('single_flight/stale', 5, 10)
+
+    def test_single_flight_waits_for_value(self):
+
+        cache.delete('single_flight/a')
+        lock_key = _build_single_flight_lock_key(('single_flight/a',))
+        cache.set(lock_key, True)
+        self.addCleanup(cache.delete, lock_key)
+        compute = Mock(return_value=5)
+
+        def sleep(interval):
+            # Simulate other process storing the value
+            cache.set('single_flight/a', 4)
+
+        with patch('wirecloud.commons.utils.cache.time.sleep', side_effect=sleep):
+            self.assertEqual(get_or_set_single_flight('single_flight/a', compute), 4)
+
+        compute.assert_not_called()
+
+    def test_single_flight_bounded_wait(self):
+
+        cache.delete('single_flight/a')
+        lock_key = _build_single_flight_lock_key(('single_flight/a',))
+        cache.set(lock_key, True)
+        self.addCleanup(cache.delete, lock_key)
+        compute = Mock(return_value=5)
+
+        with patch('wirecloud.commons.utils.cache.time.sleep'):
+            self.assertEqual(get_or_set_single_flight('single_flight/a', compute, max_wait=0.01), 5)
+
+        compute.assert_called_once_with()
+        self.assertEqual(cache.get('single_flight/a'), 5)
+
+    def test_single_flight_lock_released_by_other_process(self):
+
+        cache.delete('single_flight/a')
+        lock_key = _build_single_flight_lock_key(('single_flight/a',))
+        cache.set(lock_key, True)
+        self.addCleanup(cache.delete, lock_key)
+        compute = Mock(return_value=5)
+
+        with patch('wirecloud.commons.utils.cache.time.sleep', side_effect=lambda interval: cache.delete(lock_key)) as sleep_mock:
+            self.assertEqual(get_or_set_single_flight('single_flight/a', compute), 5)
+
+        self.assertEqual(sleep_mock.call_count, 1)
+        compute.assert_called_once_with()
+
+    def test_single_flight_many(self):
+
+        cache.delete_many(('single_flight/a', 'single_flight/b', 'single_flight/c'))
+        cache.set('single_flight/a', 1)
+        compute = Mock(side_effect=lambda items: {item: item.upper() for item in items if item != 'c'})
+
+        values = get_many_or_set_single_flight({'a': 'single_flight/a', 'b': 'single_flight/b', 'c': 'single_flight/c'}, compute)
+
+        self.assertEqual(values, {'a': 1, 'b': 'B'})
+        compute.assert_called_once_with(['b', 'c'])
+        self.assertEqual(cache.get('single_flight/b'), 'B')
+
+    def test_api_token_auth_cache(self):
+
+        from django.contrib.auth.models import User
+        user = User.objects.create_user('tokenuser')
+        cache.delete(build_api_token_cache_key('test', 'token'))
+        backend = Mock(return_value=(user, None))
+        auth = cache_api_token_auth('test')(backend)
+
+        self.assertEqual(auth('Bearer', 'token'), user)
+        self.assertEqual(auth('Bearer', 'token'), user)
+        backend.assert_called_once_with('Bearer', 'token')
+
+        # Invalidated tokens are validated again
+        invalidate_api_tokens('test', ('token',))
+        self.assertEqual(auth('Bearer', 'token'), user)
+        self.assertEqual(backend.call_count, 2)
+
+    def test_api_token_auth_cache_does_not_outlive_token(self):
+
+        from django.contrib.auth.models import User
+        user = User.objects.create_user('tokenuser')
+        cache.delete(build_api_token_cache_key('test', 'token'))
+        backend = Mock(return_value=(user, time.time()))
+        auth = cache_api_token_auth('test')(backend)
+
+        auth('Bearer', 'token')
+        auth('Bearer', 'token')
+        self.assertEqual(backend.call_count, 2)
+
+    def test_api_token_auth_cache_bad_credentials(self):
+
+        cache.delete(build_api_token_cache_key('test', 'token'))
+        backend = Mock(side_effect=HttpBadCredentials('Expired access token', 'Bearer realm="WireCloud"'))
+        auth = cache_api_token_auth('test')(backend)
+
+        self.assertRaises(HttpBadCredentials, auth, 'Bearer', 'token')
+        with self.assertRaises(HttpBadCredentials) as cm:
+            auth('Bearer', 'token')
+
+        self.assertEqual(cm.exception.message, 'Expired access token')
+        self.assertEqual(cm.exception.error_info, 'Bearer realm="WireCloud"')
+        backend.assert_called_once_with('Bearer', 'token')
+
+    def test_api_token_auth_cache_bad_credentials_language(self):
+
+        cache.delete(build_api_token_cache_key('test', 'token'))
+        backend = Mock(side_effect=HttpBadCredentials(ugettext_lazy('Bad credentials')))
+        auth = cache_api_token_auth('test')(backend)
+
+        with translation.override('es'):
+            self.assertRaises(HttpBadCredentials, auth, 'Bearer', 'token')
+
+        # Cached errors are translated using the language of each request
+        with translation.override('en'):
+            with self.assertRaises(HttpBadCredentials) as cm:
+                auth('Bearer', 'token')
+
+        self.assertEqual(cm.exception.message, 'Bad credentials')
+        backend.assert_called_once_with('Bearer', 'token')
+
+    def test_api_token_auth_cache_deleted_user(self):
+
+        from django.contrib.auth.models import User
+        user = User.objects.create_user('tokenuser')
+        cache.delete(build_api_token_cache_key('test', 'token'))
+        backend = Mock(return_value=(user, None))
+        auth = cache_api_token_auth('test')(backend)
+
+        auth('Bearer', 'token')
+        user.delete()
+
+        self.assertRaises(User.DoesNotExist, auth, 'Bearer', 'token')
+        backend.assert_called_once_with('Bearer', 'token')
+
+    @override_settings(WIRECLOUD_API_TOKEN_NEGATIVE_CACHE_TIMEOUT=0)
+    def test_api_token_auth_negative_cache_disabled(self):
+
+        from django.contrib.auth.models import User
+        cache.delete(build_api_token_cache_key('test', 'token'))
+        backend = Mock(side_effect=User.DoesNotExist)
+        auth = cache_api_token_auth('test')(backend)
+
+        self.assertRaises(User.DoesNotExist, auth, 'Bearer', 'token')
+        self.assertRaises(User.DoesNotExist, auth, 'Bearer', 'token')
+        self.assertEqual(backend.call_count, 2)
+
+
 class WGTTestCase(TestCase):
 
     tags = ('wirecloud-utils', 'wirecloud-wgt', 'wirecloud-noselenium')
@@ -380,6 +688,52 @@ class WGTTestCase(TestCase):
             self.assertNotEqual(wgt_file.get_underlying_file(), old_file)
             zip_write_mock.assert_any_call(ANY, ANY, new_contents)
 
+    def deploy_media_and_read_manifest(self):
+
+        deployer, base_dir = deploy_media_wgt(self, {
+            'js/small.js': b'var a = 1;',
+            'js/main.js': b'var a = 1;\n' * 100,
+            'js/main.js.gz': b'provided by the component',
+            'images/icon.png': b'\x89PNG' * 100,
+        })
+        with open(os.path.join(base_dir, MEDIA_MANIFEST_FILENAME), 'rb') as manifest_file:
+            manifest = json.loads(manifest_file.read().decode('utf-8'))
+
+        return deployer, base_dir, manifest
+
+    def test_deploy_prepares_media(self):
+
+        deployer, base_dir, manifest = self.deploy_media_and_read_manifest()
+
+        self.assertEqual(set(manifest['files'].keys()), {'config.xml', 'index.html', 'js/small.js', 'js/main.js', 'js/main.js.gz', 'images/icon.png'})
+        self.assertEqual(manifest['files']['index.html']['encodings']['gzip'], 'index.html.gz')
+        with open(os.path.join(base_dir, 'index.html.gz'), 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), MEDIA_INDEX_CODE)
+
+        # Small and binary files are not compressed
+        self.assertEqual(manifest['files']['js/small.js']['encodings'], {})
+        self.assertEqual(manifest['files']['images/icon.png']['encodings'], {})
+        # Files provided by the component are not overwritten
+        self.assertNotIn('gzip', manifest['files']['js/main.js']['encodings'])
+        with open(os.path.join(base_dir, 'js', 'main.js.gz'), 'rb') as f:
+            self.assertEqual(f.read(), b'provided by the component')
+
+    def test_deploy_prepares_media_redeploy(self):
+
+        deployer, base_dir, manifest = self.deploy_media_and_read_manifest()
+        os.remove(os.path.join(base_dir, 'index.html'))
+
+        f = BytesIO()
+        zf = zipfile.ZipFile(f, 'w')
+        with open(os.path.join(base_dir, 'config.xml'), 'rb') as config_file:
+            zf.writestr('config.xml', config_file.read())
+        zf.writestr('index.html', b'<html></html>')
+        zf.close()
+        deployer.deploy(WgtFile(f))
+
+        self.assertFalse(os.path.exists(os.path.join(base_dir, 'index.html.gz')))
+        self.assertTrue(os.path.exists(os.path.join(base_dir, 'index.html')))
+
 
 class HTTPUtilsTestCase(TestCase):
 
@@ -450,6 +804,78 @@ class HTTPUtilsTestCase(TestCase):
             self.assertNotEqual(response, None)
             serve_mock.assert_called_once_with('manage.py', '/')
 
+    @override_settings(USE_XSENDFILE=False, DEBUG=False)
+    def test_build_downloadfile_response_precompressed(self):
+
+        deployer, base_dir = deploy_media_wgt(self)
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        response = build_downloadfile_response(request, 'index.html', base_dir)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/html')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), MEDIA_INDEX_CODE)
+        response.close()
+
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        identity_response = build_downloadfile_response(request, 'index.html', base_dir)
+        self.assertFalse(identity_response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(identity_response.streaming_content), MEDIA_INDEX_CODE)
+        self.assertEqual(response['ETag'], identity_response['ETag'][:-1] + '-gzip"')
+        identity_response.close()
+
+    @override_settings(USE_XSENDFILE=False)
+    def test_build_downloadfile_response_precompressed_not_modified(self):
+
+        deployer, base_dir = deploy_media_wgt(self)
+        response = build_downloadfile_response(RequestFactory().get('/'), 'index.html', base_dir)
+        response.close()
+
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        response = build_downloadfile_response(request, 'index.html', base_dir)
+        self.assertEqual(response.status_code, 304)
+
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH='"other", ' + response['ETag'][:-1] + '-gzip"')
+        response = build_downloadfile_response(request, 'index.html', base_dir)
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+
+    @override_settings(USE_XSENDFILE=False, DEBUG=False)
+    def test_build_downloadfile_response_precompressed_mutable(self):
+
+        deployer, base_dir = deploy_media_wgt(self)
+        response = build_downloadfile_response(RequestFactory().get('/'), 'index.html', base_dir, immutable=False)
+        response.close()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=0')
+        self.assertIn('ETag', response)
+
+    @override_settings(USE_XSENDFILE=True)
+    def test_build_downloadfile_response_precompressed_sendfile(self):
+
+        deployer, base_dir = deploy_media_wgt(self)
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = build_downloadfile_response(request, 'index.html', base_dir)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], os.path.join(base_dir, 'index.html.gz'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    @override_settings(USE_XSENDFILE=False)
+    def test_build_downloadfile_response_file_not_in_manifest(self):
+
+        deployer, base_dir = deploy_media_wgt(self)
+        with open(os.path.join(base_dir, 'extra.txt'), 'wb') as f:
+            f.write(b'extra')
+
+        request = RequestFactory().get('/')
+        with patch('django.views.static.serve') as serve_mock:
+            build_downloadfile_response(request, 'extra.txt', base_dir)
+            serve_mock.assert_called_once_with(request, 'extra.txt', document_root=base_dir)
+
     def test_normalize_boolean_param_string(self):
 
         request = self._prepare_request_mock()
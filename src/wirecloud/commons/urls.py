@@ -31,6 +31,11 @@ urlpatterns = (
         views.cached_javascript_catalog,
         name="wirecloud.javascript_translation_catalogue"),
 
+    # Instrumentation
+    url(r'^api/admin/instrumentation$',
+        views.InstrumentationEntry(permitted_methods=('GET', 'DELETE')),
+        name='wirecloud.instrumentation'),
+
     # OAuth2
     url('^oauth2/default_redirect_uri$',
         TemplateView.as_view(template_name='wirecloud/oauth2/default_redirect_uri.html'),
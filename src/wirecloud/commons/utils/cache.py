@@ -17,11 +17,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+from functools import wraps
 import hashlib
+import random
+import threading
 import time
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ObjectDoesNotExist
 from django.http import HttpResponse
+from django.utils import translation
 from django.utils.http import http_date
+from django.utils.translation import ugettext as _
+
+from wirecloud.commons.exceptions import HttpBadCredentials
 
 
 def patch_cache_headers(response, timestamp=None, cache_timeout=None, etag=None):
@@ -50,6 +62,214 @@ def patch_cache_headers(response, timestamp=None, cache_timeout=None, etag=None)
     return response
 
 
+def get_cache_version(key):
+
+    return get_cache_versions((key,))[key]
+
+
+def get_cache_versions(keys):
+    """
+    Returns the current version stored on each of the given version keys,
+    initializing the missing ones. Versions are retrieved using a single cache
+    request.
+    """
+
+    versions = cache.get_many(keys)
+
+    missing_versions = {key: random.randrange(1, 100000) for key in keys if key not in versions}
+    if len(missing_versions) > 0:
+        cache.set_many(missing_versions)
+        versions.update(missing_versions)
+
+    return versions
+
+
+def invalidate_cache_version(key):
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+# Max time (in seconds) a process can hold a single-flight lock
+SINGLE_FLIGHT_LOCK_TIMEOUT = 30
+# Max time (in seconds) to wait for a value being computed by other process
+SINGLE_FLIGHT_MAX_WAIT = 5
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+
+def _build_single_flight_lock_key(keys):
+    return '_single_flight_lock/%s' % hashlib.sha1('|'.join(keys).encode('utf-8')).hexdigest()
+
+
+def _run_single_flight(lock_key, compute, lookup, stale=None, max_wait=SINGLE_FLIGHT_MAX_WAIT):
+
+    # cache.add is atomic on all the Django cache backends
+    if cache.add(lock_key, True, SINGLE_FLIGHT_LOCK_TIMEOUT):
+        try:
+            return compute()
+        finally:
+            cache.delete(lock_key)
+
+    # Other process is already computing this value
+    if stale is not None:
+        value = stale()
+        if value is not None:
+            return value
+
+    deadline = time.monotonic() + max_wait
+    while time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+        value = lookup()
+        if value is not None:
+            return value
+
+        if cache.get(lock_key) is None:
+            # The other process failed computing the value
+            break
+
+    return compute()
+
+
+def get_or_set_single_flight(key, compute, timeout=DEFAULT_TIMEOUT, stale_key=None, max_wait=SINGLE_FLIGHT_MAX_WAIT, stale_timeout=None):
+    """
+    Returns the value stored on the cache for the given key, calling compute
+    and storing its result if there is no such value. Only one process
+    computes the value at a time, other processes wait for it (up to max_wait
+    seconds) or, if stale_key is provided, use the last value stored using
+    that stale_key. compute must not return None. timeout can also be a
+    function returning the timeout to use for the computed value. Stale
+    values are kept for stale_timeout seconds (timeout by default).
+    """
+
+    if stale_key is None:
+        value = cache.get(key)
+    else:
+        values = cache.get_many((key, stale_key))
+        value = values.get(key)
+
+    if value is not None:
+        return value
+
+    def compute_and_store():
+        value = compute()
+        value_timeout = timeout(value) if callable(timeout) else timeout
+        if stale_key is None:
+            cache.set(key, value, value_timeout)
+        elif stale_timeout is None:
+            cache.set_many({key: value, stale_key: value}, value_timeout)
+        else:
+            cache.set(key, value, value_timeout)
+            cache.set(stale_key, value, stale_timeout)
+        return value
+
+    stale = (lambda: values.get(stale_key)) if stale_key is not None else None
+    return _run_single_flight(_build_single_flight_lock_key((key,)), compute_and_store, lambda: cache.get(key), stale=stale, max_wait=max_wait)
+
+
+def get_many_or_set_single_flight(keys, compute, timeout=DEFAULT_TIMEOUT, max_wait=SINGLE_FLIGHT_MAX_WAIT):
+    """
+    Bulk version of get_or_set_single_flight. keys is a dict mapping items to
+    cache keys, compute is called with the list of items missing on the
+    cache and should return a dict mapping those items to their values.
+    Returns a dict mapping the items to their values (items not returned by
+    compute are not included).
+    """
+
+    values = cache.get_many(keys.values())
+    missing = [item for item, key in keys.items() if key not in values]
+
+    if len(missing) > 0:
+        missing_keys = sorted(keys[item] for item in missing)
+
+        def compute_and_store():
+            new_values = {keys[item]: value for item, value in compute(missing).items()}
+            cache.set_many(new_values, timeout)
+            return new_values
+
+        def lookup():
+            found = cache.get_many(missing_keys)
+            return found if len(found) == len(missing_keys) else None
+
+        values.update(_run_single_flight(_build_single_flight_lock_key(missing_keys), compute_and_store, lookup, max_wait=max_wait))
+
+    return {item: values[key] for item, key in keys.items() if key in values}
+
+
+API_TOKEN_CACHE_TIMEOUT = 300
+API_TOKEN_NEGATIVE_CACHE_TIMEOUT = 30
+
+
+def build_api_token_cache_key(namespace, token):
+    # Tokens are not stored in plain text on the cache
+    return '_api_token/%s/%s' % (namespace, hashlib.sha256(token.encode('utf-8')).hexdigest())
+
+
+def invalidate_api_tokens(namespace, tokens):
+
+    cache.delete_many([build_api_token_cache_key(namespace, token) for token in tokens])
+
+
+def cache_api_token_auth(namespace):
+    """
+    Decorator caching the results of an API auth backend. The decorated
+    backend must return the authenticated user and the expiration timestamp
+    of the token (or None if unknown). Valid tokens are cached until they
+    expire (up to WIRECLOUD_API_TOKEN_CACHE_TIMEOUT seconds) and bad tokens
+    for WIRECLOUD_API_TOKEN_NEGATIVE_CACHE_TIMEOUT seconds.
+
+    Only the id of the user is cached, so a hit still costs a primary key
+    lookup (users deleted meanwhile are reported as bad credentials).
+    HttpBadCredentials messages should be lazy translations, the cache stores
+    their untranslated version and translates it again on each hit.
+    """
+
+    def wrap(func):
+
+        @wraps(func)
+        def wrapper(auth_type, token):
+            from django.contrib.auth.models import User
+
+            key = build_api_token_cache_key(namespace, token)
+            entry = cache.get(key)
+            if entry is not None:
+                if entry[0] == 'user':
+                    return User.objects.get(pk=entry[1])
+                elif entry[1] is not None:
+                    raise HttpBadCredentials(_(entry[1]), entry[2])
+                else:
+                    raise ObjectDoesNotExist()
+
+            negative_timeout = getattr(settings, 'WIRECLOUD_API_TOKEN_NEGATIVE_CACHE_TIMEOUT', API_TOKEN_NEGATIVE_CACHE_TIMEOUT)
+            try:
+                user, expires_at = func(auth_type, token)
+            except HttpBadCredentials as e:
+                if negative_timeout > 0:
+                    with translation.override(None):
+                        message = str(e.message)
+                    cache.set(key, ('error', message, e.error_info), negative_timeout)
+                raise
+            except ObjectDoesNotExist:
+                if negative_timeout > 0:
+                    cache.set(key, ('error', None, None), negative_timeout)
+                raise
+
+            timeout = getattr(settings, 'WIRECLOUD_API_TOKEN_CACHE_TIMEOUT', API_TOKEN_CACHE_TIMEOUT)
+            if expires_at is not None:
+                timeout = min(timeout, int(expires_at - time.time()))
+
+            if timeout > 0:
+                cache.set(key, ('user', user.pk), timeout)
+
+            return user
+
+        return wrapper
+
+    return wrap
+
+
 class CacheableData(object):
 
     def __init__(self, data, timestamp=None, timeout=0, content_type='application/json; charset=UTF-8'):
@@ -74,3 +294,58 @@ class CacheableData(object):
             patch_cache_headers(response, self.timestamp, self.timeout)
 
         return response
+
+
+class LRUCache(object):
+    """
+    Size-bounded, thread-safe and process-local cache. Entries are evicted in
+    least recently used order.
+    """
+
+    def __init__(self, max_entries=1000):
+
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+
+            return self._data[key]
+
+    def set(self, key, value):
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+
+        return key in self._data
+
+    def __len__(self):
+
+        return len(self._data)
@@ -127,6 +127,7 @@ def load_default_wirecloud_conf(settings, instance_type='platform'):
 
     settings['URL_MIDDLEWARE_CLASSES'] = {
         'default': (
+            'wirecloud.commons.middleware.InstrumentationMiddleware',
             'django.middleware.security.SecurityMiddleware',
             'django.contrib.sessions.middleware.SessionMiddleware',
             'django.middleware.http.ConditionalGetMiddleware',
@@ -137,6 +138,7 @@ def load_default_wirecloud_conf(settings, instance_type='platform'):
             'django.contrib.messages.middleware.MessageMiddleware',
         ),
         'api': (
+            'wirecloud.commons.middleware.InstrumentationMiddleware',
             'django.middleware.security.SecurityMiddleware',
             'django.contrib.sessions.middleware.SessionMiddleware',
             'django.middleware.http.ConditionalGetMiddleware',
@@ -146,6 +148,7 @@ def load_default_wirecloud_conf(settings, instance_type='platform'):
             'wirecloud.commons.middleware.AuthenticationMiddleware',
         ),
         'proxy': (
+            'wirecloud.commons.middleware.InstrumentationMiddleware',
             'django.middleware.security.SecurityMiddleware',
             'django.contrib.sessions.middleware.SessionMiddleware',
             'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -81,7 +81,7 @@ def filter_changelog(code, from_version):
     for header in doc.xpath('/div/h1|/div/h2|/div/h3'):
         title = header.text[1:] if header.text.startswith('v') else header.text
         try:
-            version = Version(VERSION_HEADER_RE.split(title, 1)[0])
+            version = Version.parse(VERSION_HEADER_RE.split(title, 1)[0])
         except ValueError:
             continue
 
@@ -97,7 +97,7 @@ def filter_changelog(code, from_version):
         for header in parentelement.xpath(headerelement):
             title = header.text[1:] if header.text.startswith('v') else header.text
             try:
-                version = Version(VERSION_HEADER_RE.split(title, 1)[0])
+                version = Version.parse(VERSION_HEADER_RE.split(title, 1)[0])
             except ValueError:
                 continue
 
@@ -18,14 +18,17 @@
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import mimetypes
 import os
 import posixpath
 import socket
 from urllib.parse import urljoin, urlparse, unquote
 
 from django.urls import reverse
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, Http404
+from django.utils.cache import patch_vary_headers
 from django.utils.encoding import smart_str
+from django.utils.http import http_date
 from django.utils.translation import ugettext as _
 from lxml import etree
 
@@ -411,11 +414,116 @@ def build_sendfile_response(file_path, document_root):
     return response
 
 
-def build_downloadfile_response(request, file_path, base_dir):
+# Content codings that can be used for serving component files, sorted by
+# preference
+MEDIA_ENCODINGS = ('br', 'gzip')
+MEDIA_CACHE_TIMEOUT = 31536000  # 1 year
+
+
+def get_accepted_encodings(request):
+
+    encodings = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        parts = item.split(';')
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, _sep, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if coding != '' and quality > 0:
+            encodings.add(coding)
+
+    return encodings
+
+
+def build_media_response(request, file_path, base_dir, immutable=True):
+    """
+    Builds a response for a file deployed by WgtDeployer, using the info
+    stored on the media manifest: the content hash is used as a strong ETag
+    and pre-compressed variants are selected depending on the
+    Accept-Encoding header. Returns None if the file is not described by the
+    media manifest. Files of components that can be redeployed using the
+    same version (e.g. -dev versions) should use immutable=False, so clients
+    revalidate them using the ETag.
+    """
+
+    from django.conf import settings
+    from wirecloud.commons.utils.wgt import get_media_manifest
+
+    manifest = get_media_manifest(base_dir)
+    if manifest is None:
+        return None
+
+    path = posixpath.normpath(file_path).lstrip('/')
+    entry = manifest['files'].get(path)
+    if entry is None:
+        return None
+
+    content_type, content_encoding = mimetypes.guess_type(path)
+
+    # Each variant uses its own strong ETag, as their contents are different
+    etag = '"%s"' % entry['hash']
+    validators = set([etag] + ['"%s-%s"' % (entry['hash'], encoding) for encoding in entry['encodings']])
+
+    served_path = path
+    accepted_encodings = get_accepted_encodings(request)
+    for encoding in MEDIA_ENCODINGS:
+        if encoding in entry['encodings'] and encoding in accepted_encodings:
+            served_path = entry['encodings'][encoding]
+            content_encoding = encoding
+            etag = '"%s-%s"' % (entry['hash'], encoding)
+            break
+
+    fullpath = os.path.join(base_dir, served_path.replace('/', os.sep))
+    try:
+        stat = os.stat(fullpath)
+    except OSError:
+        return None
+
+    if_none_match = [value.strip() for value in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+    if not validators.isdisjoint(if_none_match) or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    elif getattr(settings, 'USE_XSENDFILE', False):
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        response['X-Sendfile'] = smart_str(fullpath)
+    else:
+        # FileResponse uses the wsgi.file_wrapper provided by the server (if
+        # any), allowing it to use sendfile for sending the file contents
+        response = FileResponse(open(fullpath, 'rb'))
+        # FileResponse guesses the content type using the name of the file
+        response['Content-Type'] = content_type or 'application/octet-stream'
+
+    if content_encoding is not None and response.status_code == 200:
+        response['Content-Encoding'] = content_encoding
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if len(entry['encodings']) > 0:
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+    # Component files are versioned, so they can be cached forever
+    if settings.DEBUG or not immutable:
+        response['Cache-Control'] = 'private, max-age=0'
+    else:
+        response['Cache-Control'] = 'private, max-age=%s, immutable' % MEDIA_CACHE_TIMEOUT
+
+    return response
+
+
+def build_downloadfile_response(request, file_path, base_dir, immutable=True):
 
     from django.conf import settings
     from django.views.static import serve
 
+    response = build_media_response(request, file_path, base_dir, immutable=immutable)
+    if response is not None:
+        return response
+
     if not getattr(settings, 'USE_XSENDFILE', False):
         return serve(request, file_path, document_root=base_dir)
     else:
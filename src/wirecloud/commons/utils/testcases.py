@@ -19,6 +19,7 @@
 
 import codecs
 import copy
+from functools import partial
 from http.cookies import SimpleCookie
 from io import BytesIO
 import mimetypes
@@ -106,7 +107,9 @@ def restoretree(backup_path, dest_path):
 class RealWebServer(object):
 
     def __init__(self):
-        self._request_method = requests.request
+        # Use the original request method as the requests module is mocked
+        # while running the tests
+        self._request_method = partial(requests.Session.request, requests.Session())
 
     def request(self, method, url, *args, **kwargs):
         response = self._request_method(method, url, *args, **kwargs)
@@ -233,6 +236,10 @@ class StreamContent(object):
 
         return self._content.__iter__()
 
+    def close(self):
+
+        self._content.close()
+
 
 class FakeNetwork(object):
 
@@ -293,10 +300,16 @@ class FakeNetwork(object):
             res_info = self('POST', url, *args, **kwargs)
             return self._prepare_response(res_info, url)
 
+        def session_request_mock(session, method, url, *args, **kwargs):
+            return request_mock(method, url, *args, **kwargs)
+
         self.patcher = mock.patch.multiple('requests', get=get_mock, post=post_mock, request=request_mock)
         self.patcher.start()
+        self.session_patcher = mock.patch.object(requests.Session, 'request', session_request_mock)
+        self.session_patcher.start()
 
     def unmock_requests(self):
+        self.session_patcher.stop()
         self.patcher.stop()
 
 
@@ -399,6 +412,13 @@ class WirecloudTestCase(object):
             # Reload the connection
             haystack.connections.connections_info = settings.HAYSTACK_CONNECTIONS
             haystack.connections.reload('default')
+
+            # TestCase transactions are never committed, so search indexes
+            # have to be updated without waiting for the commit
+            signal_processor = apps.get_app_config('haystack').signal_processor
+            cls.old_deferred_search_indexing = getattr(signal_processor, 'deferred', False)
+            if issubclass(cls, TestCase):
+                signal_processor.deferred = False
         else:
             apps.get_app_config('haystack').signal_processor.teardown()
 
@@ -430,6 +450,7 @@ class WirecloudTestCase(object):
                 # test basis in the tearDown method
                 management.call_command('clear_index', interactive=False, verbosity=0)
 
+            apps.get_app_config('haystack').signal_processor.deferred = cls.old_deferred_search_indexing
             settings.HAYSTACK_CONNECTIONS = cls.old_haystack_conf
 
         # Clear cache
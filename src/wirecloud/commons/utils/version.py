@@ -18,6 +18,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import lru_cache
+
 import regex
 
 
@@ -25,13 +27,17 @@ def cmp(a, b):
     return (a > b) - (a < b)
 
 
+PRERELEASE_TYPES = ('a', 'b', 'rc')
+
+
 class Version(object):
 
+    __slots__ = ('vstring', 'version', 'prerelease', 'dev', 'reverse', 'key')
+
     version_re = regex.compile(r'^([1-9]\d*|0)((?:\.(?:[1-9]\d*|0))*)(?:(a|b|rc)([1-9]\d*))?(-dev.*)?$')
 
     def __init__(self, vstring, reverse=False):
 
-        self.vstring = vstring
         match = self.version_re.match(vstring)
 
         if not match:
@@ -40,68 +46,120 @@ class Version(object):
         (major, patch, prerelease, prerelease_num, dev) = match.group(1, 2, 3, 4, 5)
 
         if patch:
-            self.version = tuple(map(int, [major] + patch[1:].split('.')))
+            version = tuple(map(int, [major] + patch[1:].split('.')))
         else:
-            self.version = (int(major),)
+            version = (int(major),)
 
         if prerelease:
-            self.prerelease = (prerelease, int(prerelease_num))
+            prerelease = (prerelease, int(prerelease_num))
         else:
-            self.prerelease = None
-
-        self.dev = True if dev else False
+            prerelease = None
+
+        # Tuple following the ordering of the versions:
+        # - trailing zeros are not significant (1.0 == 1.0.0)
+        # - development versions are lower than any other version
+        # - prereleases are lower than final versions
+        significant = version
+        while len(significant) > 0 and significant[-1] == 0:
+            significant = significant[:-1]
+
+        key = (
+            significant,
+            0 if dev else 1,
+            (0, PRERELEASE_TYPES.index(prerelease[0]), prerelease[1]) if prerelease else (1,),
+        )
+
+        setattr_ = super(Version, self).__setattr__
+        setattr_('vstring', vstring)
+        setattr_('version', version)
+        setattr_('prerelease', prerelease)
+        setattr_('dev', True if dev else False)
+        setattr_('reverse', reverse)
+        setattr_('key', key)
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def parse(vstring):
+        """
+        Returns a (shared) Version instance for the given version string.
+        Version instances are immutable, so this method caches the most
+        recently parsed versions to avoid parsing them again.
+        """
+
+        return Version(vstring)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Version instances are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Version instances are immutable")
+
+    def __reduce__(self):
+        return (Version, (self.vstring, self.reverse))
+
+    def __repr__(self):
+        return "Version('%s')" % self.vstring
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def get_sort_key(self):
+        """
+        Returns a string that sorts (using a plain character by character
+        comparison) in the same order as this version. Only digits are used
+        so the order does not depend on the collation used by the database.
+        """
+
+        def encode_number(number):
+            digits = str(number)
+            if len(digits) > 9:
+                raise ValueError("version component too big '%s'" % self.vstring)
+            return str(len(digits)) + digits
+
+        (version, release, prerelease) = self.key
+
+        key = ''.join(encode_number(number) for number in version) + '0'
+        key += str(release)
+        if prerelease[0] == 0:
+            key += '0' + str(prerelease[1]) + encode_number(prerelease[2])
+        else:
+            key += '1'
 
-        self.reverse = reverse
+        return key
 
-    def __cmp__(self, other):
+    def _coerce(self, other):
 
         if isinstance(other, str):
-            other = Version(other)
+            return Version.parse(other)
 
         if not isinstance(other, Version):
             raise ValueError("invalid version number '%s'" % other)
 
-        maxlen = max(len(self.version), len(other.version))
-        compare = cmp(self.version + (0,) * (maxlen - len(self.version)), other.version + (0,) * (maxlen - len(other.version)))
-
-        if compare == 0:
-
-            # First check if only one of them is a development version
-            if self.dev != other.dev:
-                compare = 1 if other.dev else -1
+        return other
 
-            # case 1: neither has prerelease; they're equal
-            elif not self.prerelease and not other.prerelease:
-                compare = 0
-
-            # case 2: self has prerelease, other doesn't; other is greater
-            elif self.prerelease and not other.prerelease:
-                compare = -1
-
-            # case 3: self doesn't have prerelease, other does: self is greater
-            elif not self.prerelease and other.prerelease:
-                compare = 1
-
-            # case 4: both have prerelease: must compare them!
-            else:
-                compare = cmp(self.prerelease, other.prerelease)
+    def __cmp__(self, other):
 
+        compare = cmp(self.key, self._coerce(other).key)
         return compare if not self.reverse else (compare * -1)
 
     def __eq__(self, other):
-        return self.__cmp__(other) == 0
+        return self.key == self._coerce(other).key
+
+    def __ne__(self, other):
+        return self.key != self._coerce(other).key
 
     def __ge__(self, other):
-        return self.__cmp__(other) >= 0
+        other = self._coerce(other)
+        return self.key >= other.key if not self.reverse else self.key <= other.key
 
     def __gt__(self, other):
-        return self.__cmp__(other) > 0
+        other = self._coerce(other)
+        return self.key > other.key if not self.reverse else self.key < other.key
 
     def __le__(self, other):
-        return self.__cmp__(other) <= 0
+        other = self._coerce(other)
+        return self.key <= other.key if not self.reverse else self.key >= other.key
 
     def __lt__(self, other):
-        return self.__cmp__(other) < 0
-
-    def __ne__(self, other):
-        return self.__cmp__(other) != 0
+        other = self._coerce(other)
+        return self.key < other.key if not self.reverse else self.key > other.key
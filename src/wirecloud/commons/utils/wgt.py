@@ -17,16 +17,94 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+import gzip
+import hashlib
 from io import BytesIO
+import json
+import mimetypes
 import os
 import re
 from shutil import rmtree
 from urllib.request import pathname2url
 import zipfile
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from wirecloud.commons.utils.cache import LRUCache
 from wirecloud.commons.utils.template import TemplateParser
 
 
+MEDIA_MANIFEST_FILENAME = '.wirecloud-media.json'
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'application/javascript',
+    'application/json',
+    'application/manifest+json',
+    'application/x-javascript',
+    'application/xhtml+xml',
+    'application/xml',
+    'image/svg+xml',
+    'image/x-icon',
+))
+# Files smaller than this are served uncompressed
+MIN_COMPRESSIBLE_SIZE = 256
+
+
+def get_media_encodings():
+    """
+    Returns the (content coding, file extension, compress function) tuples
+    used for pre-compressing component files, sorted by preference.
+    """
+
+    encodings = []
+    if brotli is not None:
+        encodings.append(('br', '.br', lambda contents: brotli.compress(contents)))
+    encodings.append(('gzip', '.gz', lambda contents: gzip.compress(contents, compresslevel=9, mtime=0)))
+
+    return encodings
+
+
+def is_compressible(filename, size):
+
+    if size < MIN_COMPRESSIBLE_SIZE:
+        return False
+
+    mimetype, encoding = mimetypes.guess_type(filename)
+    return encoding is None and mimetype is not None and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES)
+
+
+_media_manifests = LRUCache(1000)
+
+
+def get_media_manifest(base_dir):
+    """
+    Returns the media manifest written by WgtDeployer for the given
+    component folder or None if the folder has no manifest (e.g. components
+    deployed using previous versions of WireCloud).
+    """
+
+    path = os.path.join(base_dir, MEDIA_MANIFEST_FILENAME)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    entry = _media_manifests.get(base_dir)
+    if entry is not None and entry[0] == mtime:
+        return entry[1]
+
+    try:
+        with open(path, 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+    except (IOError, ValueError):
+        return None
+
+    _media_manifests.set(base_dir, (mtime, manifest))
+    return manifest
+
+
 class InvalidContents(Exception):
 
     def __init__(self, message, details=None):
@@ -199,10 +277,67 @@ class WgtDeployer(object):
         template_parser.set_base(pathname2url(widget_rel_dir) + '/')
 
         self._create_folders(widget_dir)
+        self._remove_media_variants(widget_dir)
         wgt_file.extract(widget_dir)
+        self.prepare_media(wgt_file, widget_dir)
 
         return template_parser
 
+    def prepare_media(self, wgt_file, widget_dir):
+        """
+        Computes the hash of the contents of the files extracted from the given
+        wgt file and writes pre-compressed variants of them. This info is
+        stored into a manifest file used when serving component files (see
+        wirecloud.commons.utils.http.build_downloadfile_response).
+        """
+
+        filenames = set(name for name in wgt_file.namelist() if not name.endswith('/'))
+        encodings = get_media_encodings()
+
+        files = {}
+        for name in filenames:
+            if name == MEDIA_MANIFEST_FILENAME:
+                continue
+
+            contents = wgt_file.read(name)
+            entry = {
+                'hash': hashlib.sha256(contents).hexdigest(),
+                'encodings': {},
+            }
+
+            if is_compressible(name, len(contents)):
+                for encoding, extension, compress in encodings:
+                    # Don't overwrite files provided by the component
+                    if name + extension in filenames:
+                        continue
+
+                    compressed = compress(contents)
+                    if len(compressed) >= len(contents):
+                        continue
+
+                    with open(os.path.join(widget_dir, (name + extension).replace('/', os.sep)), 'wb') as f:
+                        f.write(compressed)
+                    entry['encodings'][encoding] = name + extension
+
+            files[name] = entry
+
+        with open(os.path.join(widget_dir, MEDIA_MANIFEST_FILENAME), 'wb') as f:
+            f.write(json.dumps({'files': files}, sort_keys=True).encode('utf-8'))
+
+    def _remove_media_variants(self, widget_dir):
+
+        # Remove pre-compressed files from previous deployments
+        manifest = get_media_manifest(widget_dir)
+        if manifest is None:
+            return
+
+        for entry in manifest['files'].values():
+            for name in entry['encodings'].values():
+                try:
+                    os.remove(os.path.join(widget_dir, name.replace('/', os.sep)))
+                except OSError:
+                    pass
+
     def undeploy(self, vendor, name, version):
 
         base_dir = self.get_base_dir(vendor, name, version)
@@ -36,6 +36,7 @@ from django.views.decorators.cache import cache_page
 from django.views.i18n import get_formats, JavaScriptCatalog
 
 from wirecloud.commons.baseviews import Resource, Service
+from wirecloud.commons.instrumentation import get_instrumentation
 from wirecloud.platform.plugins import get_plugins
 from wirecloud.commons.utils.http import authentication_required, build_error_response, get_html_basic_error_response, consumes, parse_json_request, produces
 from wirecloud.commons.search_indexes import get_search_engine, is_available
@@ -215,6 +216,31 @@ class ResourceSearch(Resource):
         return HttpResponse(json.dumps(result, sort_keys=True), status=200, content_type='application/json; charset=utf-8')
 
 
+class InstrumentationEntry(Resource):
+
+    @authentication_required
+    @produces(('application/json',))
+    def read(self, request):
+
+        if not request.user.is_staff:
+            return build_error_response(request, 403, _('You are not allowed to read the instrumentation stats'))
+
+        instrumentation = get_instrumentation()
+        if not instrumentation.enabled:
+            return build_error_response(request, 404, _('Instrumentation is disabled'))
+
+        return HttpResponse(json.dumps(instrumentation.get_stats(), sort_keys=True), content_type='application/json; charset=utf-8')
+
+    @authentication_required
+    def delete(self, request):
+
+        if not request.user.is_staff:
+            return build_error_response(request, 403, _('You are not allowed to reset the instrumentation stats'))
+
+        get_instrumentation().clear()
+        return HttpResponse(status=204)
+
+
 class SwitchUserService(Service):
 
     @authentication_required
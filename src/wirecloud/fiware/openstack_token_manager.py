@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 # Copyright (c) 2014-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
 
 # This file is part of Wirecloud.
 
@@ -17,13 +18,29 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
+import time
 
-import requests
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
 
+from wirecloud.commons.utils.cache import get_or_set_single_flight
+from wirecloud.proxy.pool import SessionPool
 from wirecloud.proxy.utils import ValidationError
 
 
+OPENSTACK_TOKEN_CACHE_TIMEOUT = 3600
+# Cached tokens are discarded this number of seconds before they expire
+OPENSTACK_TOKEN_EXPIRATION_MARGIN = 60
+OPENSTACK_MAX_CONCURRENT_REQUESTS = 8
+
+# Keystone requests are made using pooled sessions, so connections to the
+# cloud server are reused between requests and threads
+session_pool = SessionPool.from_settings()
+
+
 def first_step_openstack(url, idmtoken):
     payload = {
         "auth": {
@@ -41,7 +58,7 @@ def first_step_openstack(url, idmtoken):
         "Content-Type": "application/json"
     }
 
-    return requests.post(url, headers=headers, data=json.dumps(payload), verify=False)
+    return session_pool.request('POST', url, headers=headers, data=json.dumps(payload), verify=False)
 
 
 def getProjects(url, generalToken, username):
@@ -52,7 +69,7 @@ def getProjects(url, generalToken, username):
 
     payload = {"user.id": username}
 
-    return requests.get(url, headers=headers, params=payload, verify=False)
+    return session_pool.request('GET', url, headers=headers, params=payload, verify=False)
 
 
 def getProjectPermissions(url, token):
@@ -61,7 +78,7 @@ def getProjectPermissions(url, token):
         "Accept": "application/json"
     }
 
-    return requests.get(url, headers=headers, verify=False)
+    return session_pool.request('GET', url, headers=headers, verify=False)
 
 
 def get_openstack_project_token(url, projectid, idmtoken):
@@ -83,7 +100,29 @@ def get_openstack_project_token(url, projectid, idmtoken):
 
     headers = {"Content-Type": "application/json"}
 
-    return requests.post(url, headers=headers, data=json.dumps(payload), verify=False)
+    return session_pool.request('POST', url, headers=headers, data=json.dumps(payload), verify=False)
+
+
+def get_subject_token(response):
+
+    token = response.headers.get("x-subject-token")
+    if not (200 <= response.status_code < 300) or token is None:
+        raise ValidationError("Error obtaining an OpenStack token (status code: %s)" % response.status_code)
+
+    return token
+
+
+def get_token_expiration(response):
+
+    try:
+        expires_at = parse_datetime(response.json()["token"]["expires_at"])
+    except (ValueError, TypeError, KeyError):
+        expires_at = None
+
+    if expires_at is None:
+        raise ValidationError("Keystone didn't provide the expiration time of the OpenStack token")
+
+    return expires_at.timestamp()
 
 
 class OpenstackTokenManager(object):
@@ -97,38 +136,70 @@ class OpenstackTokenManager(object):
         if oauth_info.access_token is None:
             raise ValidationError("User doesn't have an access token")
 
-        opentok = oauth_info.extra_data.get('openstack_token')
         tenantid = "__default__" if tenantid is None else tenantid
-        if opentok is None or opentok.get(tenantid):
-            opentok = self.get_openstack_token(user.username, oauth_info.access_token, tenantid)
-            oauth_info.extra_data['openstack_token'][tenantid] = opentok
-            oauth_info.save()
+
+        # Tokens are cached per user and tenant. The IdM token is also part
+        # of the key, so cached tokens are not used once it is renewed
+        key = '_openstack_token/%s/%s' % (user.pk, hashlib.sha256(('%s/%s' % (oauth_info.access_token, tenantid)).encode('utf-8')).hexdigest())
+        opentok, expires_at = get_or_set_single_flight(
+            key,
+            lambda: self.get_openstack_token(user.username, oauth_info.access_token, tenantid),
+            self.get_cache_timeout
+        )
 
         return opentok
 
+    def get_cache_timeout(self, value):
+
+        timeout = getattr(settings, 'WIRECLOUD_OPENSTACK_TOKEN_CACHE_TIMEOUT', OPENSTACK_TOKEN_CACHE_TIMEOUT)
+        expires_at = value[1]
+        if expires_at is not None:
+            timeout = min(timeout, int(expires_at - time.time()) - OPENSTACK_TOKEN_EXPIRATION_MARGIN)
+
+        # Tokens about to expire are reused for, at least, one second
+        return max(timeout, 1)
+
     def get_openstack_token(self, username, idmtoken, tenantid):
+        """
+        Returns the token and its expiration timestamp for the first cloud
+        project of the user matching the given tenantid. Raises a
+        ValidationError if Keystone doesn't provide a valid token, so no
+        value is cached.
+        """
+
         # We love FIWARE process to get the token <3
 
         # Fist we get an initial token
         firstResponse = first_step_openstack("{}/keystone/v3/auth/tokens".format(self.url), idmtoken)
-        generalToken = firstResponse.headers.get("x-subject-token")
+        generalToken = get_subject_token(firstResponse)
 
         # Then we ask for all the projects the user have
         projectsResponse = getProjects("{}/keystone/v3/role_assignments".format(self.url), generalToken, username)
         projects = projectsResponse.json()
 
+        projectids = []
         for role in projects.get("role_assignments"):
             if role.get("scope") is not None and role["scope"].get("project") is not None:
                 projectid = role["scope"]["project"]["id"]
+                if projectid not in projectids and (tenantid == "__default__" or projectid == tenantid):
+                    projectids.append(projectid)
+
+        if len(projectids) > 0:
 
-                # Ask for permissions for every project
+            def get_permissions(projectid):
                 response = getProjectPermissions("{}/keystone/v3/projects/{}".format(self.url, projectid), generalToken)
-                responseJson = response.json()
-                if responseJson.get("project").get("is_cloud_project") and (tenantid == "__default__" or responseJson.get("project").get("id") == tenantid):
+                return response.json()
+
+            # Ask for permissions for every project
+            with ThreadPoolExecutor(max_workers=min(len(projectids), OPENSTACK_MAX_CONCURRENT_REQUESTS)) as executor:
+                permissions = list(executor.map(get_permissions, projectids))
+
+            for projectid, responseJson in zip(projectids, permissions):
+                if responseJson.get("project").get("is_cloud_project"):
 
                     # And if the project was cloud, we finally ask for the token
                     projectTokenR = get_openstack_project_token("{}/keystone/v3/auth/tokens".format(self.url), projectid, idmtoken)
-                    return projectTokenR.headers.get("x-subject-token")
+                    return get_subject_token(projectTokenR), get_token_expiration(projectTokenR)
 
         # if we are here, we didn't detected any openstack token
         raise Exception
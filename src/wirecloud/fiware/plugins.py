@@ -24,8 +24,11 @@ from django.conf import settings
 from django.conf.urls import url
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.cache import cache_page
+import requests
 
 from wirecloud.catalogue.models import CatalogueResource
+from wirecloud.commons.exceptions import HttpBadCredentials
+from wirecloud.commons.utils.cache import cache_api_token_auth
 from wirecloud.commons.utils.wgt import WgtFile
 from wirecloud.platform.core.plugins import get_version_hash
 from wirecloud.platform.localcatalogue.utils import install_component
@@ -53,11 +56,20 @@ BAE_SEARCH_FILTERS_WIDGET = os.path.join(BASE_PATH, 'initial', 'CoNWeT_bae-searc
 BAE_MASHUP = os.path.join(BASE_PATH, 'initial', 'CoNWeT_bae-marketplace_0.1.1.wgt')
 
 
+@cache_api_token_auth('fiware')
 def auth_fiware_token(auth_type, token):
 
     from social_django.models import UserSocialAuth
-    user_data = FIWARE_SOCIAL_AUTH_BACKEND.user_data(token)
-    return UserSocialAuth.objects.get(provider='fiware', uid=user_data['username']).user
+
+    try:
+        user_data = FIWARE_SOCIAL_AUTH_BACKEND.user_data(token)
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 401:
+            raise HttpBadCredentials(_('Bad credentials'), '%(auth_type)s realm="WireCloud", error="invalid_token", error_description="bad credentials"' % {"auth_type": auth_type})
+        raise
+
+    # The IdM does not provide the expiration time of the token
+    return UserSocialAuth.objects.get(provider='fiware', uid=user_data['username']).user, None
 
 
 class FIWAREBAEManager(MarketManager):
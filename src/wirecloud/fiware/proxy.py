@@ -18,8 +18,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
-from io import BytesIO
-
 from django.conf import settings
 from django.utils.http import urlquote_plus
 from django.utils.translation import ugettext as _
@@ -27,7 +25,7 @@ from django.utils.translation import ugettext as _
 from wirecloud.fiware import FIWARE_LAB_CLOUD_SERVER
 from wirecloud.fiware.openstack_token_manager import OpenstackTokenManager
 from wirecloud.fiware.plugins import IDM_SUPPORT_ENABLED
-from wirecloud.proxy.utils import ValidationError
+from wirecloud.proxy.utils import replace_body_patterns, ValidationError
 
 
 if IDM_SUPPORT_ENABLED:
@@ -100,9 +98,8 @@ def replace_body_pattern(request, bodies, token):
         pattern = request['headers'][body]
         del request['headers'][body]
 
-        new_body = request['data'].read().replace(pattern.encode('utf8'), token.encode('utf8'))
-        request['headers']['content-length'] = "{}".format(len(new_body))
-        request['data'] = BytesIO(new_body)
+        request['data'], length = replace_body_patterns(request['data'], {pattern.encode('utf8'): token.encode('utf8')})
+        request['headers']['content-length'] = "{}".format(length)
 
         return
 
@@ -122,6 +119,9 @@ class IDMTokenProcessor(object):
         for header in filtered:
             del request['headers'][header]
 
+        # Requests including user tokens are user dependent
+        request['private'] = True
+
         if not IDM_SUPPORT_ENABLED:
             raise ValidationError(_('IdM support not enabled'))
         elif request['workspace'] is None:
@@ -1,3 +1,3 @@
-from wirecloud.fiware.tests.proxy import ProxyTestCase  # noqa
+from wirecloud.fiware.tests.proxy import OpenstackTokenManagerTestCase, ProxyTestCase  # noqa
 from wirecloud.fiware.tests.views import FIWAREViewsTestCase  # noqa
 from wirecloud.fiware.tests.social_backend import *  # noqa
@@ -17,17 +17,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+from io import BytesIO
 import json
 from importlib import import_module
+import time
 from unittest.mock import MagicMock, Mock, patch
 from urllib.parse import parse_qsl
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 
 from wirecloud.commons.utils.testcases import WirecloudTestCase
+from wirecloud.fiware.openstack_token_manager import OpenstackTokenManager
+from wirecloud.proxy.utils import ValidationError
 from wirecloud.proxy.views import proxy_request
 
 
@@ -133,7 +138,7 @@ class ProxyTestCase(WirecloudTestCase, TestCase):
             data = data.encode('utf-8')
             request.META['content_type'] = 'application/json'
             request.META['content_length'] = len(data)
-            request.read.return_value = data
+            request.read.side_effect = BytesIO(data).read
         else:
             request.method = 'GET'
 
@@ -303,8 +308,8 @@ class ProxyTestCase(WirecloudTestCase, TestCase):
             self.assertIn('X-Auth-Token', request_headers)
             self.assertEqual(request_headers['X-Auth-Token'], TEST_WORKSPACE_TOKEN)
 
-        with patch('wirecloud.proxy.views.Workspace') as Workspace_orm_mock:
-            Workspace_orm_mock.objects.get().creator = self.user_with_workspaces_mock
+        with patch('wirecloud.proxy.views.get_accessible_workspace') as get_accessible_workspace_mock:
+            get_accessible_workspace_mock().creator = self.user_with_workspaces_mock
             self.check_proxy_request(validator=validator, data='{}', extra_headers={
                 "HTTP_FIWARE_OAUTH_SOURCE": 'workspaceowner',
                 "HTTP_FIWARE_OAUTH_HEADER_NAME": 'X-Auth-Token',
@@ -317,8 +322,8 @@ class ProxyTestCase(WirecloudTestCase, TestCase):
 
         self.network._servers['http']['example.com'].add_response('POST', '/path', self.echo_headers_response)
 
-        with patch('wirecloud.proxy.views.Workspace') as Workspace_orm_mock:
-            Workspace_orm_mock.objects.get().creator = self.user_with_workspaces_mock
+        with patch('wirecloud.proxy.views.get_accessible_workspace') as get_accessible_workspace_mock:
+            get_accessible_workspace_mock().creator = self.user_with_workspaces_mock
             self.check_proxy_request(validator=self.invalid_request_validator(), data='{}', extra_headers={
                 "HTTP_FIWARE_OAUTH_SOURCE": 'workspaceowner',
                 "HTTP_FIWARE_OAUTH_HEADER_NAME": 'X-Auth-Token',
@@ -344,3 +349,145 @@ class ProxyTestCase(WirecloudTestCase, TestCase):
         self.check_proxy_request(validator=validator, data='{}', extra_headers={
             "HTTP_FIWARE_OAUTH_HEADER_NAME": 'X-Auth-Token',
         }, refresh=True)
+
+
+class OpenstackTokenManagerTestCase(TestCase):
+
+    tags = ('wirecloud-fiware-proxy', 'wirecloud-proxy', 'wirecloud-noselenium')
+
+    def setUp(self):
+        cache.clear()
+
+        self.user_mock = Mock(pk=1, username='user')
+        self.user_mock.social_auth.get.return_value = Mock(access_token=TEST_TOKEN)
+        self.manager = OpenstackTokenManager('https://cloud.example.com')
+
+    def build_response(self, headers={}, data={}, status_code=201):
+        response = Mock(headers=headers, status_code=status_code)
+        response.json.return_value = data
+        return response
+
+    def test_get_token_is_cached(self):
+
+        with patch.object(self.manager, 'get_openstack_token', return_value=('openstack_token', time.time() + 3600)) as get_openstack_token_mock:
+            self.assertEqual(self.manager.get_token(self.user_mock), 'openstack_token')
+            self.assertEqual(self.manager.get_token(self.user_mock), 'openstack_token')
+            self.assertEqual(self.manager.get_token(self.user_mock, 'tenant'), 'openstack_token')
+
+        self.assertEqual(get_openstack_token_mock.call_count, 2)
+        get_openstack_token_mock.assert_any_call('user', TEST_TOKEN, '__default__')
+        get_openstack_token_mock.assert_any_call('user', TEST_TOKEN, 'tenant')
+
+    def test_get_token_renewed_idm_token(self):
+
+        with patch.object(self.manager, 'get_openstack_token', return_value=('openstack_token', None)) as get_openstack_token_mock:
+            self.manager.get_token(self.user_mock)
+            self.user_mock.social_auth.get.return_value = Mock(access_token=TEST_WORKSPACE_TOKEN)
+            self.manager.get_token(self.user_mock)
+
+        self.assertEqual(get_openstack_token_mock.call_count, 2)
+
+    def test_get_cache_timeout(self):
+
+        self.assertEqual(self.manager.get_cache_timeout(('openstack_token', None)), 3600)
+        self.assertAlmostEqual(self.manager.get_cache_timeout(('openstack_token', time.time() + 600)), 540, delta=1)
+        self.assertEqual(self.manager.get_cache_timeout(('openstack_token', time.time() + 30)), 1)
+
+    def test_get_openstack_token(self):
+
+        role_assignments = {
+            "role_assignments": [
+                {"scope": {"project": {"id": "project1"}}},
+                {"scope": {"domain": {"id": "domain"}}},
+                {"scope": {"project": {"id": "project2"}}},
+                {"scope": {"project": {"id": "project3"}}},
+            ]
+        }
+        projects = {
+            "project1": {"project": {"id": "project1", "is_cloud_project": False}},
+            "project2": {"project": {"id": "project2", "is_cloud_project": True}},
+            "project3": {"project": {"id": "project3", "is_cloud_project": True}},
+        }
+
+        mocks = {
+            'first_step_openstack': Mock(return_value=self.build_response(headers={"x-subject-token": "general_token"})),
+            'getProjects': Mock(return_value=self.build_response(data=role_assignments)),
+            'getProjectPermissions': Mock(side_effect=lambda url, token: self.build_response(data=projects[url.rsplit('/', 1)[1]])),
+            'get_openstack_project_token': Mock(return_value=self.build_response(headers={"x-subject-token": "project_token"}, data={"token": {"expires_at": "2030-01-01T00:00:00.000000Z"}})),
+        }
+
+        with patch.multiple('wirecloud.fiware.openstack_token_manager', **mocks):
+            token, expires_at = self.manager.get_openstack_token('user', TEST_TOKEN, '__default__')
+
+        self.assertEqual(token, 'project_token')
+        self.assertEqual(expires_at, 1893456000)
+        self.assertEqual(mocks['getProjectPermissions'].call_count, 3)
+        mocks['get_openstack_project_token'].assert_called_once_with('https://cloud.example.com/keystone/v3/auth/tokens', 'project2', TEST_TOKEN)
+
+    def test_get_openstack_token_tenant(self):
+
+        role_assignments = {
+            "role_assignments": [
+                {"scope": {"project": {"id": "project1"}}},
+                {"scope": {"project": {"id": "project2"}}},
+            ]
+        }
+
+        mocks = {
+            'first_step_openstack': Mock(return_value=self.build_response(headers={"x-subject-token": "general_token"})),
+            'getProjects': Mock(return_value=self.build_response(data=role_assignments)),
+            'getProjectPermissions': Mock(return_value=self.build_response(data={"project": {"id": "project2", "is_cloud_project": True}})),
+            'get_openstack_project_token': Mock(return_value=self.build_response(headers={"x-subject-token": "project_token"}, data={"token": {"expires_at": "2030-01-01T00:00:00Z"}})),
+        }
+
+        with patch.multiple('wirecloud.fiware.openstack_token_manager', **mocks):
+            token, expires_at = self.manager.get_openstack_token('user', TEST_TOKEN, 'project2')
+
+        self.assertEqual(token, 'project_token')
+        self.assertEqual(expires_at, 1893456000)
+        mocks['getProjectPermissions'].assert_called_once_with('https://cloud.example.com/keystone/v3/projects/project2', 'general_token')
+
+    def check_keystone_error(self, first_step_response, project_token_response):
+
+        mocks = {
+            'first_step_openstack': Mock(return_value=first_step_response),
+            'getProjects': Mock(return_value=self.build_response(data={"role_assignments": [{"scope": {"project": {"id": "project1"}}}]})),
+            'getProjectPermissions': Mock(return_value=self.build_response(data={"project": {"id": "project1", "is_cloud_project": True}})),
+            'get_openstack_project_token': Mock(return_value=project_token_response),
+        }
+
+        with patch.multiple('wirecloud.fiware.openstack_token_manager', **mocks):
+            self.assertRaises(ValidationError, self.manager.get_token, self.user_mock)
+
+            # Errors are not cached
+            mocks['first_step_openstack'].return_value = self.build_response(headers={"x-subject-token": "general_token"})
+            mocks['get_openstack_project_token'].return_value = self.build_response(headers={"x-subject-token": "project_token"}, data={"token": {"expires_at": "2030-01-01T00:00:00Z"}})
+            self.assertEqual(self.manager.get_token(self.user_mock), 'project_token')
+
+    def test_get_token_general_token_error(self):
+
+        self.check_keystone_error(
+            self.build_response(status_code=401),
+            self.build_response(headers={"x-subject-token": "project_token"}, data={"token": {"expires_at": "2030-01-01T00:00:00Z"}})
+        )
+
+    def test_get_token_project_token_error(self):
+
+        self.check_keystone_error(
+            self.build_response(headers={"x-subject-token": "general_token"}),
+            self.build_response(status_code=503)
+        )
+
+    def test_get_token_project_token_missing_header(self):
+
+        self.check_keystone_error(
+            self.build_response(headers={"x-subject-token": "general_token"}),
+            self.build_response(data={"token": {"expires_at": "2030-01-01T00:00:00Z"}})
+        )
+
+    def test_get_token_project_token_missing_expiration(self):
+
+        self.check_keystone_error(
+            self.build_response(headers={"x-subject-token": "general_token"}),
+            self.build_response(headers={"x-subject-token": "project_token"})
+        )
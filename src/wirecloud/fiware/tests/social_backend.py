@@ -264,6 +264,7 @@ class TestSocialAuthBackend(WirecloudTestCase, TestCase):
     def test_api_authentication_using_idm(self):
 
         auth_user_mock = MagicMock()
+        auth_user_mock.user.pk = 1
 
         def get_social_auth(provider, uid):
             if provider == 'fiware' and uid == 'demo':
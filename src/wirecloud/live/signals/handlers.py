@@ -64,6 +64,9 @@ def workspace_update(sender, instance, created, raw, using, update_fields, **kwa
 
     if update_fields is not None:
         for field in update_fields:
+            # Wiring status and forced values may contain per-user values
+            if field in ('wiringStatus', 'forcedValues'):
+                continue
             data[field] = getattr(instance, field)
 
     notify(data, affected_users)
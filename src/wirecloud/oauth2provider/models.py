@@ -19,10 +19,12 @@
 
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils.translation import ugettext as _
 
+from wirecloud.commons.utils.cache import invalidate_api_tokens
+
 
 class Application(models.Model):
 
@@ -72,4 +74,12 @@ class Token(models.Model):
 @receiver(post_save, sender=Application)
 def invalidate_tokens_on_change(sender, instance, created, raw, **kwargs):
     if created is False:
-        instance.token_set.all().update(creation_timestamp='0')
+        tokens = instance.token_set.all()
+        invalidate_api_tokens('oauth2', tokens.values_list('token', flat=True))
+        tokens.update(creation_timestamp='0')
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    invalidate_api_tokens('oauth2', (instance.token,))
@@ -19,21 +19,24 @@
 
 import time
 
-from django.utils.translation import ugettext as _
+from django.utils.translation import ugettext_lazy as _
 
 from wirecloud.commons.exceptions import HttpBadCredentials
+from wirecloud.commons.utils.cache import cache_api_token_auth
 from wirecloud.platform.plugins import WirecloudPlugin
 from wirecloud.oauth2provider.models import Token
 from wirecloud.oauth2provider.urls import urlpatterns
 
 
+@cache_api_token_auth('oauth2')
 def auth_oauth2_token(auth_type, token):
 
-    token = Token.objects.get(token=token)
-    if (int(token.creation_timestamp) + int(token.expires_in)) <= time.time():
+    token = Token.objects.select_related('user').get(token=token)
+    expires_at = int(token.creation_timestamp) + int(token.expires_in)
+    if expires_at <= time.time():
         raise HttpBadCredentials(_('Expired access token'), 'Bearer realm="WireCloud", error="invalid_token", error_description="expired access token"')
 
-    return token.user
+    return token.user, expires_at
 
 
 class OAuth2ProviderPlugin(WirecloudPlugin):
@@ -440,3 +440,22 @@ class Oauth2TestCase(WirecloudTestCase, TransactionTestCase):
         self.check_token_is_invalid('eternal_token2')
         # eternal_token3 is not owned by app 3faf0fb4c2fe76c1c3bb7d09c21b97c2
         self.check_token_is_valid('eternal_token3')
+
+    def test_authorization_token_validation_is_cached(self):
+
+        self.check_token_is_valid('eternal_token1')
+
+        with patch('wirecloud.oauth2provider.plugins.Token.objects') as token_objects_mock:
+            self.check_token_is_valid('eternal_token1')
+
+        token_objects_mock.select_related.assert_not_called()
+
+    def test_removed_token_invalidates_cache(self):
+
+        from wirecloud.oauth2provider.models import Token
+
+        self.check_token_is_valid('eternal_token1')
+
+        Token.objects.get(token='eternal_token1').delete()
+
+        self.check_token_is_invalid('eternal_token1')
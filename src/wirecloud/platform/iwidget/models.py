@@ -21,7 +21,9 @@ from django.db import models
 from django.utils.translation import ugettext as _
 
 from wirecloud.commons.fields import JSONField
+from wirecloud.commons.utils.cache import get_cache_version, invalidate_cache_version
 from wirecloud.platform.wiring.utils import remove_widget_from_wiring_status
+from wirecloud.platform.workspace.models import Tab
 
 
 class IWidget(models.Model):
@@ -40,9 +42,24 @@ class IWidget(models.Model):
         app_label = 'platform'
         db_table = 'wirecloud_iwidget'
 
+    def __init__(self, *args, **kwargs):
+        super(IWidget, self).__init__(*args, **kwargs)
+        self.__original_tab_id = self.tab_id
+
     def __str__(self):
         return str(self.pk)
 
+    @staticmethod
+    def build_cache_version_key(iwidget_id):
+        return '_iwidget_version/%s' % iwidget_id
+
+    @property
+    def cache_version(self):
+        return get_cache_version(self.build_cache_version_key(self.id))
+
+    def invalidate_cache(self):
+        invalidate_cache_version(self.build_cache_version_key(self.id))
+
     def set_variable_value(self, var_name, value, user):
 
         iwidget_info = self.widget.resource.get_processed_info(translate=False, process_variables=True)
@@ -71,15 +88,26 @@ class IWidget(models.Model):
         if self.widget is not None:
             self.widget_uri = self.widget.resource.local_uri_part
 
+        created = self.pk is None
         super(IWidget, self).save(*args, **kwargs)
 
+        self.invalidate_cache()
+        if created or self.tab_id != self.__original_tab_id:
+            # The list of widgets of the affected tabs has changed
+            if self.__original_tab_id is not None:
+                invalidate_cache_version(Tab.build_cache_version_key(self.__original_tab_id))
+            self.tab.invalidate_cache()
+            self.__original_tab_id = self.tab_id
+
         if updatecache:
-            self.tab.workspace.save()  # Invalidate workspace cache
+            self.tab.workspace.save(update_fields=('last_modified',))
 
     def delete(self, *args, **kwargs):
 
         # Delete IWidget from wiring
-        remove_widget_from_wiring_status("%s" % self.id, self.tab.workspace.wiringStatus)
-        self.tab.workspace.save()  # This also invalidates the workspace cache
+        workspace = self.tab.workspace
+        remove_widget_from_wiring_status("%s" % self.id, workspace.wiringStatus)
+        workspace.save(update_fields=('wiringStatus',))
+        self.tab.invalidate_cache()
 
         super(IWidget, self).delete(*args, **kwargs)
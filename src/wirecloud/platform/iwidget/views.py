@@ -42,7 +42,7 @@ class IWidgetCollection(Resource):
             return build_error_response(request, 403, _("You don't have permission to access this workspace"))
 
         cache_manager = VariableValueCacheManager(tab.workspace, request.user)
-        iwidgets = tab.iwidget_set.all()
+        iwidgets = tab.iwidget_set.select_related('widget__resource')
         data = [get_iwidget_data(iwidget, tab.workspace, cache_manager) for iwidget in iwidgets]
 
         return HttpResponse(json.dumps(data, sort_keys=True), content_type='application/json; charset=UTF-8')
@@ -97,8 +97,8 @@ class IWidgetCollection(Resource):
                 return build_error_response(request, 422, e)
 
         if len(iwidgets) > 0:
-            # Invalidate workspace cache
-            tab.workspace.save()
+            # Update the modification date of the workspace
+            tab.workspace.save(update_fields=('last_modified',))
 
         return HttpResponse(status=204)
 
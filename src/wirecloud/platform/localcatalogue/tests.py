@@ -21,12 +21,12 @@
 from io import BytesIO
 import os.path
 import time
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 import zipfile
 
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import PermissionDenied
-from django.db import IntegrityError
+from django.db import DatabaseError, IntegrityError
 from django.test import Client, TransactionTestCase
 from django.urls import reverse
 from selenium.webdriver.common.by import By
@@ -204,6 +204,24 @@ class LocalCatalogueTestCase(WirecloudTestCase, TransactionTestCase):
         self.assertRaises(Widget.DoesNotExist, Widget.objects.get, resource__pk=resource_pk)
         self.assertRaises(CatalogueResource.DoesNotExist, CatalogueResource.objects.get, pk=resource_pk)
 
+    def test_widget_creation_code_read_errors(self):
+
+        file_contents = self.build_simple_wgt('template1.xml', other_files=('doc/index.html',))
+        logger = Mock()
+        with patch.multiple('wirecloud.platform.widget.utils', download_local_file=Mock(side_effect=IOError('read error')), logger=logger):
+            added, resource = install_component(file_contents, executor_user=self.user, users=[self.user])
+
+        # The error will be reported when serving the widget code
+        self.assertTrue(added)
+        self.assertEqual(logger.warning.call_count, 1)
+        self.assertEqual(resource.widget.xhtml.compiled_code, '')
+
+    def test_widget_creation_database_errors(self):
+
+        file_contents = self.build_simple_wgt('template1.xml', other_files=('doc/index.html',))
+        with patch('wirecloud.platform.widget.utils.store_compiled_widget_code', side_effect=DatabaseError):
+            self.assertRaises(DatabaseError, install_component, file_contents, executor_user=self.user, users=[self.user])
+
     def test_widget_code_cache(self):
 
         client = Client()
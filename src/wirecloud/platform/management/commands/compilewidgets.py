@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from wirecloud.commons.utils.http import get_current_domain, get_current_scheme
+from wirecloud.platform.models import Widget
+from wirecloud.platform.themes import get_available_themes
+from wirecloud.platform.widget.utils import build_widget_code_cache_entry, compile_xhtml, render_widget_code, WIDGET_CODE_CACHE_TIMEOUT
+
+
+DEFAULT_MODES = ('classic', 'embedded', 'smartphone')
+
+
+class Command(BaseCommand):
+
+    help = 'Compiles the code of the installed widgets and precomputes the variants served for each theme and view mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            dest='force',
+            help='Compile the code of all the widgets, including the ones already compiled'
+        )
+        parser.add_argument(
+            '--theme',
+            action='append',
+            dest='themes',
+            metavar='THEME',
+            help='Theme to use for precomputing the widget code. Can be used several times (default: all the available themes)'
+        )
+        parser.add_argument(
+            '--mode',
+            action='append',
+            dest='modes',
+            metavar='MODE',
+            help='View mode to use for precomputing the widget code. Can be used several times (default: %s)' % ', '.join(DEFAULT_MODES)
+        )
+
+    def handle(self, *args, **options):
+
+        self.verbosity = int(options.get('verbosity', 1))
+        themes = options['themes'] or get_available_themes()
+        modes = options['modes'] or DEFAULT_MODES
+        # Variants are stored using the scheme and domain used for building
+        # the URLs included on the widget code, so they are only used for
+        # requests made using the same scheme and domain
+        scheme = get_current_scheme()
+        domain = get_current_domain()
+
+        compiled = variants = 0
+        for widget in Widget.objects.select_related('resource', 'xhtml').filter(xhtml__cacheable=True):
+            resource = widget.resource
+            xhtml = widget.xhtml
+            if resource.json_description['contents']['cacheable'] is not True:
+                continue
+
+            compiled_code = xhtml.compiled_code
+            if options['force'] or compiled_code == '':
+                try:
+                    compiled_code = compile_xhtml(xhtml, resource)
+                except Exception as e:
+                    self.stderr.write('Error compiling the code of %s: %s' % (widget.uri, e))
+                    continue
+
+                xhtml.invalidate_cache()
+                compiled += 1
+
+            content_type = resource.json_description['contents'].get('contenttype', 'text/html')
+            charset = resource.json_description['contents'].get('charset', 'utf-8')
+            for theme in themes:
+                for mode in modes:
+                    try:
+                        code = render_widget_code(resource, compiled_code, None, mode, theme)
+                    except Exception as e:
+                        self.stderr.write('Error processing the code of %s (mode: %s, theme: %s): %s' % (widget.uri, mode, theme, e))
+                        continue
+
+                    cache.set(xhtml.get_cache_key(scheme, domain, mode, theme), build_widget_code_cache_entry(xhtml, code, content_type, charset), WIDGET_CODE_CACHE_TIMEOUT)
+                    variants += 1
+
+        self.log('%d widgets compiled, %d widget code variants stored' % (compiled, variants))
+
+    def log(self, msg, level=1):
+        """
+        Small log helper
+        """
+        if self.verbosity >= level:
+            self.stdout.write(msg)
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('platform', '0019_auto_20201130_1824'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xhtml',
+            name='compiled_code',
+            field=models.TextField(blank=True, verbose_name='Compiled code'),
+        ),
+    ]
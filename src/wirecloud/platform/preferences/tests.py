@@ -270,7 +270,8 @@ class WorkspacePreferencesTestCase(TestCase):
         pref1.save.assert_called_once_with() if change1 else pref1.save.assert_not_called()
         pref2.save.assert_called_once_with() if change2 else pref2.save.assert_not_called()
         self.assertGreater(WorkspacePreference.call_count, 0) if new else WorkspacePreference.assert_not_called()
-        workspace.save.assert_called_once_with() if change1 or change2 or new else workspace.save.assert_not_called()
+        workspace.invalidate_cache.assert_called_once_with('metadata') if change1 or change2 or new else workspace.invalidate_cache.assert_not_called()
+        workspace.save.assert_called_once_with(update_fields=('last_modified',)) if change1 or change2 or new else workspace.save.assert_not_called()
         self.assertEqual(response.status_code, 204)
 
 
@@ -370,7 +371,8 @@ class TabPreferencesTestCase(TestCase):
         pref1.save.assert_called_once_with() if change1 else pref1.save.assert_not_called()
         pref2.save.assert_called_once_with() if change2 else pref2.save.assert_not_called()
         self.assertGreater(TabPreference.call_count, 0) if new else TabPreference.assert_not_called()
-        workspace.save.assert_called_once_with() if change1 or change2 or new else workspace.save.assert_not_called()
+        tab.invalidate_cache.assert_called_once_with() if change1 or change2 or new else tab.invalidate_cache.assert_not_called()
+        workspace.save.assert_called_once_with(update_fields=('last_modified',)) if change1 or change2 or new else workspace.save.assert_not_called()
         self.assertEqual(response.status_code, 204)
 
 
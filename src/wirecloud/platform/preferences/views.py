@@ -65,7 +65,7 @@ def parseInheritableValues(values):
 
 
 def make_tab_preferences_cache_key(tab):
-    return '_tab_preferences_cache/%s/%s' % (tab.id, tab.workspace.last_modified)
+    return '_tab_preferences_cache/%s/%s' % (tab.id, tab.cache_version)
 
 
 def serialize_default_value(value):
@@ -131,13 +131,12 @@ def update_tab_preferences(tab, preferences_json):
             preference.save()
 
     if changes:
-        cache_key = make_tab_preferences_cache_key(tab)
-        cache.delete(cache_key)
-        tab.workspace.save()  # Invalidate workspace cache
+        tab.invalidate_cache()
+        tab.workspace.save(update_fields=('last_modified',))
 
 
 def make_workspace_preferences_cache_key(workspace):
-    return '_workspace_preferences_cache/%s/%s' % (workspace.id, workspace.last_modified)
+    return '_workspace_preferences_cache/%s/%s' % (workspace.id, workspace.get_cache_version('metadata'))
 
 
 def get_workspace_preference_values(workspace):
@@ -196,9 +195,8 @@ def update_workspace_preferences(workspace, preferences_json, invalidate_cache=T
             preference.save()
 
     if invalidate_cache and changes:
-        cache_key = make_workspace_preferences_cache_key(workspace)
-        cache.delete(cache_key)
-        workspace.save()  # Invalidate workspace cache
+        workspace.invalidate_cache('metadata')
+        workspace.save(update_fields=('last_modified',))
 
 
 class PlatformPreferencesCollection(Resource):
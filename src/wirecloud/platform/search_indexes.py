@@ -20,13 +20,14 @@
 
 from datetime import datetime
 
-from django.db.models import Q
+from django.contrib.auth.models import Group, User
+from django.db.models import Prefetch, Q
 from haystack import indexes
 
 from wirecloud.platform.models import Workspace
 from wirecloud.commons.haystack_fields import BooleanField
 from wirecloud.commons.haystack_queryparser import ParseSQ
-from wirecloud.commons.search_indexes import buildSearchResults, SearchQuerySet
+from wirecloud.commons.search_indexes import buildSearchResults, get_related_ids, SearchQuerySet
 
 
 CONTENT_FIELDS = ["owner", "name"]
@@ -52,9 +53,19 @@ class WorkspaceIndex(indexes.SearchIndex, indexes.Indexable):
     groups = indexes.MultiValueField(stored=False)
     shared = BooleanField()
 
+    # Field used for finding the instances updated since the last
+    # incremental update of the indexes (see the updatesearchindexes command)
+    watermark_field = 'last_modified'
+
     def get_model(self):
         return self.model
 
+    def index_queryset(self, using=None):
+        return self.get_model()._default_manager.select_related('creator').prefetch_related(
+            Prefetch('users', queryset=User.objects.only('id')),
+            Prefetch('groups', queryset=Group.objects.only('id')),
+        )
+
     def prepare(self, object):
         self.prepared_data = super(WorkspaceIndex, self).prepare(object)
 
@@ -65,8 +76,8 @@ class WorkspaceIndex(indexes.SearchIndex, indexes.Indexable):
 
         self.prepared_data["lastmodified"] = lastmodified
         self.prepared_data["owner"] = object.creator.username
-        self.prepared_data["users"] = tuple(object.users.all().values_list('id', flat=True))
-        self.prepared_data["groups"] = tuple(object.groups.all().values_list('id', flat=True))
+        self.prepared_data["users"] = get_related_ids(object, 'users')
+        self.prepared_data["groups"] = get_related_ids(object, 'groups')
         self.prepared_data["shared"] = object.is_shared()
 
         return self.prepared_data
@@ -20,14 +20,16 @@
 import os
 
 from django.contrib.auth.signals import user_logged_in
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.signals import m2m_changed, pre_delete, post_delete, post_save
 from django.dispatch import receiver
 
 from wirecloud.catalogue import utils as catalogue
 from wirecloud.catalogue.models import CatalogueResource
+from wirecloud.commons.utils.cache import invalidate_cache_version
 from wirecloud.commons.utils.wgt import WgtFile
 from wirecloud.platform.iwidget.models import IWidget
 from wirecloud.platform.widget.models import Widget
+from wirecloud.platform.workspace.models import UserWorkspace, Workspace
 from wirecloud.platform.preferences.models import update_session_lang
 from wirecloud.platform.widget.utils import create_widget_from_wgt
 
@@ -53,13 +55,46 @@ def create_widget_on_resource_creation(sender, instance, created, raw, **kwargs)
             resource.widget = create_widget_from_wgt(wgt_file, resource.creator)
 
         # Restore any iwidget associated with this widget
-        IWidget.objects.filter(widget_uri=resource.local_uri_part).update(widget=resource.widget)
+        iwidgets = IWidget.objects.filter(widget_uri=resource.local_uri_part)
+        iwidget_ids = list(iwidgets.values_list('id', flat=True))
+        iwidgets.update(widget=resource.widget)
+        invalidate_iwidget_caches(iwidget_ids)
 
 
 @receiver(pre_delete, sender=CatalogueResource)
 def delete_widget_on_resource_deletion(sender, instance, using, **kwargs):
     if instance.resource_type() == 'widget':
         try:
+            iwidget_ids = list(IWidget.objects.filter(widget=instance.widget).values_list('id', flat=True))
             instance.widget.delete()
+            invalidate_iwidget_caches(iwidget_ids)
         except Widget.DoesNotExist:
             pass
+
+
+def invalidate_iwidget_caches(iwidget_ids):
+    for iwidget_id in iwidget_ids:
+        invalidate_cache_version(IWidget.build_cache_version_key(iwidget_id))
+
+
+@receiver(post_save, sender=UserWorkspace)
+@receiver(post_delete, sender=UserWorkspace)
+def invalidate_workspace_cache_on_user_change(sender, instance, **kwargs):
+    invalidate_cache_version(Workspace.build_cache_version_key(instance.workspace_id, 'metadata'))
+
+
+@receiver(m2m_changed, sender=Workspace.groups.through)
+def invalidate_workspace_cache_on_group_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if not reverse:
+        instance.invalidate_cache('metadata')
+    elif pk_set is not None:
+        for workspace_id in pk_set:
+            invalidate_cache_version(Workspace.build_cache_version_key(workspace_id, 'metadata'))
+
+
+@receiver(post_delete, sender=Workspace)
+def invalidate_workspace_cache_on_deletion(sender, instance, **kwargs):
+    instance.invalidate_cache('metadata')
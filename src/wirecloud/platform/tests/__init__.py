@@ -19,7 +19,7 @@
 
 
 from wirecloud.platform.tests.base import *  # noqa
-from wirecloud.platform.tests.commands import PopuplateCommandTestCase  # noqa
+from wirecloud.platform.tests.commands import CompileWidgetsCommandTestCase, PopuplateCommandTestCase  # noqa
 from wirecloud.platform.tests.plugins import CorePluginTestCase, WirecloudPluginTestCase  # noqa
 from wirecloud.platform.tests.rest_api import AdministrationAPI, ApplicationMashupAPI, ResourceManagementAPI, ExtraApplicationMashupAPI  # noqa
 from wirecloud.platform.tests.search_indexes import *  # noqa
@@ -30,5 +30,5 @@ from wirecloud.platform.markets.tests import *  # noqa
 from wirecloud.platform.preferences.tests import *  # noqa
 from wirecloud.platform.wiring.tests import *  # noqa
 from wirecloud.platform.widget.tests import CodeTransformationTestCase, WidgetModuleTestCase  # noqa
-from wirecloud.platform.workspace.tests import WorkspaceMigrationsTestCase, WorkspaceTestCase, WorkspaceUtilsTestCase, WorkspaceCacheTestCase, ParameterizedWorkspaceParseTestCase, ParameterizedWorkspaceGenerationTestCase  # noqa
-from wirecloud.proxy.tests import ProxyTests, ProxySecureDataTests  # noqa
+from wirecloud.platform.workspace.tests import WorkspaceMigrationsTestCase, WorkspaceTestCase, WorkspaceUtilsTestCase, WorkspaceCacheTestCase, WorkspaceSerializationQueriesTestCase, ParameterizedWorkspaceParseTestCase, ParameterizedWorkspaceGenerationTestCase  # noqa
+from wirecloud.proxy.tests import ProxyBodyReplacementTests, ProxyCacheTests, ProxyConsumerTests, ProxyMetricsTests, ProxyTests, ProxySecureDataTests, ProxySessionPoolTests, ProxyUpstreamTests  # noqa
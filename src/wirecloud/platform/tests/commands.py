@@ -23,10 +23,14 @@ from unittest.mock import patch
 
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.test import override_settings, TransactionTestCase
+from django.test import Client, override_settings, TransactionTestCase
+from django.urls import reverse
 
+from wirecloud.catalogue.models import CatalogueResource
 from wirecloud.commons.utils.testcases import WirecloudTestCase
 from wirecloud.platform.plugins import clear_cache
+from wirecloud.platform.themes import get_active_theme_name
+from wirecloud.platform.widget.utils import WIDGET_CODE_INJECTION_POINT
 
 
 # Avoid nose to repeat these tests (they are run through wirecloud/platform/tests/__init__.py)
@@ -139,3 +143,72 @@ class PopuplateCommandTestCase(WirecloudTestCase, TransactionTestCase):
 
         getdefaultlocale_mock.side_effect = TypeError
         self.check_populate_command_empty_db_quiet()
+
+
+@override_settings(FORCE_DOMAIN='example.com', FORCE_PROTO='http')
+@patch('wirecloud.platform.widget.utils.download_local_file', return_value=b'<html><head></head><body>compiled hello world!</body></html>')
+class CompileWidgetsCommandTestCase(WirecloudTestCase, TransactionTestCase):
+
+    fixtures = ('selenium_test_data',)
+    tags = ('wirecloud-commands', 'wirecloud-command-compilewidgets', 'wirecloud-noselenium')
+    populate = False
+    use_search_indexes = False
+
+    def setUp(self):
+
+        super(CompileWidgetsCommandTestCase, self).setUp()
+
+        self.options = {"stdout": io.StringIO(), "stderr": io.StringIO()}
+        self.resource = CatalogueResource.objects.get(vendor='Wirecloud', short_name='Test', version='1.0')
+        xhtml = self.resource.widget.xhtml
+        xhtml.cacheable = True
+        xhtml.code = ''
+        xhtml.compiled_code = ''
+        xhtml.save()
+
+    def test_compilewidgets_command(self, download_local_file_mock):
+
+        call_command('compilewidgets', theme=[get_active_theme_name()], mode=['classic'], **self.options)
+
+        xhtml = CatalogueResource.objects.get(pk=self.resource.pk).widget.xhtml
+        self.assertIn(WIDGET_CODE_INJECTION_POINT, xhtml.compiled_code)
+        self.assertIn('compiled hello world!', xhtml.code)
+        self.options['stderr'].seek(0)
+        self.assertEqual(self.options['stderr'].read(), '')
+
+        # Variants should be served from the cache
+        url = reverse('wirecloud.showcase_media', kwargs={'vendor': 'Wirecloud', 'name': 'Test', 'version': '1.0', 'file_path': '/test.html'}) + '?entrypoint=true'
+        client = Client()
+        with patch('wirecloud.platform.widget.views.render_widget_code') as render_widget_code_mock:
+            response = client.get(url, HTTP_ACCEPT='application/xhtml+xml')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(render_widget_code_mock.called)
+        self.assertIn(b'compiled hello world!', response.content)
+        self.assertIn(b'WirecloudAPIClosure.js', response.content)
+        self.assertNotIn(WIDGET_CODE_INJECTION_POINT.encode('utf-8'), response.content)
+
+    def test_compilewidgets_command_variants_depend_on_scheme(self, download_local_file_mock):
+
+        call_command('compilewidgets', theme=[get_active_theme_name()], mode=['classic'], **self.options)
+
+        # Variants were computed for http, so they cannot be used for https requests
+        url = reverse('wirecloud.showcase_media', kwargs={'vendor': 'Wirecloud', 'name': 'Test', 'version': '1.0', 'file_path': '/test.html'}) + '?entrypoint=true'
+        client = Client()
+        with self.settings(FORCE_PROTO=None):
+            response = client.get(url, HTTP_ACCEPT='application/xhtml+xml', secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'src="https://example.com/static/', response.content)
+        self.assertNotIn(b'src="http://', response.content)
+
+    def test_compilewidgets_command_skips_compiled_widgets(self, download_local_file_mock):
+
+        call_command('compilewidgets', theme=[get_active_theme_name()], mode=['classic'], **self.options)
+        download_local_file_mock.reset_mock()
+
+        call_command('compilewidgets', theme=[get_active_theme_name()], mode=['classic'], **self.options)
+        self.assertFalse(download_local_file_mock.called)
+
+        call_command('compilewidgets', force=True, theme=[get_active_theme_name()], mode=['classic'], **self.options)
+        self.assertTrue(download_local_file_mock.called)
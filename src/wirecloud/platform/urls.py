@@ -33,6 +33,7 @@ from wirecloud.platform.preferences import views as preferences_views
 from wirecloud.platform.theme import views as theme_views
 from wirecloud.platform.widget import views as widget_views
 from wirecloud.platform.workspace import views as workspace_views
+from wirecloud.proxy import views as proxy_views
 
 
 urlpatterns = (
@@ -167,6 +168,14 @@ urlpatterns = (
         SwitchUserService(),
         name='wirecloud.switch_user_service'),
 
+    url(r'^api/admin/proxy$',
+        proxy_views.ProxyStatusEntry(permitted_methods=('GET',)),
+        name='wirecloud.proxy_status'),
+
+    url(r'^api/admin/proxy/metrics$',
+        proxy_views.ProxyMetricsEntry(permitted_methods=('GET',)),
+        name='wirecloud.proxy_metrics'),
+
 ) + wirecloud.commons.urls.urlpatterns + get_plugin_urls() + (
 
     url(r'^(?P<owner>[^/]+)/(?P<name>[^/]+)/?$', views.render_workspace_view, name='wirecloud.workspace_view'),
@@ -29,6 +29,8 @@ class XHTML(models.Model):
     uri = models.CharField(_('URI'), max_length=255, unique=True)
     code = models.TextField(_('Code'), blank=True)
     code_timestamp = models.BigIntegerField(_('Cache timestamp'), null=True, blank=True)
+    # Code processed by wirecloud.platform.widget.utils.compile_widget_code
+    compiled_code = models.TextField(_('Compiled code'), blank=True)
     url = models.CharField(_('URL'), max_length=500)
     content_type = models.CharField(_('Content type'), max_length=50, blank=True, null=True)
     use_platform_style = models.BooleanField(_('Uses platform style'), default=False)
@@ -37,22 +39,25 @@ class XHTML(models.Model):
     def __str__(self):
         return self.uri
 
-    def get_cache_key(self, domain, mode, theme):
+    def get_cache_key(self, scheme, domain, mode, theme):
         version = cache.get('_widget_xhtml_version/%s' % self.id)
         if version is None:
             version = random.randrange(1, 100000)
             cache.set('_widget_xhtml_version/%s' % self.id, version)
 
-        return '_widget_xhtml/%s/%s/%s?mode=%s&theme=%s' % (version, domain, self.id, mode, theme)
+        return '_widget_xhtml/%s/%s://%s/%s?mode=%s&theme=%s' % (version, scheme, domain, self.id, mode, theme)
 
-    def delete(self, *args, **kwargs):
-        old_id = self.id
-        super(XHTML, self).delete(*args, **kwargs)
+    def invalidate_cache(self, xhtml_id=None):
         try:
-            cache.incr('_widget_xhtml_version/%s' % old_id)
+            cache.incr('_widget_xhtml_version/%s' % (self.id if xhtml_id is None else xhtml_id))
         except ValueError:
             pass
 
+    def delete(self, *args, **kwargs):
+        old_id = self.id
+        super(XHTML, self).delete(*args, **kwargs)
+        self.invalidate_cache(old_id)
+
     class Meta:
         app_label = 'platform'
         db_table = 'wirecloud_xhtml'
@@ -25,7 +25,7 @@ from django.http import Http404
 from django.test import TestCase, override_settings
 
 from wirecloud.platform import plugins
-from wirecloud.platform.widget.utils import fix_widget_code
+from wirecloud.platform.widget.utils import compile_widget_code, fix_widget_code, get_widget_code_injection, splice_widget_code
 from wirecloud.platform.widget.views import serve_showcase_media
 
 
@@ -68,6 +68,27 @@ class CodeTransformationTestCase(TestCase):
 
         return contents
 
+    def test_compiled_code_variants(self):
+
+        initial_code = self.read_file('test-data/xhtml1-initial.html')
+        compiled_code = compile_widget_code(initial_code, 'application/xhtml+xml', 'utf-8', 1)
+        expected_template = (
+            '<html><head><link rel="stylesheet" type="text/css" href="http://example.com/%s.css"/>'
+            '<script type="text/javascript" src="http://example.com/static/js/WirecloudAPI/WirecloudAPIBootstrap.js?v=v1"/>'
+            '<script type="text/javascript" src="http://example.com/static/js/WirecloudAPI/WirecloudWidgetAPI.js?v=v1"/>'
+            '<script type="text/javascript" src="http://example.com/static/js/WirecloudAPI/WirecloudAPICommon.js?v=v1"/>'
+            '<script type="text/javascript" src="http://example.com/static/js/WirecloudAPI/StyledElements.js?v=v1"/>'
+            '<script type="text/javascript" src="http://example.com/static/js/WirecloudAPI/WirecloudAPIClosure.js?v=v1"/>'
+            '<title>Test</title><script type="text/javascript" src="js/script.js"></script></head>'
+            '<body><div id="element"></div></body></html>'
+        )
+
+        with patch('wirecloud.platform.widget.utils.get_widget_platform_style', side_effect=lambda theme: ('http://example.com/%s.css' % theme,)):
+            for mode, theme in (('classic', 'theme1'), ('smartphone', 'theme2')):
+                injection = get_widget_code_injection('application/xhtml+xml', None, True, {}, mode, theme, 1)
+                final_code = self.XML_NORMALIZATION_RE.sub(b'><', splice_widget_code(compiled_code, injection, 'utf-8'))
+                self.assertEqual(final_code, (expected_template % theme).encode('utf-8'))
+
     def test_unhandled_content_type(self):
 
         initial_code = b'plain text'
@@ -18,6 +18,10 @@
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
 from io import BytesIO
+import logging
+import os
+import time
+from urllib.request import url2pathname
 
 from django.core.cache import cache
 from django.conf import settings
@@ -26,13 +30,16 @@ from django.template import Context, Template
 from lxml import etree
 
 from wirecloud.catalogue.models import CatalogueResource
-from wirecloud.commons.utils.http import ERROR_FORMATTERS, get_absolute_static_url, get_current_domain
+from wirecloud.commons.utils.downloader import download_local_file
+from wirecloud.commons.utils.http import ERROR_FORMATTERS, get_absolute_static_url, get_current_domain, get_current_scheme
 from wirecloud.commons.utils.template import UnsupportedFeature
 from wirecloud.commons.utils.wgt import WgtDeployer, WgtFile
 from wirecloud.platform.models import Widget, XHTML
 from wirecloud.platform.plugins import get_active_features, get_widget_api_extensions
 
 
+logger = logging.getLogger(__name__)
+
 wgt_deployer = WgtDeployer(settings.GADGETS_DEPLOYMENT_DIR)
 WIDGET_ERROR_FORMATTERS = ERROR_FORMATTERS.copy()
 
@@ -88,6 +95,13 @@ def create_widget_from_wgt(wgt_file, user, deploy_only=False):
         )
         widget.save()
 
+        if widget.xhtml.cacheable:
+            try:
+                compile_xhtml(widget.xhtml, widget.resource)
+            except (IOError, UnicodeDecodeError, etree.XMLSyntaxError):
+                # Errors will be reported when serving the widget code
+                logger.warning('Error compiling the code of the %s widget', widget.resource.local_uri_part, exc_info=True)
+
         return widget
 
 
@@ -139,7 +153,7 @@ def get_widget_api_files(request):
 
     from wirecloud.platform.core.plugins import get_version_hash
 
-    key = 'widget_api_files/%s?v=%s' % (get_current_domain(request), get_version_hash())
+    key = 'widget_api_files/%s://%s?v=%s' % (get_current_scheme(request), get_current_domain(request), get_version_hash())
     widget_api_files = cache.get(key)
 
     if widget_api_files is None or settings.DEBUG is True:
@@ -160,7 +174,17 @@ def get_widget_api_files(request):
     return list(widget_api_files)
 
 
-def fix_widget_code(widget_code, content_type, request, encoding, use_platform_style, requirements, mode, theme, macversion):
+WIDGET_CODE_CACHE_TIMEOUT = 31536000  # 1 year
+WIDGET_CODE_INJECTION_POINT = '<!--wirecloud:injection-point-->'
+
+
+def compile_widget_code(widget_code, content_type, encoding, macversion):
+    """
+    Parses the widget code and applies all the transformations that don't
+    depend on the request. Returns the resulting code as a string including a
+    mark on the position where the platform scripts and styles have to be
+    injected (see splice_widget_code).
+    """
 
     # This line is here for raising UnicodeDecodeError in case the widget_code is not encoded using the expecified encoding
     widget_code.decode(encoding)
@@ -177,7 +201,7 @@ def fix_widget_code(widget_code, content_type, request, encoding, use_platform_s
         serialization_options = {'method': 'xml', 'xml_declaration': False}
 
     else:
-        return widget_code
+        return widget_code.decode(encoding)
 
     xmltree = etree.parse(BytesIO(widget_code), parser)
 
@@ -207,17 +231,105 @@ def fix_widget_code(widget_code, content_type, request, encoding, use_platform_s
             if 'src' in script.attrib:
                 script.text = ''
 
-        head_element.insert(0, etree.Element('script', type="text/javascript", src=get_absolute_static_url('js/WirecloudAPI/WirecloudAPIClosure.js', request=request, versioned=True)))
-        files = get_widget_api_extensions(mode, requirements)
-        files.reverse()
-        for file in files:
-            head_element.insert(0, etree.Element('script', type="text/javascript", src=get_absolute_static_url(file, request=request, versioned=True)))
-        for file in get_widget_api_files(request):
-            head_element.insert(0, etree.Element('script', type="text/javascript", src=file))
+    head_element.insert(0, etree.Comment(WIDGET_CODE_INJECTION_POINT[4:-3]))
 
+    return etree.tostring(xmltree, pretty_print=False, encoding=encoding, **serialization_options).decode(encoding)
+
+
+def get_widget_code_injection(content_type, request, use_platform_style, requirements, mode, theme, macversion):
+    """
+    Returns the code of the elements to inject into compiled widget code or
+    None if the content type of the widget code is not processed.
+    """
+
+    if content_type == 'text/html':
+        method = 'html'
+    elif content_type == 'application/xhtml+xml':
+        method = 'xml'
+    else:
+        return None
+
+    elements = []
     if use_platform_style:
-        for file in get_widget_platform_style(theme):
-            head_element.insert(0, etree.Element('link', rel="stylesheet", type="text/css", href=file))
+        for file in reversed(get_widget_platform_style(theme)):
+            elements.append(etree.Element('link', rel="stylesheet", type="text/css", href=file))
+
+    if macversion == 1:
+        for file in reversed(get_widget_api_files(request)):
+            elements.append(etree.Element('script', type="text/javascript", src=file))
+        for file in get_widget_api_extensions(mode, requirements):
+            elements.append(etree.Element('script', type="text/javascript", src=get_absolute_static_url(file, request=request, versioned=True)))
+        elements.append(etree.Element('script', type="text/javascript", src=get_absolute_static_url('js/WirecloudAPI/WirecloudAPIClosure.js', request=request, versioned=True)))
+
+    return ''.join(etree.tostring(element, method=method, encoding='unicode') for element in elements)
+
+
+def splice_widget_code(compiled_code, injection, encoding):
+    """
+    Injects the given code into compiled widget code
+    """
+
+    if injection is None:
+        return compiled_code.encode(encoding)
+
+    return compiled_code.replace(WIDGET_CODE_INJECTION_POINT, injection, 1).encode(encoding)
+
+
+def fix_widget_code(widget_code, content_type, request, encoding, use_platform_style, requirements, mode, theme, macversion):
+
+    compiled_code = compile_widget_code(widget_code, content_type, encoding, macversion)
+    injection = get_widget_code_injection(content_type, request, use_platform_style, requirements, mode, theme, macversion)
+    return splice_widget_code(compiled_code, injection, encoding)
+
+
+def store_compiled_widget_code(xhtml, code, compiled_code, encoding):
+
+    if xhtml.code == '' or xhtml.code_timestamp is None:
+        xhtml.code_timestamp = time.time() * 1000
+
+    xhtml.code = code.decode(encoding)
+    xhtml.compiled_code = compiled_code
+    xhtml.save()
+
+
+def compile_xhtml(xhtml, resource):
+    """
+    Reads the code of a widget from the deployment directory and stores its
+    compiled version on the associated XHTML instance.
+    """
+
+    widget_info = resource.json_description
+    content_type = widget_info['contents'].get('contenttype', 'text/html')
+    charset = widget_info['contents'].get('charset', 'utf-8')
+
+    code = download_local_file(os.path.join(wgt_deployer.root_dir, url2pathname(xhtml.url)))
+    compiled_code = compile_widget_code(code, content_type, charset, resource.get_processed_info()["macversion"])
+    store_compiled_widget_code(xhtml, code, compiled_code, charset)
+
+    return compiled_code
+
+
+def process_requirements(requirements):
+
+    return dict((requirement['name'], {}) for requirement in requirements)
+
+
+def render_widget_code(resource, compiled_code, request, mode, theme):
+
+    widget_info = resource.json_description
+    xhtml = resource.widget.xhtml
+    content_type = widget_info['contents'].get('contenttype', 'text/html')
+    charset = widget_info['contents'].get('charset', 'utf-8')
+
+    injection = get_widget_code_injection(content_type, request, xhtml.use_platform_style, process_requirements(widget_info['requirements']), mode, theme, resource.get_processed_info()["macversion"])
+    return splice_widget_code(compiled_code, injection, charset)
+
+
+def build_widget_code_cache_entry(xhtml, code, content_type, charset):
 
-    # return modified code
-    return etree.tostring(xmltree, pretty_print=False, encoding=encoding, **serialization_options)
+    return {
+        'code': code,
+        'content_type': '%s; charset=%s' % (content_type, charset),
+        'timestamp': xhtml.code_timestamp,
+        'timeout': WIDGET_CODE_CACHE_TIMEOUT,
+    }
@@ -18,11 +18,9 @@
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
 import errno
-import time
 import os
 from urllib.request import url2pathname
 
-from django.core.cache import cache
 from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
@@ -31,87 +29,79 @@ from django.views.decorators.http import require_GET
 from django.views.generic import TemplateView
 
 from wirecloud.catalogue.models import CatalogueResource
-from wirecloud.commons.utils.cache import patch_cache_headers
+from wirecloud.commons.exceptions import ErrorResponse
+from wirecloud.commons.utils.cache import get_or_set_single_flight, patch_cache_headers
 from wirecloud.commons.utils.downloader import download_local_file
-from wirecloud.commons.utils.http import build_response, build_downloadfile_response, get_current_domain
+from wirecloud.commons.utils.http import build_response, build_downloadfile_response, get_current_domain, get_current_scheme
 from wirecloud.platform.themes import get_active_theme_name
 import wirecloud.platform.widget.utils as showcase_utils
-from wirecloud.platform.widget.utils import WIDGET_ERROR_FORMATTERS, fix_widget_code, get_widget_platform_style
+from wirecloud.platform.widget.utils import build_widget_code_cache_entry, compile_widget_code, get_widget_platform_style, render_widget_code, store_compiled_widget_code, WIDGET_CODE_CACHE_TIMEOUT, WIDGET_ERROR_FORMATTERS
 
 
-def process_requirements(requirements):
+def build_widget_code(request, resource, mode, theme):
 
-    return dict((requirement['name'], {}) for requirement in requirements)
-
-
-def process_widget_code(request, resource):
-
-    mode = request.GET.get('mode', 'classic')
-    theme = request.GET.get('theme', get_active_theme_name())
     widget_info = resource.json_description
-
-    # check if the xhtml code has been cached
-    if widget_info['contents']['cacheable'] is True:
-
-        cache_key = resource.widget.xhtml.get_cache_key(get_current_domain(request), mode, theme)
-        cache_entry = cache.get(cache_key)
-        if cache_entry is not None:
-            response = HttpResponse(cache_entry['code'], content_type=cache_entry['content_type'])
-            patch_cache_headers(response, cache_entry['timestamp'], cache_entry['timeout'])
-            return response
-
-    # process xhtml
     xhtml = resource.widget.xhtml
     content_type = widget_info['contents'].get('contenttype', 'text/html')
     charset = widget_info['contents'].get('charset', 'utf-8')
+    macversion = resource.get_processed_info()["macversion"]
+
+    compiled_code = xhtml.compiled_code if xhtml.cacheable else ''
+    if compiled_code == '':
+        code = xhtml.code
+        if not xhtml.cacheable or code == '':
+            try:
+                code = download_local_file(os.path.join(showcase_utils.wgt_deployer.root_dir, url2pathname(xhtml.url)))
+
+            except Exception as e:
+                if isinstance(e, IOError) and e.errno == errno.ENOENT:
+                    raise ErrorResponse(build_response(request, 404, {'error_msg': _("Widget code not found"), 'details': "%s" % e}, WIDGET_ERROR_FORMATTERS))
+                else:
+                    raise ErrorResponse(build_response(request, 500, {'error_msg': _("Error reading widget code"), 'details': "%s" % e}, WIDGET_ERROR_FORMATTERS))
+        else:
+            # Code contents comes as unicode from persistence, we need bytes
+            code = code.encode(charset)
 
-    code = xhtml.code
-    if not xhtml.cacheable or code == '':
-        try:
-            code = download_local_file(os.path.join(showcase_utils.wgt_deployer.root_dir, url2pathname(xhtml.url)))
-
-        except Exception as e:
-            if isinstance(e, IOError) and e.errno == errno.ENOENT:
-                return build_response(request, 404, {'error_msg': _("Widget code not found"), 'details': "%s" % e}, WIDGET_ERROR_FORMATTERS)
-            else:
-                return build_response(request, 500, {'error_msg': _("Error reading widget code"), 'details': "%s" % e}, WIDGET_ERROR_FORMATTERS)
-    else:
-        # Code contents comes as unicode from persistence, we need bytes
-        code = code.encode(charset)
-
-    if xhtml.cacheable and (xhtml.code == '' or xhtml.code_timestamp is None):
         try:
-            xhtml.code = code.decode(charset)
+            compiled_code = compile_widget_code(code, content_type, charset, macversion)
         except UnicodeDecodeError:
             msg = _('Widget code was not encoded using the specified charset (%(charset)s as stated in the widget description file).') % {'charset': charset}
-            return build_response(request, 502, {'error_msg': msg}, WIDGET_ERROR_FORMATTERS)
+            raise ErrorResponse(build_response(request, 502, {'error_msg': msg}, WIDGET_ERROR_FORMATTERS))
+        except Exception as e:
+            msg = _('Error processing widget code')
+            raise ErrorResponse(build_response(request, 502, {'error_msg': msg, 'details': "%s" % e}, WIDGET_ERROR_FORMATTERS))
 
-        xhtml.code_timestamp = time.time() * 1000
-        xhtml.save()
+        if xhtml.cacheable:
+            store_compiled_widget_code(xhtml, code, compiled_code, charset)
 
     try:
-        code = fix_widget_code(code, content_type, request, charset, xhtml.use_platform_style, process_requirements(widget_info['requirements']), mode, theme, resource.get_processed_info()["macversion"])
-    except UnicodeDecodeError:
-        msg = _('Widget code was not encoded using the specified charset (%(charset)s as stated in the widget description file).') % {'charset': charset}
-        return build_response(request, 502, {'error_msg': msg}, WIDGET_ERROR_FORMATTERS)
+        code = render_widget_code(resource, compiled_code, request, mode, theme)
     except Exception as e:
         msg = _('Error processing widget code')
-        return build_response(request, 502, {'error_msg': msg, 'details': "%s" % e}, WIDGET_ERROR_FORMATTERS)
-
-    if xhtml.cacheable:
-        cache_timeout = 31536000  # 1 year
-        cache_entry = {
-            'code': code,
-            'content_type': '%s; charset=%s' % (content_type, charset),
-            'timestamp': xhtml.code_timestamp,
-            'timeout': cache_timeout,
-        }
-        cache.set(cache_key, cache_entry, cache_timeout)
-    else:
-        cache_timeout = 0
-
-    response = HttpResponse(code, content_type='%s; charset=%s' % (content_type, charset))
-    patch_cache_headers(response, xhtml.code_timestamp, cache_timeout)
+        raise ErrorResponse(build_response(request, 502, {'error_msg': msg, 'details': "%s" % e}, WIDGET_ERROR_FORMATTERS))
+
+    return build_widget_code_cache_entry(xhtml, code, content_type, charset)
+
+
+def process_widget_code(request, resource):
+
+    mode = request.GET.get('mode', 'classic')
+    theme = request.GET.get('theme', get_active_theme_name())
+    widget_info = resource.json_description
+
+    try:
+        # check if the xhtml code has been cached
+        if widget_info['contents']['cacheable'] is True:
+            cache_key = resource.widget.xhtml.get_cache_key(get_current_scheme(request), get_current_domain(request), mode, theme)
+            cache_entry = get_or_set_single_flight(cache_key, lambda: build_widget_code(request, resource, mode, theme), WIDGET_CODE_CACHE_TIMEOUT)
+        else:
+            cache_entry = build_widget_code(request, resource, mode, theme)
+            cache_entry['timeout'] = 0
+    except ErrorResponse as e:
+        return e.response
+
+    response = HttpResponse(cache_entry['code'], content_type=cache_entry['content_type'])
+    patch_cache_headers(response, cache_entry['timestamp'], cache_entry['timeout'])
     return response
 
 
@@ -130,7 +120,8 @@ def serve_showcase_media(request, vendor, name, version, file_path):
         return process_widget_code(request, resource)
 
     base_dir = showcase_utils.wgt_deployer.get_base_dir(vendor, name, version)
-    response = build_downloadfile_response(request, file_path, base_dir)
+    # -dev versions can be redeployed using the same version
+    response = build_downloadfile_response(request, file_path, base_dir, immutable='-dev' not in version)
     if response.status_code == 302:
         response['Location'] = reverse('wirecloud.showcase_media', kwargs={"vendor": vendor, "name": name, "version": version, "file_path": response['Location']})
 
@@ -22,7 +22,6 @@ import json
 import jsonpatch
 import re
 
-from django.core.cache import cache
 from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils.translation import ugettext as _
@@ -30,7 +29,7 @@ from copy import deepcopy
 
 from wirecloud.catalogue.models import CatalogueResource
 from wirecloud.commons.baseviews import Resource
-from wirecloud.commons.utils.cache import CacheableData
+from wirecloud.commons.utils.cache import CacheableData, get_or_set_single_flight
 from wirecloud.commons.utils.http import authentication_required, build_error_response, get_absolute_reverse_url, get_current_domain, consumes, parse_json_request
 from wirecloud.commons.utils.transaction import commit_on_http_success
 from wirecloud.platform.models import Workspace
@@ -300,7 +299,7 @@ class WiringEntry(Resource):
             return result
 
         workspace.wiringStatus = new_wiring_status
-        workspace.save()
+        workspace.save(update_fields=('wiringStatus',))
 
         return HttpResponse(status=204)
 
@@ -353,7 +352,7 @@ class WiringEntry(Resource):
         if result is not True:
             return result
         workspace.wiringStatus = new_wiring_status
-        workspace.save()
+        workspace.save(update_fields=('wiringStatus',))
 
         return HttpResponse(status=204)
 
@@ -374,9 +373,9 @@ class OperatorEntry(Resource):
 
         mode = request.GET.get('mode', 'classic')
 
-        key = get_operator_cache_key(operator, get_current_domain(request), mode)
-        cached_response = cache.get(key)
-        if cached_response is None:
+        cache_timeout = 31536000  # 1 year
+
+        def build_operator_code():
             options = operator.json_description
             js_files = options['js_files']
 
@@ -388,10 +387,10 @@ class OperatorEntry(Resource):
             }, request=request)
 
             xhtml = generate_xhtml_operator_code(js_files, base_url, request, process_requirements(options['requirements']), mode)
-            cache_timeout = 31536000  # 1 year
-            cached_response = CacheableData(xhtml, timeout=cache_timeout, content_type='application/xhtml+xml; charset=UTF-8')
+            return CacheableData(xhtml, timeout=cache_timeout, content_type='application/xhtml+xml; charset=UTF-8')
 
-            cache.set(key, cached_response, cache_timeout)
+        key = get_operator_cache_key(operator, get_current_domain(request), mode)
+        cached_response = get_or_set_single_flight(key, build_operator_code, cache_timeout)
 
         return cached_response.get_response()
 
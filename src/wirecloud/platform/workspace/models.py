@@ -25,6 +25,7 @@ from django.db import models
 from django.utils.translation import ugettext as _
 
 from wirecloud.commons.fields import JSONField
+from wirecloud.commons.utils.cache import get_cache_version, get_cache_versions, invalidate_cache_version
 
 
 def now_timestamp():
@@ -53,6 +54,10 @@ class Workspace(models.Model):
 
     __original_public = False
 
+    # Sections of the cached workspace data, each one has its own version so
+    # changes only invalidate the affected fragments
+    CACHE_SECTIONS = ('metadata', 'tabs', 'wiring')
+
     class Meta:
         app_label = 'platform'
         db_table = 'wirecloud_workspace'
@@ -78,6 +83,36 @@ class Workspace(models.Model):
 
         super(Workspace, self).save(*args, **kwargs)
 
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.invalidate_cache('metadata', 'wiring')
+        else:
+            sections = []
+            if 'wiringStatus' in update_fields:
+                sections.append('wiring')
+            if len(set(update_fields) - {'last_modified', 'wiringStatus'}) > 0:
+                sections.append('metadata')
+            self.invalidate_cache(*sections)
+
+    @staticmethod
+    def build_cache_version_key(workspace_id, section):
+        return '_workspace_version/%s/%s' % (workspace_id, section)
+
+    def get_cache_version_key(self, section):
+        return self.build_cache_version_key(self.id, section)
+
+    def get_cache_version(self, section):
+        return get_cache_version(self.get_cache_version_key(section))
+
+    def get_cache_versions(self):
+        keys = {section: self.get_cache_version_key(section) for section in self.CACHE_SECTIONS}
+        versions = get_cache_versions(tuple(keys.values()))
+        return {section: versions[key] for section, key in keys.items()}
+
+    def invalidate_cache(self, *sections):
+        for section in sections:
+            invalidate_cache_version(self.get_cache_version_key(section))
+
     def is_accessible_by(self, user):
         return (
             user.is_superuser
@@ -139,8 +174,28 @@ class Tab(models.Model):
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def build_cache_version_key(tab_id):
+        return '_tab_version/%s' % tab_id
+
+    @property
+    def cache_version(self):
+        return get_cache_version(self.build_cache_version_key(self.id))
+
+    def invalidate_cache(self):
+        invalidate_cache_version(self.build_cache_version_key(self.id))
+
     def save(self, *args, **kwargs):
 
         super(Tab, self).save(*args, **kwargs)
 
-        self.workspace.save()
+        self.invalidate_cache()
+        self.workspace.invalidate_cache('tabs')
+        self.workspace.save(update_fields=('last_modified',))
+
+    def delete(self, *args, **kwargs):
+
+        super(Tab, self).delete(*args, **kwargs)
+
+        self.workspace.invalidate_cache('tabs')
+        self.workspace.save(update_fields=('last_modified',))
@@ -27,18 +27,22 @@ from unittest import TestCase
 from unittest.mock import Mock, patch
 
 from django.contrib.auth.models import AnonymousUser, User, Group
+from django.core.cache import cache
+from django.db import connection
 from django.db.migrations.exceptions import IrreversibleError
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from parameterized import parameterized
 
 from wirecloud.commons.utils.template import TemplateParser
 from wirecloud.commons.utils.testcases import uses_extra_resources, WirecloudTestCase
 from wirecloud.commons.utils.wgt import WgtFile
 from wirecloud.platform.iwidget.utils import SaveIWidget
 from wirecloud.platform.models import IWidget, Tab, UserWorkspace, Workspace
-from wirecloud.platform.preferences.views import update_workspace_preferences
+from wirecloud.platform.preferences.views import update_tab_preferences, update_workspace_preferences
 from wirecloud.platform.workspace.mashupTemplateGenerator import build_json_template_from_workspace, build_xml_template_from_workspace, build_rdf_template_from_workspace
 from wirecloud.platform.workspace.mashupTemplateParser import buildWorkspaceFromTemplate, fillWorkspaceUsingTemplate
-from wirecloud.platform.workspace.utils import get_global_workspace_data, encrypt_value, create_workspace, delete_workspace
+from wirecloud.platform.workspace.utils import get_global_workspace_data, get_iwidget_data, encrypt_value, create_workspace, delete_workspace
 from wirecloud.platform.workspace.views import createEmptyWorkspace
 from wirecloud.platform.migration_utils import multiuser_variables_structure_forwards, multiuser_variables_structure_backwards
 
@@ -390,6 +394,33 @@ class WorkspaceCacheTestCase(WirecloudTestCase, TransactionTestCase):
         workspace_info = get_global_workspace_data(self.workspace, self.user)
         self.assertEqual(self.initial_info.timestamp, workspace_info.timestamp)
 
+    def test_cached_workspace_data_is_not_stored_again(self):
+
+        with patch('wirecloud.commons.utils.cache.cache') as cache_mock:
+            cache_mock.get_many.side_effect = lambda keys: cache.get_many(keys)
+            workspace_info = get_global_workspace_data(self.workspace, self.user)
+
+        cache_mock.set.assert_not_called()
+        cache_mock.set_many.assert_not_called()
+        cache_mock.add.assert_not_called()
+        self.assertEqual(workspace_info.get_data(), self.initial_info.get_data())
+
+    def test_workspace_data_is_served_stale_as_a_unit(self):
+
+        self.workspace.name = 'renamed'
+        self.workspace.save()
+        self.workspace.invalidate_cache('metadata', 'wiring')
+
+        # Simulate other process assembling the new version of the document
+        with patch('wirecloud.commons.utils.cache.cache.add', return_value=False), patch('wirecloud.commons.utils.cache.time.sleep'):
+            workspace_info = get_global_workspace_data(self.workspace, self.user)
+        self.assertEqual(workspace_info.timestamp, self.initial_info.timestamp)
+        self.assertEqual(workspace_info.get_data(), self.initial_info.get_data())
+
+        workspace_info = get_global_workspace_data(self.workspace, self.user)
+        self.assertNotEqual(workspace_info.timestamp, self.initial_info.timestamp)
+        self.assertEqual(json.loads(workspace_info.get_data())['name'], 'renamed')
+
     def test_updating_preferences_invalidates_cache(self):
 
         iwidget = self.workspace.tab_set.get(pk=1).iwidget_set.get(pk=1)
@@ -458,6 +489,152 @@ class WorkspaceCacheTestCase(WirecloudTestCase, TransactionTestCase):
         iwidget_list = data['tabs'][0]['iwidgets']
         self.assertEqual(len(iwidget_list), 1)
 
+    def test_widget_update_only_invalidates_widget_data(self):
+
+        iwidget = self.workspace.tab_set.get(pk=1).iwidget_set.get(pk=1)
+        iwidget.positions['widget']['top'] = 5
+        iwidget.save()
+
+        with patch('wirecloud.platform.workspace.utils.get_iwidget_data', wraps=get_iwidget_data) as get_iwidget_data_mock:
+            with patch('wirecloud.platform.workspace.utils._get_workspace_metadata') as get_workspace_metadata_mock:
+                with patch('wirecloud.platform.workspace.utils._get_workspace_wiring') as get_workspace_wiring_mock:
+                    workspace_info = get_global_workspace_data(self.workspace, self.user)
+
+        self.assertNotEqual(self.initial_info.timestamp, workspace_info.timestamp)
+        self.assertEqual(get_iwidget_data_mock.call_count, 1)
+        self.assertEqual(get_iwidget_data_mock.call_args[0][0].id, 1)
+        get_workspace_metadata_mock.assert_not_called()
+        get_workspace_wiring_mock.assert_not_called()
+
+        data = json.loads(workspace_info.get_data())
+        iwidget_list = data['tabs'][0]['iwidgets']
+        self.assertEqual(len(iwidget_list), 2)
+        self.assertEqual(iwidget_list[0]['top'], 5)
+
+    def test_widget_move_invalidates_tab_data(self):
+
+        new_tab = Tab.objects.create(workspace=self.workspace, name='new_tab', title='New Tab', position=1)
+        iwidget = self.workspace.tab_set.get(pk=1).iwidget_set.get(pk=1)
+        iwidget.tab = new_tab
+        iwidget.save()
+
+        data = json.loads(get_global_workspace_data(self.workspace, self.user).get_data())
+        self.assertEqual(len(data['tabs']), 2)
+        self.assertEqual([iwidget['id'] for iwidget in data['tabs'][0]['iwidgets']], ['2'])
+        self.assertEqual([iwidget['id'] for iwidget in data['tabs'][1]['iwidgets']], ['1'])
+        self.assertEqual(data['tabs'][1]['iwidgets'][0]['tab'], new_tab.id)
+
+    def test_tab_preferences_update_invalidates_cache(self):
+
+        tab = self.workspace.tab_set.get(pk=1)
+        update_tab_preferences(tab, {'baselayout': {'value': 'freeform', 'inherit': False}})
+
+        workspace_info = get_global_workspace_data(self.workspace, self.user)
+        self.assertNotEqual(self.initial_info.timestamp, workspace_info.timestamp)
+
+        data = json.loads(workspace_info.get_data())
+        self.assertEqual(data['tabs'][0]['preferences']['baselayout'], {'value': 'freeform', 'inherit': False})
+
+    def test_wiring_update_only_invalidates_wiring_data(self):
+
+        self.workspace.wiringStatus['operators']['1']['preferences']['pref_with_val']['value']['users']['2'] = 'new_value'
+        self.workspace.save(update_fields=('wiringStatus',))
+
+        with patch('wirecloud.platform.workspace.utils.get_iwidget_data') as get_iwidget_data_mock:
+            with patch('wirecloud.platform.workspace.utils._get_workspace_metadata') as get_workspace_metadata_mock:
+                workspace_info = get_global_workspace_data(self.workspace, self.user)
+
+        get_iwidget_data_mock.assert_not_called()
+        get_workspace_metadata_mock.assert_not_called()
+
+        data = json.loads(workspace_info.get_data())
+        self.assertEqual(data['wiring']['operators']['1']['preferences']['pref_with_val']['value'], 'new_value')
+
+    def test_component_availability_changes_invalidate_widget_data(self):
+
+        resource = self.workspace.tab_set.get(pk=1).iwidget_set.get(pk=1).widget.resource
+        resource.public = False
+        resource.save()
+        resource.users.clear()
+        resource.groups.clear()
+
+        data = json.loads(get_global_workspace_data(self.workspace, self.user).get_data())
+        iwidget_data = [iwidget for iwidget in data['tabs'][0]['iwidgets'] if iwidget['id'] == '1'][0]
+        self.assertEqual(iwidget_data['preferences'], {})
+        self.assertEqual(iwidget_data['properties'], {})
+
+        resource.users.add(self.workspace.creator)
+
+        data = json.loads(get_global_workspace_data(self.workspace, self.user).get_data())
+        iwidget_data = [iwidget for iwidget in data['tabs'][0]['iwidgets'] if iwidget['id'] == '1'][0]
+        self.assertEqual(iwidget_data['preferences']['username']['value'], 'test_username')
+
+    def test_sharing_invalidates_metadata(self):
+
+        UserWorkspace.objects.create(workspace=self.workspace, user=User.objects.get(username='test3'))
+
+        data = json.loads(get_global_workspace_data(self.workspace, self.user).get_data())
+        self.assertEqual(set(user['username'] for user in data['users']), {'test', 'test2', 'test3'})
+
+
+class WorkspaceSerializationQueriesTestCase(WirecloudTestCase, TransactionTestCase):
+
+    fixtures = ('test_data',)
+    tags = ('wirecloud-workspace', 'wirecloud-noselenium')
+    populate = False
+    use_search_indexes = False
+
+    def setUp(self):
+        super(WorkspaceSerializationQueriesTestCase, self).setUp()
+
+        self.user = User.objects.get(username='test')
+
+    def build_workspace(self, iwidget_count, tab_count=5):
+
+        workspace = Workspace.objects.get(pk=1)
+        template = IWidget.objects.get(pk=1)
+        tabs = [Tab.objects.create(workspace=workspace, name='tab%s' % i, title='Tab %s' % i, position=i) for i in range(1, tab_count)]
+        tabs.append(template.tab)
+
+        IWidget.objects.bulk_create([
+            IWidget(
+                widget=template.widget,
+                widget_uri=template.widget_uri,
+                name='Widget %s' % i,
+                tab=tabs[i % len(tabs)],
+                positions=template.positions,
+                permissions=template.permissions,
+                variables=template.variables,
+            ) for i in range(iwidget_count)
+        ])
+
+        return Workspace.objects.get(pk=1)
+
+    def count_queries(self, workspace):
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            data = json.loads(get_global_workspace_data(workspace, self.user).get_data())
+
+        return len(context), data
+
+    @parameterized.expand([
+        (5,),
+        (50,),
+        (500,),
+    ])
+    def test_get_global_workspace_data_query_count(self, iwidget_count):
+
+        # Base workspace: 1 tab, 2 iwidgets and 1 operator
+        base_queries, data = self.count_queries(Workspace.objects.get(pk=1))
+        self.assertEqual(sum(len(tab['iwidgets']) for tab in data['tabs']), 2)
+
+        queries, data = self.count_queries(self.build_workspace(iwidget_count))
+
+        self.assertEqual(len(data['tabs']), 5)
+        self.assertEqual(sum(len(tab['iwidgets']) for tab in data['tabs']), iwidget_count + 2)
+        self.assertEqual(queries, base_queries)
+
 
 class ParameterizedWorkspaceGenerationTestCase(WirecloudTestCase, TransactionTestCase):
 
@@ -28,7 +28,7 @@ import re
 
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.shortcuts import get_object_or_404
 from django.utils.translation import ugettext as _
 import markdown
@@ -36,7 +36,7 @@ import markdown
 from wirecloud.catalogue import utils as catalogue
 from wirecloud.catalogue.models import CatalogueResource
 from wirecloud.commons.models import Organization
-from wirecloud.commons.utils.cache import CacheableData
+from wirecloud.commons.utils.cache import CacheableData, get_cache_version, get_cache_versions, get_many_or_set_single_flight, get_or_set_single_flight
 from wirecloud.commons.utils.db import save_alternative
 from wirecloud.commons.utils.downloader import download_http_content
 from wirecloud.commons.utils.encoding import LazyEncoder
@@ -51,6 +51,11 @@ from wirecloud.platform.preferences.views import get_workspace_preference_values
 from wirecloud.platform.models import IWidget, Tab, Workspace
 
 
+# Max time (in seconds) a previous version of the workspace data can be served
+# while other process is assembling the current one
+WORKSPACE_STALE_DATA_TIMEOUT = 60
+
+
 def deleteTab(tab, user):
     # Delete iwidgets
     for iwidget in tab.iwidget_set.all():
@@ -119,14 +124,13 @@ def get_workspace_list(user):
     return workspaces
 
 
-def _process_variable(component_type, component_id, vardef, value, forced_values, values_by_varname, current_user, workspace_creator):
-    varname = vardef['name']
+def _process_variable(component_type, component_id, vardef, value, forced_values, current_user, workspace_creator):
     entry = {
         'type': vardef['type'],
         'secure': vardef['secure'],
     }
-    if component_id in forced_values[component_type] and varname in forced_values[component_type][component_id]:
-        fv_entry = forced_values[component_type][component_id][varname]
+    if component_id in forced_values[component_type] and vardef['name'] in forced_values[component_type][component_id]:
+        fv_entry = forced_values[component_type][component_id][vardef['name']]
 
         entry['value'] = fv_entry['value']
         if vardef['secure']:
@@ -149,65 +153,74 @@ def _process_variable(component_type, component_id, vardef, value, forced_values
         entry['readonly'] = False
         entry['hidden'] = False
 
-    values_by_varname[component_type][component_id][varname] = entry
+    return entry
 
 
-def _populate_variables_values_cache(workspace, user, key, forced_values=None):
-    """ populates VariableValue cached values for that user """
-    values_by_varname = {
-        "ioperator": {},
-        "iwidget": {},
-    }
-    if forced_values is None:
-        context_values = get_context_values(workspace, user)
-        preferences = get_workspace_preference_values(workspace)
-        forced_values = process_forced_values(workspace, user, context_values, preferences)
+def _get_iwidget_variable_values(workspace, user, iwidget, forced_values):
+    """ returns the VariableValue values of an iwidget for that user """
+    values = {}
 
-    for iwidget in IWidget.objects.filter(tab__workspace=workspace):
-        # forced_values uses string keys
-        svariwidget = str(iwidget.id)
-        values_by_varname["iwidget"][svariwidget] = {}
+    if iwidget.widget is None:
+        return values
 
-        if iwidget.widget is None:
-            continue
+    # forced_values uses string keys
+    svariwidget = str(iwidget.id)
+    iwidget_info = iwidget.widget.resource.get_processed_info()
+    for vardef in iwidget_info.get('preferences', []) + iwidget_info.get('properties', []):
+        value = iwidget.variables.get(vardef['name'], None)
+        values[vardef['name']] = _process_variable("iwidget", svariwidget, vardef, value, forced_values, user, workspace.creator)
+
+    return values
+
+
+def _get_operator_variable_values(workspace, user, operator_id, operator, resource, forced_values):
+    """ returns the VariableValue values of an operator for that user """
+    values = {}
+
+    if resource is None:
+        return values
 
-        iwidget_info = iwidget.widget.resource.get_processed_info()
+    operator_info = resource.get_processed_info()
+    for vardef in operator_info.get('preferences', []):
+        value = operator.get("preferences", {}).get(vardef['name'], {}).get("value")
+        values[vardef['name']] = _process_variable("ioperator", operator_id, vardef, value, forced_values, user, workspace.creator)
 
-        for vardef in iwidget_info.get('preferences', {}):
-            value = iwidget.variables.get(vardef['name'], None)
-            _process_variable("iwidget", svariwidget, vardef, value, forced_values, values_by_varname, user, workspace.creator)
+    for vardef in operator_info.get('properties', []):
+        value = operator.get("properties", {}).get(vardef['name'], {}).get("value")
+        values[vardef['name']] = _process_variable("ioperator", operator_id, vardef, value, forced_values, user, workspace.creator)
 
-        for vardef in iwidget_info.get('properties', {}):
-            value = iwidget.variables.get(vardef['name'], None)
-            _process_variable("iwidget", svariwidget, vardef, value, forced_values, values_by_varname, user, workspace.creator)
+    return values
 
-    for operator_id, operator in workspace.wiringStatus.get('operators', {}).items():
 
-        values_by_varname["ioperator"][operator_id] = {}
-        vendor, name, version = operator['name'].split('/')
+def get_operator_resources(wiring_status):
+    """
+    Retrieves the catalogue resources used by the operators of the given
+    wiring status using a single query. Returns a dict indexed by the operator
+    names (vendor/name/version).
+    """
+
+    query = Q()
+    for operator in wiring_status.get('operators', {}).values():
         try:
-            operator_info = CatalogueResource.objects.get(vendor=vendor, short_name=name, version=version).get_processed_info()
-        except CatalogueResource.DoesNotExist:
+            (vendor, name, version) = operator['name'].split('/')
+        except (KeyError, ValueError):
             continue
-        for vardef in operator_info.get('preferences', {}):
-            value = operator.get("preferences", {}).get(vardef['name'], {}).get("value")
-            _process_variable("ioperator", operator_id, vardef, value, forced_values, values_by_varname, user, workspace.creator)
 
-        for vardef in operator_info.get('properties', {}):
-            value = operator.get("properties", {}).get(vardef['name'], {}).get("value")
-            _process_variable("ioperator", operator_id, vardef, value, forced_values, values_by_varname, user, workspace.creator)
+        query |= Q(vendor=vendor, short_name=name, version=version)
 
-    cache.set(key, values_by_varname)
+    if len(query) == 0:
+        return {}
 
-    return values_by_varname
+    return {resource.local_uri_part: resource for resource in CatalogueResource.objects.filter(query)}
 
 
-def _variable_values_cache_key(workspace, user):
-    return '_variables_values_cache/%s/%s/%s' % (workspace.id, workspace.last_modified, user.id)
-
+def _variable_values_cache_key(workspace, user, component_type, component_id):
+    if component_type == "iwidget":
+        component_version = get_cache_version(IWidget.build_cache_version_key(component_id))
+    else:
+        component_version = workspace.get_cache_version('wiring')
 
-def _workspace_cache_key(workspace, user):
-    return '_workspace_global_data/%s/%s/%s' % (workspace.id, workspace.last_modified, user.id)
+    return '_variables_values_cache/%s/%s/%s/%s/%s/%s' % (workspace.id, workspace.get_cache_version('metadata'), component_type, component_id, component_version, user.id)
 
 
 class VariableValueCacheManager():
@@ -221,6 +234,10 @@ class VariableValueCacheManager():
         self.workspace = workspace
         self.user = user
         self.forced_values = forced_values
+        self.values = {
+            "ioperator": {},
+            "iwidget": {},
+        }
 
     def _process_entry(self, entry):
 
@@ -230,24 +247,55 @@ class VariableValueCacheManager():
         else:
             return entry['value']
 
-    def get_variable_values(self):
-        if self.values is None:
-            key = _variable_values_cache_key(self.workspace, self.user)
-            self.values = cache.get(key)
-            if self.values is None:
-                self.values = _populate_variables_values_cache(self.workspace, self.user, key, self.forced_values)
+    def get_forced_values(self):
+        if self.forced_values is None:
+            context_values = get_context_values(self.workspace, self.user)
+            preferences = get_workspace_preference_values(self.workspace)
+            self.forced_values = process_forced_values(self.workspace, self.user, context_values, preferences)
+
+        return self.forced_values
+
+    def get_component_values(self, component_type, component_id, component=None):
+        """
+        Returns the variable values of a component. Values are cached per
+        component, so updating a component only invalidates its own values.
+        The component instance (an IWidget for iwidgets) can be provided to
+        avoid retrieving it from the database.
+        """
+
+        component_id = str(component_id)
+        values = self.values[component_type].get(component_id)
+        if values is not None:
+            return values
+
+        def compute():
+            if component_type == "iwidget":
+                iwidget = component
+                if iwidget is None:
+                    try:
+                        iwidget = IWidget.objects.select_related('widget__resource').get(tab__workspace=self.workspace, pk=component_id)
+                    except (IWidget.DoesNotExist, ValueError):
+                        raise KeyError(component_id)
+
+                return _get_iwidget_variable_values(self.workspace, self.user, iwidget, self.get_forced_values())
+            else:
+                operator = self.workspace.wiringStatus.get('operators', {})[component_id]
+                resource = get_operator_resources({'operators': {component_id: operator}}).get(operator.get('name'))
+                return _get_operator_variable_values(self.workspace, self.user, component_id, operator, resource, self.get_forced_values())
+
+        key = _variable_values_cache_key(self.workspace, self.user, component_type, component_id)
+        values = get_or_set_single_flight(key, compute)
 
-        return self.values
+        self.values[component_type][component_id] = values
+        return values
 
     def get_variable_value_from_varname(self, component_type, component_id, var_name):
-        values = self.get_variable_values()
-        entry = values[component_type][str(component_id)][var_name]
+        entry = self.get_component_values(component_type, component_id)[var_name]
         return self._process_entry(entry)
 
     # Get variable data
     def get_variable_data(self, component_type, component_id, var_name):
-        values = self.get_variable_values()
-        entry = values[component_type][str(component_id)][var_name]
+        entry = self.get_component_values(component_type, component_id)[var_name]
 
         # If secure and has value, censor it
         if entry['secure'] and entry["value"] != "":
@@ -369,7 +417,31 @@ def process_forced_values(workspace, user, concept_values, preferences):
     return forced_values
 
 
-def _get_global_workspace_data(workspaceDAO, user):
+def _workspace_document_cache_key(workspace, versions, user):
+    return '_workspace_document/%s/%s/%s/%s/%s/%s/%s' % (workspace.id, versions['metadata'], versions['tabs'], versions['wiring'], versions['availability'], workspace.last_modified, user.id)
+
+
+def _workspace_cache_key(workspace, versions, user):
+    return '_workspace_global_data/%s/%s/%s' % (workspace.id, versions['metadata'], user.id)
+
+
+def _workspace_tabs_cache_key(workspace, versions):
+    return '_workspace_tabs/%s/%s' % (workspace.id, versions['tabs'])
+
+
+def _workspace_wiring_cache_key(workspace, versions, user):
+    return '_workspace_wiring/%s/%s/%s/%s/%s' % (workspace.id, versions['metadata'], versions['wiring'], versions['availability'], user.id)
+
+
+def _tab_cache_key(tab_id, tab_version):
+    return '_tab_data/%s/%s' % (tab_id, tab_version)
+
+
+def _iwidget_cache_key(iwidget_id, iwidget_version, versions, user):
+    return '_iwidget_data/%s/%s/%s/%s/%s' % (iwidget_id, iwidget_version, versions['metadata'], versions['availability'], user.id)
+
+
+def _get_workspace_metadata(workspaceDAO, user, cache_manager):
     data_ret = get_workspace_data(workspaceDAO, user)
 
     # Workspace preferences
@@ -380,7 +452,7 @@ def _get_global_workspace_data(workspaceDAO, user):
     data_ret['groups'] = []
 
     if workspaceDAO.creator == user:
-        for u in workspaceDAO.users.all():
+        for u in workspaceDAO.users.select_related('organization'):
             try:
                 is_organization = u.organization is not None
             except Organization.DoesNotExist:
@@ -393,7 +465,7 @@ def _get_global_workspace_data(workspaceDAO, user):
                 "accesslevel": "owner" if workspaceDAO.creator == u else "read",
             })
 
-        for g in workspaceDAO.groups.all():
+        for g in workspaceDAO.groups.select_related('organization'):
             try:
                 is_organization = g.organization is not None
             except Organization.DoesNotExist:
@@ -406,40 +478,89 @@ def _get_global_workspace_data(workspaceDAO, user):
                 })
 
     # Process forced variable values
-    concept_values = get_context_values(workspaceDAO, user)
-    forced_values = process_forced_values(workspaceDAO, user, concept_values, preferences)
+    forced_values = cache_manager.get_forced_values()
     data_ret['empty_params'] = forced_values['empty_params']
     data_ret['extra_prefs'] = forced_values['extra_prefs']
-    if len(forced_values['empty_params']) > 0:
-        return json.dumps(data_ret, cls=LazyEncoder)
 
-    cache_manager = VariableValueCacheManager(workspaceDAO, user, forced_values)
+    return data_ret
 
-    # Tabs processing
-    # Check if the workspace's tabs have order
-    tabs = Tab.objects.filter(workspace=workspaceDAO).order_by('position')
-    if tabs.count() == 0:
-        tabs = [createTab(_('Tab'), workspaceDAO)]
 
-    data_ret['tabs'] = [get_tab_data(tab, workspace=workspaceDAO, cache_manager=cache_manager, user=user) for tab in tabs]
-    data_ret['wiring'] = deepcopy(workspaceDAO.wiringStatus)
-    for operator_id, operator in data_ret['wiring'].get('operators', {}).items():
+def _get_workspace_tabs(workspaceDAO, user, versions, cache_manager):
+
+    def compute_tab_ids():
+        # Check if the workspace's tabs have order
+        tab_ids = list(workspaceDAO.tab_set.order_by('position').values_list('id', flat=True))
+        if len(tab_ids) == 0:
+            tab_ids = [createTab(_('Tab'), workspaceDAO).id]
+            versions['tabs'] = workspaceDAO.get_cache_version('tabs')
+        return tab_ids
+
+    tab_ids = get_or_set_single_flight(_workspace_tabs_cache_key(workspaceDAO, versions), compute_tab_ids)
+
+    # Tab fragments
+    def compute_tabs(missing_tabs):
+        iwidget_ids = {tab_id: [] for tab_id in missing_tabs}
+        for tab_id, iwidget_id in IWidget.objects.filter(tab__in=missing_tabs).order_by('id').values_list('tab_id', 'id'):
+            iwidget_ids[tab_id].append(iwidget_id)
+
+        new_tabs = {}
+        for tab in Tab.objects.filter(id__in=missing_tabs).prefetch_related('tabpreference_set'):
+            tab_data = get_tab_data(tab, workspace=workspaceDAO, user=user, iwidgets=())
+            tab_data['iwidgets'] = iwidget_ids[tab.id]
+            new_tabs[tab.id] = tab_data
+
+        return new_tabs
+
+    tab_versions = get_cache_versions([Tab.build_cache_version_key(tab_id) for tab_id in tab_ids])
+    tab_keys = {tab_id: _tab_cache_key(tab_id, tab_versions[Tab.build_cache_version_key(tab_id)]) for tab_id in tab_ids}
+    tabs = get_many_or_set_single_flight(tab_keys, compute_tabs)
+    tabs = [tabs[tab_id] for tab_id in tab_ids if tab_id in tabs]
+
+    # IWidget fragments
+    def compute_iwidgets(missing_iwidgets):
+        iwidget_list = list(IWidget.objects.filter(tab__workspace=workspaceDAO, id__in=missing_iwidgets).select_related('widget__resource'))
+
+        # Check the availability of all the used components using a single query
+        available_resources = CatalogueResource.objects.get_available_ids(workspaceDAO.creator, [iwidget.widget.resource_id for iwidget in iwidget_list if iwidget.widget is not None])
+
+        return {iwidget.id: get_iwidget_data(iwidget, workspaceDAO, cache_manager, user, available_resources=available_resources) for iwidget in iwidget_list}
+
+    iwidget_ids = [iwidget_id for tab in tabs for iwidget_id in tab['iwidgets']]
+    iwidget_versions = get_cache_versions([IWidget.build_cache_version_key(iwidget_id) for iwidget_id in iwidget_ids])
+    iwidget_keys = {iwidget_id: _iwidget_cache_key(iwidget_id, iwidget_versions[IWidget.build_cache_version_key(iwidget_id)], versions, user) for iwidget_id in iwidget_ids}
+    iwidgets = get_many_or_set_single_flight(iwidget_keys, compute_iwidgets)
+
+    for tab in tabs:
+        tab['iwidgets'] = [iwidgets[iwidget_id] for iwidget_id in tab['iwidgets'] if iwidget_id in iwidgets]
+
+    return tabs
+
+
+def _get_workspace_wiring(workspaceDAO, user, cache_manager):
+
+    forced_values = cache_manager.get_forced_values()
+    wiring = deepcopy(workspaceDAO.wiringStatus)
+
+    # Check the availability of all the used operators using a single query
+    operator_resources = get_operator_resources(wiring)
+    available_resources = CatalogueResource.objects.get_available_ids(workspaceDAO.creator, [resource.pk for resource in operator_resources.values()])
+
+    for operator_id, operator in wiring.get('operators', {}).items():
         try:
             (vendor, name, version) = operator['name'].split('/')
         except ValueError:
             continue
 
-        try:
-            resource = CatalogueResource.objects.get(vendor=vendor, short_name=name, version=version)
-            operator_info = resource.get_processed_info(process_variables=True)
-            # Check if the resource is available, if not, variables should not be retrieved
-            if not resource.is_available_for(workspaceDAO.creator):
-                raise CatalogueResource.DoesNotExist
-        except CatalogueResource.DoesNotExist:
+        resource = operator_resources.get(operator['name'])
+
+        # Check if the resource is available, if not, variables should not be retrieved
+        if resource is None or resource.pk not in available_resources:
             operator["preferences"] = {}
             operator["properties"] = {}
             continue
 
+        operator_info = resource.get_processed_info(process_variables=True)
+
         operator_forced_values = forced_values['ioperator'].get(operator_id, {})
         # Build operator preference data
         for preference_name, preference in operator.get('preferences', {}).items():
@@ -481,21 +602,58 @@ def _get_global_workspace_data(workspaceDAO, user):
             if vardef is not None and vardef["secure"]:
                 property['value'] = "" if property.get('value') is None or decrypt_value(property.get('value')) == "" else "********"
 
+    return wiring
+
+
+def _get_global_workspace_data(workspaceDAO, user, versions):
+    """
+    Builds the global workspace data from cached fragments. Metadata, tabs,
+    iwidgets and wiring are cached independently (see
+    Workspace.CACHE_SECTIONS), so updating a component only requires
+    serializing the affected fragments again.
+    """
+
+    cache_manager = VariableValueCacheManager(workspaceDAO, user)
+
+    key = _workspace_cache_key(workspaceDAO, versions, user)
+    data_ret = get_or_set_single_flight(key, lambda: _get_workspace_metadata(workspaceDAO, user, cache_manager))
+
+    if len(data_ret['empty_params']) == 0:
+        data_ret['tabs'] = _get_workspace_tabs(workspaceDAO, user, versions, cache_manager)
+
+        key = _workspace_wiring_cache_key(workspaceDAO, versions, user)
+        data_ret['wiring'] = get_or_set_single_flight(key, lambda: _get_workspace_wiring(workspaceDAO, user, cache_manager))
+
+    # The modification date is updated on every change, so it is not part
+    # of the cached fragments
+    data_ret['lastmodified'] = workspaceDAO.last_modified
+
     return json.dumps(data_ret, cls=LazyEncoder)
 
 
 def get_global_workspace_data(workspace, user):
-    key = _workspace_cache_key(workspace, user)
-    data = cache.get(key)
-    if data is None:
-        data = CacheableData(_get_global_workspace_data(workspace, user), timestamp=workspace.last_modified)
-        key = _workspace_cache_key(workspace, user)
-        cache.set(key, data)
 
-    return data
+    versions = workspace.get_cache_versions()
+    # The iwidget and wiring fragments depend on the components available
+    # for the creator of the workspace
+    versions['availability'] = CatalogueResource.objects.get_availability_version(workspace.creator_id)
+
+    def compute():
+        # Workspaces that have never been modified use their creation date
+        timestamp = workspace.last_modified if workspace.last_modified is not None else workspace.creation_date
+        return (_get_global_workspace_data(workspace, user, versions), timestamp)
 
+    # Changes on tabs and iwidgets only update the modification date of the
+    # workspace, so it is also part of the key. Concurrent requests use the
+    # previous version of the whole document (with its own timestamp) while
+    # it is being assembled
+    key = _workspace_document_cache_key(workspace, versions, user)
+    stale_key = '_workspace_document/%s/%s' % (workspace.id, user.id)
+    data, timestamp = get_or_set_single_flight(key, compute, stale_key=stale_key, stale_timeout=WORKSPACE_STALE_DATA_TIMEOUT)
+    return CacheableData(data, timestamp=timestamp)
 
-def get_tab_data(tab, workspace=None, cache_manager=None, user=None):
+
+def get_tab_data(tab, workspace=None, cache_manager=None, user=None, iwidgets=None, available_resources=None):
 
     if workspace is None:
         workspace = tab.workspace
@@ -503,17 +661,24 @@ def get_tab_data(tab, workspace=None, cache_manager=None, user=None):
     if cache_manager is None:
         cache_manager = VariableValueCacheManager(workspace, user)
 
+    if iwidgets is None:
+        iwidgets = tab.iwidget_set.select_related('widget__resource').order_by('id')
+
+    iwidgets = list(iwidgets)
+    if available_resources is None:
+        available_resources = CatalogueResource.objects.get_available_ids(workspace.creator, [iwidget.widget.resource_id for iwidget in iwidgets if iwidget.widget is not None])
+
     return {
         'id': str(tab.id),
         'name': tab.name,
         'title': tab.title,
         'visible': tab.visible,
         'preferences': get_tab_preference_values(tab),
-        'iwidgets': [get_iwidget_data(widget, workspace, cache_manager, user) for widget in tab.iwidget_set.order_by('id')]
+        'iwidgets': [get_iwidget_data(widget, workspace, cache_manager, user, available_resources=available_resources) for widget in iwidgets]
     }
 
 
-def get_iwidget_data(iwidget, workspace, cache_manager=None, user=None):
+def get_iwidget_data(iwidget, workspace, cache_manager=None, user=None, available_resources=None):
 
     widget_position = iwidget.positions.get('widget', {})
     permissions = iwidget.permissions
@@ -523,7 +688,7 @@ def get_iwidget_data(iwidget, workspace, cache_manager=None, user=None):
     data_ret = {
         'id': str(iwidget.id),
         'title': iwidget.name,
-        'tab': iwidget.tab.id,
+        'tab': iwidget.tab_id,
         'layout': iwidget.layout,
         'widget': iwidget.widget_uri,
         'top': widget_position.get('top', 0),
@@ -545,13 +710,24 @@ def get_iwidget_data(iwidget, workspace, cache_manager=None, user=None):
         'titlevisible': widget_position.get('titlevisible', True),
     }
 
-    if iwidget.widget is None or not iwidget.widget.resource.is_available_for(workspace.creator):
+    if iwidget.widget is None:
         # The widget used by this iwidget is missing
         return data_ret
 
+    if available_resources is not None:
+        available = iwidget.widget.resource_id in available_resources
+    else:
+        available = iwidget.widget.resource.is_available_for(workspace.creator)
+
+    if not available:
+        return data_ret
+
     if cache_manager is None:
         cache_manager = VariableValueCacheManager(workspace, user)
 
+    # Retrieve the variable values using the already loaded iwidget
+    cache_manager.get_component_values("iwidget", iwidget.id, iwidget)
+
     iwidget_info = iwidget.widget.resource.get_processed_info()
     data_ret['preferences'] = {preference['name']: cache_manager.get_variable_data("iwidget", iwidget.id, preference['name']) for preference in iwidget_info['preferences']}
     data_ret['properties'] = {property['name']: cache_manager.get_variable_data("iwidget", iwidget.id, property['name']) for property in iwidget_info['properties']}
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+from email.utils import parsedate_to_datetime
+import hashlib
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import cc_delim_re
+
+
+DEFAULT_CACHE_OPTIONS = {
+    'ENABLED': False,
+    'CACHE': 'default',
+    'MAX_ENTRY_SIZE': 1024 * 1024,
+    'MAX_TIMEOUT': 24 * 3600,
+    'ALLOWED_DOMAINS': None,
+    'DENIED_DOMAINS': (),
+}
+
+CACHEABLE_STATUS_CODES = (200, 203, 300, 301, 308, 404, 410)
+
+# Headers that make a request user dependent
+PRIVATE_REQUEST_HEADERS = ('authorization', 'cookie')
+
+# Headers that should not be stored with the cached responses
+UNCACHEABLE_RESPONSE_HEADERS = ('set-cookie', 'age', 'via')
+
+# Headers of a 304 response that update the stored response
+REVALIDATION_HEADERS = ('cache-control', 'date', 'etag', 'expires', 'last-modified', 'vary')
+
+
+def parse_cache_control(value):
+
+    directives = {}
+    for directive in cc_delim_re.split(value or ''):
+        name, sep, directive_value = directive.partition('=')
+        name = name.strip().lower()
+        if name != '':
+            directives[name] = directive_value.strip().strip('"') if sep else True
+
+    return directives
+
+
+def parse_http_date(value):
+
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def get_freshness_lifetime(headers, now):
+    """
+    Returns the number of seconds a response is considered fresh, following
+    the rules defined in RFC 7234 section 4.2.1 for shared caches.
+    """
+
+    directives = parse_cache_control(headers.get('cache-control'))
+    if 'no-cache' in directives:
+        return 0
+
+    for directive in ('s-maxage', 'max-age'):
+        if directive in directives:
+            try:
+                return max(int(directives[directive]), 0)
+            except ValueError:
+                return 0
+
+    date = parse_http_date(headers.get('date')) or now
+    if 'expires' in headers:
+        expires = parse_http_date(headers['expires'])
+        return max(expires - date, 0) if expires is not None else 0
+
+    # Heuristic freshness: 10% of the time since the last modification
+    last_modified = parse_http_date(headers.get('last-modified'))
+    if last_modified is not None:
+        return max((date - last_modified) / 10, 0)
+
+    return 0
+
+
+class CacheEntry(object):
+
+    __slots__ = ('status', 'reason', 'headers', 'content', 'stored', 'freshness')
+
+    def __init__(self, status, reason, headers, content, stored, freshness):
+
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.stored = stored
+        self.freshness = freshness
+
+    def get_age(self, now):
+
+        try:
+            initial_age = int(self.headers.get('age', 0))
+        except ValueError:
+            initial_age = 0
+
+        return max(now - self.stored, 0) + initial_age
+
+    def is_fresh(self, now):
+
+        return self.get_age(now) < self.freshness
+
+    def has_validators(self):
+
+        return 'etag' in self.headers or 'last-modified' in self.headers
+
+    def to_tuple(self):
+
+        return (self.status, self.reason, self.headers, self.content, self.stored, self.freshness)
+
+
+class ProxyCache(object):
+    """
+    Shared cache for the responses to the GET requests made through the
+    WireCloud proxy. Only requests that are not user dependent (requests
+    without cookies, credentials or secure data) are served from this cache.
+    """
+
+    def __init__(self, enabled=False, cache='default', max_entry_size=1024 * 1024, max_timeout=24 * 3600, allowed_domains=None, denied_domains=()):
+
+        self.enabled = enabled
+        self.cache_alias = cache
+        self.max_entry_size = max_entry_size
+        self.max_timeout = max_timeout
+        self.allowed_domains = None if allowed_domains is None else set(domain.lower() for domain in allowed_domains)
+        self.denied_domains = set(domain.lower() for domain in denied_domains)
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'revalidated': 0,
+            'stored': 0,
+            'bypassed': 0,
+        }
+
+    @classmethod
+    def from_settings(cls):
+
+        options = dict(DEFAULT_CACHE_OPTIONS)
+        options.update(getattr(settings, 'WIRECLOUD_PROXY_CACHE', {}))
+
+        return cls(
+            enabled=options['ENABLED'],
+            cache=options['CACHE'],
+            max_entry_size=options['MAX_ENTRY_SIZE'],
+            max_timeout=options['MAX_TIMEOUT'],
+            allowed_domains=options['ALLOWED_DOMAINS'],
+            denied_domains=options['DENIED_DOMAINS'],
+        )
+
+    @property
+    def cache(self):
+
+        return caches[self.cache_alias]
+
+    def record(self, stat):
+
+        with self._lock:
+            self._stats[stat] += 1
+
+    def get_stats(self):
+
+        with self._lock:
+            stats = dict(self._stats)
+
+        lookups = stats['hits'] + stats['revalidated'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['revalidated']) / lookups if lookups > 0 else 0.0
+        return stats
+
+    def is_domain_allowed(self, url):
+
+        hostname = (urlparse(url).hostname or '').lower()
+
+        def matches(domains):
+            return any(hostname == domain or hostname.endswith('.' + domain) for domain in domains)
+
+        if matches(self.denied_domains):
+            return False
+
+        return self.allowed_domains is None or matches(self.allowed_domains)
+
+    def is_cacheable_request(self, request_data):
+
+        if not self.enabled or request_data['method'] != 'GET':
+            return False
+
+        # Requests that have been processed by processors injecting
+        # credentials (e.g. the secure data processor) are marked as private
+        if request_data.get('private', False) or request_data['data'] is not None:
+            self.record('bypassed')
+            return False
+
+        headers = {name.lower(): value for name, value in request_data['headers'].items()}
+        if any(header in headers for header in PRIVATE_REQUEST_HEADERS):
+            self.record('bypassed')
+            return False
+
+        if 'no-store' in parse_cache_control(headers.get('cache-control')) or not self.is_domain_allowed(request_data['url']):
+            self.record('bypassed')
+            return False
+
+        return True
+
+    def get_base_key(self, url):
+
+        return '_proxy_cache/' + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get_variant_key(self, base_key, vary, request_headers):
+
+        headers = {name.lower(): value for name, value in request_headers.items()}
+        variant = '\n'.join('%s:%s' % (header, headers.get(header, '')) for header in vary)
+        return base_key + '/' + hashlib.sha1(variant.encode('utf-8')).hexdigest()
+
+    def lookup(self, request_data):
+        """
+        Returns the cache key and the stored response (if any) associated with
+        the given request.
+        """
+
+        base_key = self.get_base_key(request_data['url'])
+        vary = self.cache.get(base_key)
+        if vary is None:
+            return None, None
+
+        key = self.get_variant_key(base_key, vary, request_data['headers'])
+        value = self.cache.get(key)
+        if value is None:
+            return key, None
+
+        return key, CacheEntry(*value)
+
+    def prepare_request(self, request_data):
+        """
+        Looks for a stored response for the given request. Returns a tuple
+        with the stored response (if any) and a boolean indicating if that
+        response is fresh. Requests for stale responses are updated for
+        revalidating them with the upstream server.
+        """
+
+        key, entry = self.lookup(request_data)
+        if entry is None:
+            self.record('misses')
+            return None, False
+
+        directives = parse_cache_control(request_data['headers'].get('cache-control'))
+        if 'no-cache' in directives or request_data['headers'].get('pragma') == 'no-cache':
+            entry.freshness = 0
+
+        if entry.is_fresh(time.time()):
+            self.record('hits')
+            return entry, True
+
+        # Don't mix our conditional headers with the ones sent by the client
+        conditional_headers = ('if-none-match', 'if-modified-since')
+        if not entry.has_validators() or any(header in request_data['headers'] for header in conditional_headers):
+            self.record('misses')
+            return None, False
+
+        if 'etag' in entry.headers:
+            request_data['headers']['if-none-match'] = entry.headers['etag']
+        if 'last-modified' in entry.headers:
+            request_data['headers']['if-modified-since'] = entry.headers['last-modified']
+
+        return entry, False
+
+    def revalidate(self, request_data, entry, headers):
+        """
+        Updates a stored response using the headers of a 304 Not Modified
+        response.
+        """
+
+        now = time.time()
+        for header in REVALIDATION_HEADERS:
+            if header in headers:
+                entry.headers[header] = headers[header]
+        entry.headers.pop('age', None)
+        entry.stored = now
+        entry.freshness = get_freshness_lifetime(entry.headers, now)
+
+        self.store(request_data, entry)
+        self.record('revalidated')
+
+    def get_cacheable_entry(self, status, reason, headers, now):
+        """
+        Returns a new empty entry if the response can be stored, ``None``
+        otherwise.
+        """
+
+        headers = {name.lower(): value for name, value in headers.items()}
+        directives = parse_cache_control(headers.get('cache-control'))
+        if status not in CACHEABLE_STATUS_CODES or 'no-store' in directives or 'private' in directives or 'set-cookie' in headers:
+            return None
+
+        if headers.get('vary', '').strip() == '*':
+            return None
+
+        try:
+            if int(headers.get('content-length', 0)) > self.max_entry_size:
+                return None
+        except ValueError:
+            return None
+
+        for header in UNCACHEABLE_RESPONSE_HEADERS:
+            headers.pop(header, None)
+
+        freshness = get_freshness_lifetime(headers, now)
+        entry = CacheEntry(status, reason, headers, b'', now, freshness)
+        if freshness <= 0 and not entry.has_validators():
+            return None
+
+        return entry
+
+    def store(self, request_data, entry):
+
+        vary = sorted(set(header.strip().lower() for header in cc_delim_re.split(entry.headers.get('vary', '')) if header.strip() != ''))
+        timeout = self.max_timeout if entry.has_validators() else min(entry.freshness, self.max_timeout)
+
+        base_key = self.get_base_key(request_data['url'])
+        key = self.get_variant_key(base_key, vary, request_data['headers'])
+        self.cache.set_many({
+            base_key: vary,
+            key: entry.to_tuple(),
+        }, timeout)
+
+    def cache_stream(self, request_data, entry, stream):
+        """
+        Wraps the given upstream stream, storing the transferred body once the
+        upstream response has been completely forwarded.
+        """
+
+        content = []
+        size = 0
+        for chunk in stream:
+            if content is not None:
+                size += len(chunk)
+                if size <= self.max_entry_size:
+                    content.append(chunk)
+                else:
+                    content = None
+            yield chunk
+
+        if content is not None:
+            entry.content = b''.join(content)
+            self.store(request_data, entry)
+            self.record('stored')
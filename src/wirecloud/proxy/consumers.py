@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import namedtuple
+from io import BytesIO
+import ssl
+import sys
+import time
+
+import aiohttp
+from channels.db import database_sync_to_async
+from channels.generic.http import AsyncHttpConsumer
+from channels.http import AsgiRequest
+from django.conf import settings
+from django.utils.translation import ugettext as _
+
+from wirecloud.commons.utils.http import build_error_response
+from wirecloud.platform.plugins import get_request_proxy_processors, get_response_proxy_processors
+from wirecloud.proxy.metrics import get_current_request_metrics, NULL_REQUEST_METRICS
+from wirecloud.proxy.pool import DEFAULT_POOL_OPTIONS
+from wirecloud.proxy.upstream import CircuitOpenError
+from wirecloud.proxy.utils import ProxyError, ValidationError
+from wirecloud.proxy.views import fix_response_cookies, log_error, parse_proxy_request, parse_request_headers, WIRECLOUD_PROXY
+
+
+Cookie = namedtuple('Cookie', ('name', 'value', 'expires', 'path'))
+
+RETRIABLE_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+_client_session = None
+
+
+async def on_connection_create_start(session, context, params):
+
+    context.connect_start = time.perf_counter()
+
+
+async def on_connection_create_end(session, context, params):
+
+    # Record the time spent opening new connections on the connect phase
+    get_current_request_metrics().add_phase_time('connect', time.perf_counter() - context.connect_start)
+
+
+def get_client_session():
+    """
+    Returns the aiohttp client session used for sending the proxied requests.
+    Connections are pooled and kept alive using the options provided through
+    the WIRECLOUD_PROXY_POOL setting.
+    """
+    global _client_session
+
+    if _client_session is None or _client_session.closed or _client_session.loop.is_closed():
+        options = dict(DEFAULT_POOL_OPTIONS)
+        options.update(getattr(settings, 'WIRECLOUD_PROXY_POOL', {}))
+
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=options['MAX_CONNECTIONS_PER_HOST'],
+            keepalive_timeout=options['IDLE_TIMEOUT'],
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+
+        _client_session = aiohttp.ClientSession(
+            connector=connector,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            auto_decompress=False,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=60),
+            trace_configs=[trace_config],
+        )
+
+    return _client_session
+
+
+def get_ssl_option():
+
+    verify = getattr(settings, 'WIRECLOUD_HTTPS_VERIFY', True)
+    if verify is True:
+        return None
+    elif verify is False:
+        return False
+    else:
+        return ssl.create_default_context(cafile=verify)
+
+
+async def send_request(method, url, timeout, **kwargs):
+    """
+    Sends a request using the shared client session. Used by
+    UpstreamManager.arequest, which provides the timeouts to use as a
+    (connect timeout, read timeout) tuple.
+    """
+
+    connect_timeout, read_timeout = timeout
+    return await get_client_session().request(method, url, timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout), **kwargs)
+
+
+def parse_cookies(response):
+
+    return [Cookie(morsel.key, morsel.value, morsel['expires'] or None, morsel['path']) for morsel in response.cookies.values()]
+
+
+def get_response_headers(response):
+
+    headers = [(name.encode('latin1'), value.encode('latin1')) for name, value in response.items()]
+    for cookie in response.cookies.values():
+        headers.append((b'Set-Cookie', cookie.output(header='').strip().encode('latin1')))
+
+    return headers
+
+
+async def run_processor(processor, method_name, *args):
+    """
+    Calls a proxy processor from async code. Processors can provide native
+    coroutine versions of their methods (prefixed with "a", e.g.
+    aprocess_request), other processors are run in a worker thread.
+    """
+
+    async_method = getattr(processor, 'a' + method_name, None)
+    if async_method is not None and asyncio.iscoroutinefunction(async_method):
+        return await async_method(*args)
+
+    return await database_sync_to_async(getattr(processor, method_name))(*args)
+
+
+class ProxyConsumer(AsyncHttpConsumer):
+    """
+    Asynchronous implementation of the WireCloud proxy. Upstream responses are
+    streamed back to the client without blocking a worker thread. Request
+    bodies are not streamed: AsyncHttpConsumer buffers the whole body before
+    calling handle, and it is sent to the upstream server from memory.
+    """
+
+    # Whether the status and the headers of the response have been sent
+    response_started = False
+
+    async def send_headers(self, *args, **kwargs):
+
+        self.response_started = True
+        await super(ProxyConsumer, self).send_headers(*args, **kwargs)
+
+    async def handle(self, body):
+
+        request = AsgiRequest(self.scope, BytesIO(body))
+        request.user = self.scope['user']
+        request.session = self.scope['session']
+
+        kwargs = self.scope['url_route']['kwargs']
+        metrics = WIRECLOUD_PROXY.metrics.start(request.method.upper(), kwargs['domain'])
+        try:
+            await self.proxy_request(request, kwargs['protocol'], kwargs['domain'], kwargs['path'], metrics)
+        except Exception as e:
+            log_error(request, sys.exc_info())
+            if self.response_started:
+                # Errors reading the upstream body (e.g. a read timeout) can
+                # happen after sending the headers, so the response can only
+                # be ended (the body will be truncated)
+                await self.send_body(b'')
+            else:
+                msg = _("Error processing proxy request: %s") % e
+                await self.send_django_response(build_error_response(request, 500, msg), metrics)
+
+    async def send_django_response(self, response, metrics=NULL_REQUEST_METRICS):
+
+        metrics.wrap_response(response)
+        await self.send_response(response.status_code, response.content, headers=get_response_headers(response))
+
+    def prepare_request(self, request, protocol, domain, path):
+
+        url, context = parse_proxy_request(request, protocol, domain, path)
+
+        # Extract headers from META
+        parse_request_headers(request, context)
+
+        via_header = WIRECLOUD_PROXY.prepare_request(request, url, request.method.upper(), context)
+        return context, via_header
+
+    async def proxy_request(self, request, protocol, domain, path, metrics=NULL_REQUEST_METRICS):
+
+        try:
+            with metrics.phase('context'):
+                request_data, via_header = await database_sync_to_async(self.prepare_request)(request, protocol, domain, path)
+
+            # Pass proxy processors to the new request
+            with metrics.phase('request_processors'):
+                for processor in get_request_proxy_processors():
+                    await run_processor(processor, 'process_request', request_data)
+        except ProxyError as e:
+            return await self.send_django_response(e.response, metrics)
+        except ValidationError as e:
+            return await self.send_django_response(e.get_response(request), metrics)
+
+        WIRECLOUD_PROXY.finish_request(request_data)
+
+        data = request_data['data']
+        if data is not None:
+            data = data.read()
+            metrics.add_sent_bytes(len(data))
+
+        # Open the request, applying the policy of the upstream domain
+        try:
+            with metrics.phase('upstream'), metrics.activate():
+                upstream = await WIRECLOUD_PROXY.upstreams.arequest(send_request, request_data['method'], request_data['url'], RETRIABLE_EXCEPTIONS, headers=request_data['headers'], data=data, ssl=get_ssl_option())
+        except CircuitOpenError as e:
+            return await self.send_django_response(build_error_response(request, 503, _('Service Unavailable'), details=str(e), headers={'Retry-After': '%d' % max(e.retry_after, 1)}), metrics)
+        except asyncio.TimeoutError as e:
+            return await self.send_django_response(build_error_response(request, 504, _('Gateway Timeout'), details=str(e)), metrics)
+        except aiohttp.ClientSSLError as e:
+            return await self.send_django_response(build_error_response(request, 502, _('SSL Error'), details=str(e)), metrics)
+        except aiohttp.ClientError as e:
+            return await self.send_django_response(build_error_response(request, 504, _('Connection Error'), details=str(e)), metrics)
+
+        status = upstream.status
+        try:
+            # The body is streamed directly from the upstream response, response
+            # processors are only allowed to modify the status and the headers
+            response, via_header = WIRECLOUD_PROXY.build_response(via_header, upstream.status, upstream.reason, upstream.headers, parse_cookies(upstream), ())
+
+            # Pass proxy processors to the response
+            with metrics.phase('response_processors'):
+                for processor in get_response_proxy_processors():
+                    response = await run_processor(processor, 'process_response', request_data, response)
+
+            response['Via'] = via_header
+            fix_response_cookies(response, protocol, domain, path)
+            status = response.status_code
+
+            with metrics.phase('transfer'):
+                await self.send_headers(status=response.status_code, headers=get_response_headers(response))
+                async for chunk in upstream.content.iter_chunked(4096):
+                    metrics.add_received_bytes(len(chunk))
+                    await self.send_body(chunk, more_body=True)
+                await self.send_body(b'')
+        finally:
+            upstream.release()
+            metrics.finish(status)
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger('wirecloud.proxy.metrics')
+
+DEFAULT_METRICS_OPTIONS = {
+    'ENABLED': False,
+    'LOG': False,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    'MAX_DOMAINS': 100,
+    'HOOKS': (),
+    # Anonymous access is opt-in: behind a local reverse proxy every client
+    # would come from the loopback address
+    'ALLOWED_IPS': (),
+}
+
+# Phases of a proxied request:
+# - context: validation of the request (referer and workspace permissions)
+# - request_processors: execution of the request proxy processors
+# - connect: time spent opening new connections to the upstream server (DNS
+#   resolution, TCP and TLS handshakes). Not recorded when reusing a pooled
+#   connection
+# - upstream: time until the upstream response headers are received,
+#   excluding the connect phase (retries are included)
+# - response_processors: execution of the response proxy processors
+# - transfer: time spent forwarding the response body
+# - total: total time spent processing the request
+PHASES = ('context', 'request_processors', 'connect', 'upstream', 'response_processors', 'transfer', 'total')
+
+OTHER_DOMAINS_LABEL = '_other'
+
+
+class Histogram(object):
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self):
+
+        total = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            yield bucket, total
+
+
+class NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullRequestMetrics(object):
+    """
+    Recorder used when metrics are disabled. All the operations are no-ops.
+    """
+
+    NULL_PHASE = NullPhase()
+
+    def phase(self, name):
+        return self.NULL_PHASE
+
+    def add_phase_time(self, name, value):
+        pass
+
+    @contextmanager
+    def activate(self):
+        yield self
+
+    def add_sent_bytes(self, count):
+        pass
+
+    def add_received_bytes(self, count):
+        pass
+
+    def finish(self, status):
+        pass
+
+    def wrap_response(self, response):
+        return response
+
+
+NULL_REQUEST_METRICS = NullRequestMetrics()
+
+# Metrics of the proxied request being processed in the current context. Used
+# for recording the connect phase from the connection classes (see
+# wirecloud.proxy.pool) and the aiohttp trace hooks
+_current_request_metrics = ContextVar('wirecloud_proxy_request_metrics', default=NULL_REQUEST_METRICS)
+
+
+def get_current_request_metrics():
+
+    return _current_request_metrics.get()
+
+
+class Phase(object):
+
+    __slots__ = ('request_metrics', 'name', 'start')
+
+    def __init__(self, request_metrics, name):
+
+        self.request_metrics = request_metrics
+        self.name = name
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.request_metrics.add_phase_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class RequestMetrics(object):
+
+    def __init__(self, collector, method, domain):
+
+        self.collector = collector
+        self.method = method
+        self.domain = domain
+        self.phases = {}
+        self.sent_bytes = 0
+        self.received_bytes = 0
+        self.start = time.perf_counter()
+        self.finished = False
+
+    def phase(self, name):
+
+        return Phase(self, name)
+
+    def add_phase_time(self, name, value):
+
+        self.phases[name] = self.phases.get(name, 0) + value
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes these metrics the ones used for recording the connections
+        opened in the current context.
+        """
+
+        token = _current_request_metrics.set(self)
+        try:
+            yield self
+        finally:
+            _current_request_metrics.reset(token)
+
+    def add_sent_bytes(self, count):
+
+        self.sent_bytes += count
+
+    def add_received_bytes(self, count):
+
+        self.received_bytes += count
+
+    def finish(self, status):
+
+        if self.finished:
+            return
+
+        self.finished = True
+        self.phases['total'] = time.perf_counter() - self.start
+
+        # Connections are opened while waiting for the upstream response
+        if 'connect' in self.phases and 'upstream' in self.phases:
+            self.phases['upstream'] = max(self.phases['upstream'] - self.phases['connect'], 0)
+        self.collector.record(self, status)
+
+    def stream(self, content, status):
+
+        transfer = self.phase('transfer')
+        try:
+            with transfer:
+                for chunk in content:
+                    self.received_bytes += len(chunk)
+                    yield chunk
+        finally:
+            self.finish(status)
+
+    def wrap_response(self, response):
+        """
+        Finishes recording the metrics of a request. Streaming responses are
+        finished once their body has been completely forwarded.
+        """
+
+        if getattr(response, 'streaming', False) is True:
+            response.streaming_content = self.stream(response.streaming_content, response.status_code)
+        else:
+            self.received_bytes += len(response.content)
+            self.finish(response.status_code)
+
+        return response
+
+    def to_dict(self, status):
+
+        return {
+            'method': self.method,
+            'domain': self.domain,
+            'status': status,
+            'sent_bytes': self.sent_bytes,
+            'received_bytes': self.received_bytes,
+            'phases': {phase: round(value, 6) for phase, value in self.phases.items()},
+        }
+
+
+def escape_label_value(value):
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+
+    return '{' + ','.join('%s="%s"' % (name, escape_label_value(value)) for name, value in labels) + '}'
+
+
+class ProxyMetrics(object):
+    """
+    Per-process collector of metrics about the requests made through the
+    WireCloud proxy.
+    """
+
+    def __init__(self, enabled=False, log=False, buckets=DEFAULT_METRICS_OPTIONS['BUCKETS'], max_domains=100, hooks=(), allowed_ips=()):
+
+        self.enabled = enabled
+        self.log = log
+        self.buckets = tuple(sorted(buckets))
+        self.max_domains = max_domains
+        self.hooks = tuple(import_string(hook) if isinstance(hook, str) else hook for hook in hooks)
+        self.allowed_ips = allowed_ips
+
+        self._lock = threading.Lock()
+        self.clear()
+
+    @classmethod
+    def from_settings(cls):
+
+        options = dict(DEFAULT_METRICS_OPTIONS)
+        options.update(getattr(settings, 'WIRECLOUD_PROXY_METRICS', {}))
+
+        return cls(
+            enabled=options['ENABLED'],
+            log=options['LOG'],
+            buckets=options['BUCKETS'],
+            max_domains=options['MAX_DOMAINS'],
+            hooks=options['HOOKS'],
+            allowed_ips=options['ALLOWED_IPS'],
+        )
+
+    def clear(self):
+
+        with self._lock:
+            self._domains = set()
+            self._histograms = {}
+            self._requests = {}
+            self._sent_bytes = {}
+            self._received_bytes = {}
+
+    def start(self, method, domain):
+
+        if not self.enabled and not self.log and len(self.hooks) == 0:
+            return NULL_REQUEST_METRICS
+
+        return RequestMetrics(self, method, domain.lower())
+
+    def get_domain_label(self, domain):
+
+        if domain not in self._domains:
+            if len(self._domains) >= self.max_domains:
+                return OTHER_DOMAINS_LABEL
+            self._domains.add(domain)
+
+        return domain
+
+    def record(self, request_metrics, status):
+
+        if self.enabled:
+            with self._lock:
+                domain = self.get_domain_label(request_metrics.domain)
+
+                for phase, value in request_metrics.phases.items():
+                    histogram = self._histograms.get((domain, phase))
+                    if histogram is None:
+                        histogram = self._histograms[(domain, phase)] = Histogram(self.buckets)
+                    histogram.observe(value)
+
+                request_key = (domain, request_metrics.method, status)
+                self._requests[request_key] = self._requests.get(request_key, 0) + 1
+                self._sent_bytes[domain] = self._sent_bytes.get(domain, 0) + request_metrics.sent_bytes
+                self._received_bytes[domain] = self._received_bytes.get(domain, 0) + request_metrics.received_bytes
+
+        if self.log or len(self.hooks) > 0:
+            data = request_metrics.to_dict(status)
+
+            if self.log:
+                logger.info(json.dumps(data, sort_keys=True))
+
+            for hook in self.hooks:
+                try:
+                    hook(data)
+                except Exception:
+                    logger.exception('Error calling proxy metrics hook %r', hook)
+
+    def render_prometheus(self):
+        """
+        Returns the collected metrics using the Prometheus text exposition
+        format.
+        """
+
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: (item[0][0], PHASES.index(item[0][1]) if item[0][1] in PHASES else len(PHASES)))
+            histograms = [(key, list(histogram.get_cumulative_counts()), histogram.sum, histogram.count) for key, histogram in histograms]
+            requests = sorted(self._requests.items())
+            sent_bytes = sorted(self._sent_bytes.items())
+            received_bytes = sorted(self._received_bytes.items())
+
+        lines = [
+            '# HELP wirecloud_proxy_phase_seconds Time spent on each phase of the proxied requests.',
+            '# TYPE wirecloud_proxy_phase_seconds histogram',
+        ]
+        for (domain, phase), buckets, histogram_sum, histogram_count in histograms:
+            labels = (('domain', domain), ('phase', phase))
+            for bucket, count in buckets:
+                lines.append('wirecloud_proxy_phase_seconds_bucket%s %d' % (format_labels(labels + (('le', repr(float(bucket))),)), count))
+            lines.append('wirecloud_proxy_phase_seconds_bucket%s %d' % (format_labels(labels + (('le', '+Inf'),)), histogram_count))
+            lines.append('wirecloud_proxy_phase_seconds_sum%s %r' % (format_labels(labels), histogram_sum))
+            lines.append('wirecloud_proxy_phase_seconds_count%s %d' % (format_labels(labels), histogram_count))
+
+        lines.append('# HELP wirecloud_proxy_requests_total Number of proxied requests.')
+        lines.append('# TYPE wirecloud_proxy_requests_total counter')
+        for (domain, method, status), count in requests:
+            lines.append('wirecloud_proxy_requests_total%s %d' % (format_labels((('domain', domain), ('method', method), ('status', status))), count))
+
+        lines.append('# HELP wirecloud_proxy_sent_bytes_total Number of request body bytes sent to upstream servers.')
+        lines.append('# TYPE wirecloud_proxy_sent_bytes_total counter')
+        for domain, count in sent_bytes:
+            lines.append('wirecloud_proxy_sent_bytes_total%s %d' % (format_labels((('domain', domain),)), count))
+
+        lines.append('# HELP wirecloud_proxy_received_bytes_total Number of response body bytes forwarded to the clients.')
+        lines.append('# TYPE wirecloud_proxy_received_bytes_total counter')
+        for domain, count in received_bytes:
+            lines.append('wirecloud_proxy_received_bytes_total%s %d' % (format_labels((('domain', domain),)), count))
+
+        return '\n'.join(lines) + '\n'
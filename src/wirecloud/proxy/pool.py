@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from http.cookiejar import CookiePolicy
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from wirecloud.proxy.metrics import get_current_request_metrics
+
+
+DEFAULT_POOL_OPTIONS = {
+    'MAX_HOSTS': 100,
+    'MAX_CONNECTIONS_PER_HOST': 10,
+    'IDLE_TIMEOUT': 60,
+    'MAX_LIFETIME': 600,
+}
+
+
+class BlockAllCookiesPolicy(CookiePolicy):
+    """
+    Cookie policy rejecting all the cookies. Pooled sessions are shared by all
+    the users, so they must not store cookies between requests.
+    """
+
+    netscape = True
+    rfc2965 = hide_cookie2 = False
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+    def domain_return_ok(self, domain, request):
+        return False
+
+    def path_return_ok(self, path, request):
+        return False
+
+
+class TimedHTTPConnection(HTTPConnection):
+
+    def connect(self):
+        with get_current_request_metrics().phase('connect'):
+            super(TimedHTTPConnection, self).connect()
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+        with get_current_request_metrics().phase('connect'):
+            super(TimedHTTPSConnection, self).connect()
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter recording the time spent opening new connections on the
+    connect phase of the proxy metrics.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+class PooledSession(object):
+
+    def __init__(self, max_connections):
+
+        self.session = requests.Session()
+        self.session.cookies.set_policy(BlockAllCookiesPolicy())
+
+        adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.created = self.last_used = time.monotonic()
+
+    def is_expired(self, now, idle_timeout, max_lifetime):
+
+        return now - self.last_used > idle_timeout or now - self.created > max_lifetime
+
+    def close(self):
+
+        self.session.close()
+
+
+class SessionPool(object):
+    """
+    Per-process pool of requests sessions. Sessions are indexed by scheme and
+    host, so connections (and TLS sessions) to the same backend are kept alive
+    and reused between proxied requests.
+    """
+
+    def __init__(self, max_hosts=100, max_connections_per_host=10, idle_timeout=60, max_lifetime=600):
+
+        self.max_hosts = max_hosts
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evicted': 0,
+        }
+
+    @classmethod
+    def from_settings(cls):
+
+        options = dict(DEFAULT_POOL_OPTIONS)
+        options.update(getattr(settings, 'WIRECLOUD_PROXY_POOL', {}))
+
+        return cls(
+            max_hosts=options['MAX_HOSTS'],
+            max_connections_per_host=options['MAX_CONNECTIONS_PER_HOST'],
+            idle_timeout=options['IDLE_TIMEOUT'],
+            max_lifetime=options['MAX_LIFETIME'],
+        )
+
+    def get_session(self, url):
+
+        parsed_url = urlparse(url)
+        key = (parsed_url.scheme, parsed_url.netloc.lower())
+        now = time.monotonic()
+        discarded = []
+
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None and entry.is_expired(now, self.idle_timeout, self.max_lifetime):
+                discarded.append(self._sessions.pop(key))
+                self._stats['expired'] += 1
+                entry = None
+
+            if entry is None:
+                self._stats['misses'] += 1
+                entry = self._sessions[key] = PooledSession(self.max_connections_per_host)
+                while len(self._sessions) > self.max_hosts:
+                    discarded.append(self._sessions.popitem(last=False)[1])
+                    self._stats['evicted'] += 1
+            else:
+                self._stats['hits'] += 1
+                self._sessions.move_to_end(key)
+
+            entry.last_used = now
+
+        # Close discarded sessions outside the lock
+        for discarded_entry in discarded:
+            discarded_entry.close()
+
+        return entry.session
+
+    def request(self, method, url, **kwargs):
+
+        return self.get_session(url).request(method, url, **kwargs)
+
+    def get_stats(self):
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hosts'] = len(self._sessions)
+
+        return stats
+
+    def clear(self):
+
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for entry in sessions:
+            entry.close()
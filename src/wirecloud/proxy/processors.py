@@ -18,7 +18,6 @@
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
 import base64
-from io import BytesIO
 import re
 from urllib.parse import unquote
 
@@ -26,7 +25,7 @@ from django.utils.http import urlquote
 from django.utils.translation import ugettext as _
 
 from wirecloud.platform.workspace.utils import VariableValueCacheManager
-from wirecloud.proxy.utils import ValidationError
+from wirecloud.proxy.utils import replace_body_patterns, ValidationError
 
 
 WIRECLOUD_SECURE_DATA_HEADER = 'x-wirecloud-secure-data'
@@ -45,6 +44,32 @@ def get_variable_value_by_ref(ref, user, cache_manager, component_type, componen
         return None
 
 
+class VariableResolver(object):
+    """
+    Resolves the variable references used on a secure data header. Only the
+    referenced variables are retrieved and the variable cache manager is only
+    created if the header contains non-constant references.
+    """
+
+    def __init__(self, request, component_type, component_id):
+
+        self.request = request
+        self.component_type = component_type
+        self.component_id = component_id
+        self.cache_manager = None
+        self.values = {}
+
+    def resolve(self, ref):
+
+        if ref not in self.values:
+            if self.cache_manager is None and VAR_REF_RE.match(ref).group('constant') != 'c':
+                self.cache_manager = VariableValueCacheManager(self.request['workspace'], self.request['user'])
+
+            self.values[ref] = get_variable_value_by_ref(ref, self.request['user'], self.cache_manager, self.component_type, self.component_id)
+
+        return self.values[ref]
+
+
 def check_empty_params(**kargs):
     missing_params = []
 
@@ -72,7 +97,8 @@ def check_invalid_refs(**kargs):
 def process_secure_data(text, request, component_id, component_type):
 
     definitions = text.split('&')
-    cache_manager = VariableValueCacheManager(request['workspace'], request['user'])
+    resolver = VariableResolver(request, component_type, component_id)
+    body_replacements = {}
     for definition in definitions:
         params = definition.split(',')
         if len(params) == 1 and params[0].strip() == '':
@@ -90,7 +116,7 @@ def process_secure_data(text, request, component_id, component_type):
             substr = options.get('substr', '{' + var_ref + '}')
             check_empty_params(substr=substr, var_ref=var_ref)
 
-            value = get_variable_value_by_ref(var_ref, request['user'], cache_manager, component_type, component_id)
+            value = resolver.resolve(var_ref)
             check_invalid_refs(var_ref=value)
 
             encoding = options.get('encoding', 'none')
@@ -102,9 +128,9 @@ def process_secure_data(text, request, component_id, component_type):
             else:
                 value = value.encode('utf8')
 
-            new_body = request['data'].read().replace(substr, value)
-            request['headers']['content-length'] = "%s" % len(new_body)
-            request['data'] = BytesIO(new_body)
+            # Body replacements are applied at once after processing all the
+            # definitions
+            body_replacements.setdefault(substr, value)
 
         elif action == 'header':
             var_ref = options.get('var_ref', '')
@@ -112,7 +138,7 @@ def process_secure_data(text, request, component_id, component_type):
             header = options.get('header', '').lower()
             check_empty_params(substr=substr, var_ref=var_ref, header=header)
 
-            value = get_variable_value_by_ref(var_ref, request['user'], cache_manager, component_type, component_id)
+            value = resolver.resolve(var_ref)
             check_invalid_refs(var_ref=value)
 
             encoding = options.get('encoding', 'none')
@@ -129,8 +155,8 @@ def process_secure_data(text, request, component_id, component_type):
             password_ref = options.get('pass_ref', '')
             check_empty_params(user_ref=user_ref, password_ref=password_ref)
 
-            user_value = get_variable_value_by_ref(user_ref, request['user'], cache_manager, component_type, component_id)
-            password_value = get_variable_value_by_ref(password_ref, request['user'], cache_manager, component_type, component_id)
+            user_value = resolver.resolve(user_ref)
+            password_value = resolver.resolve(password_ref)
             check_invalid_refs(user_ref=user_value, password_ref=password_value)
 
             token = base64.b64encode((user_value + ':' + password_value).encode('utf8'))
@@ -138,6 +164,10 @@ def process_secure_data(text, request, component_id, component_type):
         else:
             raise ValidationError('Unsupported action: %s' % action)
 
+    if len(body_replacements) > 0 and request['data'] is not None:
+        request['data'], length = replace_body_patterns(request['data'], body_replacements)
+        request['headers']['content-length'] = "%s" % length
+
 
 class SecureDataProcessor(object):
 
@@ -147,3 +177,6 @@ class SecureDataProcessor(object):
             secure_data_value = request['headers'][WIRECLOUD_SECURE_DATA_HEADER]
             process_secure_data(secure_data_value, request, request['component_id'], request['component_type'])
             del request['headers'][WIRECLOUD_SECURE_DATA_HEADER]
+
+            # Requests including secure data are user dependent
+            request['private'] = True
@@ -17,20 +17,43 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+from http.client import HTTPMessage
 from importlib import import_module
+from io import BytesIO
 import json
 import requests
+import unittest
+from unittest.mock import Mock, patch
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.test import Client, override_settings, TestCase
+from django.http import HttpResponse
+from django.test import Client, override_settings, RequestFactory, TestCase
 from django.urls import reverse
 
 from wirecloud.commons.utils.testcases import DynamicWebServer, WirecloudTestCase
-from wirecloud.platform.models import IWidget
+from wirecloud.platform.models import IWidget, UserWorkspace, Workspace
 from wirecloud.platform.plugins import clear_cache
 from wirecloud.platform.workspace.utils import encrypt_value
+from wirecloud.proxy.cache import get_freshness_lifetime, ProxyCache
+from wirecloud.proxy.metrics import NULL_REQUEST_METRICS, ProxyMetrics
+from wirecloud.proxy.pool import SessionPool, TimedHTTPConnection
+from wirecloud.proxy.upstream import CircuitBreaker, CircuitOpenError, UpstreamManager
+from wirecloud.proxy.utils import ProxyError, replace_body_patterns
+from wirecloud.proxy.views import get_accessible_workspace
+
+try:  # pragma: no cover
+    import aiohttp  # noqa
+    import channels  # noqa
+    from asgiref.sync import async_to_sync
+    ASYNC_PROXY_INSTALLED = True
+
+    # This module cannot be imported if the channels and aiohttp modules are not installed
+    from wirecloud.proxy.consumers import get_response_headers, get_ssl_option, ProxyConsumer, run_processor
+except ModuleNotFoundError:  # pragma: no cover
+    ASYNC_PROXY_INSTALLED = False
 
 
 # Avoid nose to repeat these tests (they are run through wirecloud/platform/tests/__init__.py)
@@ -260,6 +283,64 @@ class ProxyTests(ProxyTestsBase):
         self.assertEqual(response.status_code, 404)
         self.assertEqual(self.read_response(response), b'')
 
+    def get_accessible_workspace(self, user, owner, name):
+
+        request = Mock(COOKIES={settings.SESSION_COOKIE_NAME: 'session'}, user=user)
+        return get_accessible_workspace(request, owner, name)
+
+    def test_workspace_access_is_cached(self):
+
+        user = User.objects.get(username='test')
+        workspace = self.get_accessible_workspace(user, 'test', 'workspace')
+
+        with self.assertNumQueries(0):
+            cached_workspace = self.get_accessible_workspace(user, 'test', 'workspace')
+
+        self.assertEqual(cached_workspace.id, workspace.id)
+
+    def test_workspace_access_cache_removed_workspace(self):
+
+        request = RequestFactory().get('/', HTTP_ACCEPT='application/json')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'session'
+        request.user = User.objects.get(username='test')
+        get_accessible_workspace(request, 'test', 'workspace')
+        cached_workspace = get_accessible_workspace(request, 'test', 'workspace')
+
+        # The workspace is removed before using it
+        Workspace.objects.get(creator__username='test', name='workspace').delete()
+
+        with self.assertRaises(ProxyError) as cm:
+            cached_workspace.id
+        self.assertEqual(cm.exception.response.status_code, 403)
+
+    def test_workspace_access_denials_are_cached(self):
+
+        user = User.objects.get(username='test3')
+        self.assertRaises(Exception, self.get_accessible_workspace, user, 'test', 'workspace')
+
+        with self.assertNumQueries(0):
+            self.assertRaises(Exception, self.get_accessible_workspace, user, 'test', 'workspace')
+
+    def test_workspace_access_cache_is_invalidated(self):
+
+        user = User.objects.get(username='test2')
+        self.get_accessible_workspace(user, 'test', 'workspace')
+
+        UserWorkspace.objects.get(workspace__creator__username='test', workspace__name='workspace', user=user).delete()
+
+        self.assertRaises(Exception, self.get_accessible_workspace, user, 'test', 'workspace')
+
+    def test_workspace_access_cache_is_invalidated_on_public_change(self):
+
+        user = User.objects.get(username='test3')
+        self.assertRaises(Exception, self.get_accessible_workspace, user, 'test', 'workspace')
+
+        workspace = Workspace.objects.get(creator__username='test', name='workspace')
+        workspace.public = True
+        workspace.save()
+
+        self.get_accessible_workspace(user, 'test', 'workspace')
+
     def test_connection_error(self):
 
         self.client.login(username='test', password='test')
@@ -898,3 +979,647 @@ class ProxySecureDataTests(ProxyTestsBase):
                                     HTTP_WIRECLOUD_COMPONENT_ID="2")
 
         self.assertEqual(response.status_code, 422)
+
+
+class ProxyCacheTests(ProxyTestsBase):
+
+    tags = ('wirecloud-proxy', 'wirecloud-proxy-cache', 'wirecloud-noselenium')
+
+    def setUp(self):
+
+        super(ProxyCacheTests, self).setUp()
+
+        self.proxy_cache = ProxyCache(enabled=True, denied_domains=('private.example.com',))
+        patcher = patch('wirecloud.proxy.views.WIRECLOUD_PROXY.cache', self.proxy_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client.login(username='test', password='test')
+        self.upstream_requests = []
+
+    def add_response(self, headers, content='data', status_code=200):
+
+        def response(method, url, *args, **kwargs):
+            self.upstream_requests.append(kwargs['headers'])
+            if 'if-none-match' in kwargs['headers'] and kwargs['headers']['if-none-match'] == headers.get('ETag'):
+                return {'status_code': 304, 'headers': headers}
+
+            return {'status_code': status_code, 'headers': headers, 'content': content}
+
+        self.network._servers['http']['example.com'].add_response('GET', '/path', response)
+
+    def get(self, **kwargs):
+
+        response = self.client.get(self.basic_url, HTTP_HOST='localhost', HTTP_REFERER=self.basic_referer, **kwargs)
+        return response, self.read_response(response)
+
+    def test_fresh_responses_are_served_from_cache(self):
+
+        self.add_response({'Cache-Control': 'public, max-age=60', 'Content-Type': 'text/plain'})
+
+        response1, content1 = self.get()
+        response2, content2 = self.get()
+
+        self.assertEqual(len(self.upstream_requests), 1)
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual(content2, content1)
+        self.assertEqual(response2['Content-Type'], 'text/plain')
+        self.assertIn('Age', response2)
+        self.assertEqual(self.proxy_cache.get_stats()['hits'], 1)
+
+    def test_stale_responses_are_revalidated(self):
+
+        self.add_response({'Cache-Control': 'max-age=0', 'ETag': '"v1"'})
+
+        self.get()
+        response, content = self.get()
+
+        self.assertEqual(len(self.upstream_requests), 2)
+        self.assertEqual(self.upstream_requests[1]['if-none-match'], '"v1"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b'data')
+        self.assertEqual(self.proxy_cache.get_stats()['revalidated'], 1)
+
+    def test_client_conditional_requests_are_forwarded(self):
+
+        self.add_response({'Cache-Control': 'max-age=0', 'ETag': '"v1"'})
+
+        self.get()
+        response, content = self.get(HTTP_IF_NONE_MATCH='"v1"')
+
+        self.assertEqual(len(self.upstream_requests), 2)
+        self.assertEqual(response.status_code, 304)
+
+    def test_uncacheable_responses(self):
+
+        for headers in ({'Cache-Control': 'no-store, max-age=60'}, {'Cache-Control': 'private, max-age=60'}, {'Cache-Control': 'max-age=60', 'Vary': '*'}, {}):
+            self.upstream_requests = []
+            self.add_response(headers)
+
+            self.get()
+            self.get()
+
+            self.assertEqual(len(self.upstream_requests), 2)
+
+    def test_requests_with_cookies_bypass_the_cache(self):
+
+        self.add_response({'Cache-Control': 'max-age=60'})
+        self.client.cookies['upstream'] = 'value'
+
+        self.get()
+        self.get()
+
+        self.assertEqual(len(self.upstream_requests), 2)
+        self.assertEqual(self.proxy_cache.get_stats()['bypassed'], 2)
+
+    def test_requests_with_secure_data_bypass_the_cache(self):
+
+        self.add_response({'Cache-Control': 'max-age=60'})
+
+        for i in range(2):
+            response, content = self.get(HTTP_X_WIRECLOUD_SECURE_DATA='action=header, header=x-token, var_ref=c/token', HTTP_X_TOKEN='{c/token}')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(self.upstream_requests), 2)
+        self.assertEqual(self.upstream_requests[1]['x-token'], 'token')
+
+    def test_vary_header(self):
+
+        self.add_response({'Cache-Control': 'max-age=60', 'Vary': 'Accept'})
+
+        self.get(HTTP_ACCEPT='application/json')
+        self.get(HTTP_ACCEPT='application/xml')
+        self.get(HTTP_ACCEPT='application/json')
+
+        self.assertEqual(len(self.upstream_requests), 2)
+
+    def test_denied_domains(self):
+
+        self.assertTrue(self.proxy_cache.is_domain_allowed('http://example.com/path'))
+        self.assertFalse(self.proxy_cache.is_domain_allowed('http://private.example.com/path'))
+        self.assertFalse(self.proxy_cache.is_domain_allowed('http://api.private.example.com/path'))
+
+        self.proxy_cache.allowed_domains = {'example.org'}
+        self.assertFalse(self.proxy_cache.is_domain_allowed('http://example.com/path'))
+        self.assertTrue(self.proxy_cache.is_domain_allowed('http://tiles.example.org/path'))
+
+    def test_freshness_lifetime(self):
+
+        now = 1000000000
+        self.assertEqual(get_freshness_lifetime({'cache-control': 'max-age=60, s-maxage=120'}, now), 120)
+        self.assertEqual(get_freshness_lifetime({'cache-control': 'no-cache, max-age=60'}, now), 0)
+        self.assertEqual(get_freshness_lifetime({'date': 'Sun, 09 Sep 2001 01:46:40 GMT', 'expires': 'Sun, 09 Sep 2001 01:47:40 GMT'}, now), 60)
+        self.assertEqual(get_freshness_lifetime({'date': 'Sun, 09 Sep 2001 01:46:40 GMT', 'last-modified': 'Sun, 09 Sep 2001 01:30:00 GMT'}, now), 100)
+        self.assertEqual(get_freshness_lifetime({}, now), 0)
+
+
+class ProxyBodyReplacementTests(TestCase):
+
+    tags = ('wirecloud-proxy', 'wirecloud-proxy-secure-data', 'wirecloud-noselenium')
+
+    def replace(self, body, replacements, chunk_size=64 * 1024):
+
+        data, length = replace_body_patterns(BytesIO(body), replacements, chunk_size=chunk_size)
+        content = data.read()
+        self.assertEqual(len(content), length)
+        return content
+
+    def test_replace_body_patterns(self):
+
+        replacements = {b'|username|': b'user', b'|password|': b'secret'}
+        body = b'{"user": "|username|", "pass": "|password|", "again": "|username|"}'
+
+        self.assertEqual(self.replace(body, replacements), b'{"user": "user", "pass": "secret", "again": "user"}')
+
+    def test_replace_body_patterns_across_chunks(self):
+
+        replacements = {b'{token}': b'abcdef', b'{token}{token}': b'double'}
+        body = b'x' * 5 + b'{token}' + b'y' * 9 + b'{token}{token}' + b'{tok' + b'{token}'
+
+        for chunk_size in (1, 2, 3, 7, 11, 1024):
+            self.assertEqual(
+                self.replace(body, replacements, chunk_size=chunk_size),
+                b'x' * 5 + b'abcdef' + b'y' * 9 + b'double' + b'{tok' + b'abcdef'
+            )
+
+    def test_replace_body_patterns_single_pass(self):
+
+        # Replaced values are not processed again
+        replacements = {b'{a}': b'{b}', b'{b}': b'value'}
+
+        self.assertEqual(self.replace(b'{a} {b}', replacements), b'{b} value')
+
+    def test_replace_body_patterns_empty_body(self):
+
+        self.assertEqual(self.replace(b'', {b'{a}': b'value'}), b'')
+
+
+class ProxyUpstreamTests(ProxyTestsBase):
+
+    tags = ('wirecloud-proxy', 'wirecloud-proxy-upstreams', 'wirecloud-noselenium')
+
+    def setUp(self):
+
+        super(ProxyUpstreamTests, self).setUp()
+
+        self.sleep = Mock()
+        self.upstreams = UpstreamManager({'FAILURE_THRESHOLD': 2, 'RETRIES': 2}, {'example.org': {'READ_TIMEOUT': 5}}, sleep=self.sleep)
+        patcher = patch('wirecloud.proxy.views.WIRECLOUD_PROXY.upstreams', self.upstreams)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_domain_options(self):
+
+        self.assertEqual(self.upstreams.get_options('example.com')['READ_TIMEOUT'], 60)
+        self.assertEqual(self.upstreams.get_options('example.org')['READ_TIMEOUT'], 5)
+        self.assertEqual(self.upstreams.get_options('api.example.org')['READ_TIMEOUT'], 5)
+        self.assertEqual(self.upstreams.get_options('api.example.org')['RETRIES'], 2)
+
+    def test_idempotent_requests_are_retried(self):
+
+        send = Mock(side_effect=(requests.exceptions.ConnectionError(), requests.exceptions.ReadTimeout(), Mock(status_code=200)))
+
+        response = self.upstreams.request(send, 'GET', 'http://example.org/path')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.call_count, 3)
+        send.assert_called_with('GET', 'http://example.org/path', timeout=(60, 5))
+        self.assertEqual([call[0][0] for call in self.sleep.call_args_list], [0.5, 1.0])
+
+    def test_requests_with_body_are_not_retried(self):
+
+        send = Mock(side_effect=requests.exceptions.ConnectionError())
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.upstreams.request(send, 'POST', 'http://example.org/path', data=BytesIO(b'{}'))
+
+        self.assertEqual(send.call_count, 1)
+
+    def test_circuit_breaker(self):
+
+        breaker = CircuitBreaker('example.com', 2, 30)
+
+        breaker.before_request(0)
+        breaker.record_failure(0)
+        breaker.before_request(1)
+        breaker.record_failure(1)
+        self.assertEqual(breaker.get_status(10), {'state': 'open', 'failures': 2, 'retry_after': 21})
+        self.assertRaises(CircuitOpenError, breaker.before_request, 10)
+
+        # Only one trial request is allowed once the recovery timeout expires
+        breaker.before_request(31)
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertRaises(CircuitOpenError, breaker.before_request, 32)
+
+        breaker.record_success()
+        self.assertEqual(breaker.get_status(33), {'state': 'closed', 'failures': 0})
+
+        breaker.before_request(34)
+        breaker.record_failure(34)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_async_requests_apply_domain_policy(self):
+
+        responses = [ConnectionError(), Mock(status=503), Mock(status=503)]
+        calls = []
+
+        async def send(method, url, **kwargs):
+            calls.append(kwargs['timeout'])
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        sleep = asyncio.sleep
+        with patch('wirecloud.proxy.upstream.asyncio.sleep', new=Mock(side_effect=lambda delay: sleep(0))) as sleep_mock:
+            response = asyncio.run(self.upstreams.arequest(send, 'GET', 'http://example.org/path', (ConnectionError,)))
+            self.assertEqual(response.status, 503)
+            asyncio.run(self.upstreams.arequest(send, 'GET', 'http://example.org/path', (ConnectionError,)))
+
+        self.assertEqual(calls, [(60, 5)] * 3)
+        sleep_mock.assert_called_once_with(0.5)
+
+        # Two consecutive failures open the circuit
+        self.assertRaises(CircuitOpenError, asyncio.run, self.upstreams.arequest(send, 'GET', 'http://example.org/path', (ConnectionError,)))
+
+    def test_circuit_breakers_are_bounded(self):
+
+        upstreams = UpstreamManager({'FAILURE_THRESHOLD': 2}, {'example.org': {'FAILURE_THRESHOLD': 0}}, max_breakers=2)
+        send = Mock(return_value=Mock(status_code=200))
+
+        # Domains not using a circuit breaker are not tracked
+        upstreams.request(send, 'GET', 'http://example.org/path')
+        self.assertEqual(upstreams.get_status(), {})
+
+        for domain in ('a.example.com', 'b.example.com', 'a.example.com', 'c.example.com'):
+            upstreams.request(send, 'GET', 'http://%s/path' % domain)
+
+        self.assertEqual(set(upstreams.get_status()), {'a.example.com', 'c.example.com'})
+
+    def test_open_circuits_fail_fast(self):
+
+        self.client.login(username='test', password='test')
+
+        def unavailable(method, url, *args, **kwargs):
+            return {'status_code': 503}
+
+        self.network._servers['http']['example.com'].add_response('GET', '/path', unavailable)
+        for i in range(2):
+            response = self.client.get(self.basic_url, HTTP_HOST='localhost', HTTP_REFERER=self.basic_referer)
+            self.assertEqual(response.status_code, 503)
+            self.read_response(response)
+
+        with patch('wirecloud.proxy.views.WIRECLOUD_PROXY.session_pool') as session_pool_mock:
+            response = self.client.get(self.basic_url, HTTP_HOST='localhost', HTTP_REFERER=self.basic_referer)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertFalse(session_pool_mock.request.called)
+
+    def test_status_entry_requires_superuser(self):
+
+        url = reverse('wirecloud.proxy_status')
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 401)
+
+        self.client.login(username='test', password='test')
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_status_entry(self):
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.upstreams.get_breaker('example.com', self.upstreams.get_options('example.com')).record_failure(0)
+
+        response = self.client.get(reverse('wirecloud.proxy_status'), HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        status = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(status['upstreams'], {'example.com': {'state': 'closed', 'failures': 1}})
+        self.assertIn('hits', status['pool'])
+        self.assertIn('hit_rate', status['cache'])
+
+
+class ProxyMetricsTests(ProxyTestsBase):
+
+    tags = ('wirecloud-proxy', 'wirecloud-proxy-metrics', 'wirecloud-noselenium')
+
+    def setUp(self):
+
+        super(ProxyMetricsTests, self).setUp()
+
+        self.hook = Mock()
+        self.metrics = ProxyMetrics(enabled=True, log=True, buckets=(0.1, 1), max_domains=1, hooks=(self.hook,), allowed_ips=('127.0.0.1',))
+        patcher = patch('wirecloud.proxy.views.WIRECLOUD_PROXY.metrics', self.metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client.login(username='test', password='test')
+        self.network._servers['http']['example.com'].add_response('POST', '/path', {'content': 'response data'})
+
+    def test_metrics_entry_local_requests_require_superuser_by_default(self):
+
+        self.assertEqual(ProxyMetrics.from_settings().allowed_ips, ())
+
+        # Requests forwarded by a local reverse proxy come from the loopback address
+        with patch('wirecloud.proxy.views.WIRECLOUD_PROXY.metrics', ProxyMetrics(enabled=True)):
+            response = self.client.get(reverse('wirecloud.proxy_metrics'), REMOTE_ADDR='127.0.0.1')
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_disabled(self):
+
+        self.assertIs(ProxyMetrics().start('GET', 'example.com'), NULL_REQUEST_METRICS)
+
+    def test_proxy_requests_are_recorded(self):
+
+        with self.assertLogs('wirecloud.proxy.metrics', level='INFO') as logs:
+            response = self.client.post(self.basic_url, '{}', content_type='application/json', HTTP_HOST='localhost', HTTP_REFERER=self.basic_referer)
+            # Metrics are recorded once the body has been forwarded
+            self.assertEqual(self.hook.call_count, 0)
+            self.assertEqual(self.read_response(response), b'response data')
+
+        self.assertEqual(self.hook.call_count, 1)
+        data = self.hook.call_args[0][0]
+        self.assertEqual(data['domain'], 'example.com')
+        self.assertEqual(data['method'], 'POST')
+        self.assertEqual(data['status'], 200)
+        self.assertEqual(data['sent_bytes'], 2)
+        self.assertEqual(data['received_bytes'], 13)
+        self.assertEqual(set(data['phases']), {'context', 'request_processors', 'upstream', 'response_processors', 'transfer', 'total'})
+        self.assertEqual(json.loads(logs.records[0].getMessage()), data)
+
+        metrics = self.metrics.render_prometheus()
+        self.assertIn('wirecloud_proxy_phase_seconds_count{domain="example.com",phase="upstream"} 1\n', metrics)
+        self.assertIn('wirecloud_proxy_phase_seconds_bucket{domain="example.com",phase="total",le="+Inf"} 1\n', metrics)
+        self.assertIn('wirecloud_proxy_requests_total{domain="example.com",method="POST",status="200"} 1\n', metrics)
+        self.assertIn('wirecloud_proxy_sent_bytes_total{domain="example.com"} 2\n', metrics)
+        self.assertIn('wirecloud_proxy_received_bytes_total{domain="example.com"} 13\n', metrics)
+
+    def test_rejected_requests_are_recorded(self):
+
+        response = self.client.get(self.basic_url, HTTP_HOST='localhost')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.hook.call_args[0][0]['status'], 403)
+        self.assertEqual(set(self.hook.call_args[0][0]['phases']), {'context', 'total'})
+
+    def test_new_connections_are_recorded_on_the_connect_phase(self):
+
+        request_metrics = self.metrics.start('GET', 'example.com')
+        with patch('urllib3.connection.HTTPConnection.connect') as connect_mock:
+            with request_metrics.phase('upstream'), request_metrics.activate():
+                TimedHTTPConnection('example.com').connect()
+            # Connections opened outside a proxied request are not recorded
+            TimedHTTPConnection('example.com').connect()
+
+        self.assertEqual(connect_mock.call_count, 2)
+        request_metrics.add_phase_time('connect', 10)
+        request_metrics.finish(200)
+
+        data = self.hook.call_args[0][0]
+        self.assertGreaterEqual(data['phases']['connect'], 10)
+        # The connect phase is not accounted in the upstream phase
+        self.assertEqual(data['phases']['upstream'], 0)
+
+    def test_domain_labels_are_bounded(self):
+
+        for domain in ('example.com', 'example.org'):
+            self.metrics.start('GET', domain).finish(200)
+
+        metrics = self.metrics.render_prometheus()
+        self.assertIn('wirecloud_proxy_requests_total{domain="example.com",method="GET",status="200"} 1\n', metrics)
+        self.assertIn('wirecloud_proxy_requests_total{domain="_other",method="GET",status="200"} 1\n', metrics)
+
+    def test_metrics_entry(self):
+
+        url = reverse('wirecloud.proxy_metrics')
+
+        response = self.client.get(url, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'# TYPE wirecloud_proxy_phase_seconds histogram', response.content)
+
+
+class ProxySessionPoolTests(TestCase):
+
+    tags = ('wirecloud-proxy', 'wirecloud-proxy-pool', 'wirecloud-noselenium')
+
+    def test_sessions_are_reused_per_host(self):
+
+        pool = SessionPool()
+
+        session1 = pool.get_session('https://example.com/path1')
+        session2 = pool.get_session('https://EXAMPLE.com/path2?query')
+        session3 = pool.get_session('http://example.com/path1')
+        session4 = pool.get_session('https://example.com:8443/path1')
+
+        self.assertIs(session1, session2)
+        self.assertIsNot(session1, session3)
+        self.assertIsNot(session1, session4)
+        self.assertEqual(pool.get_stats(), {'hits': 1, 'misses': 3, 'expired': 0, 'evicted': 0, 'hosts': 3})
+
+    def test_least_recently_used_hosts_are_evicted(self):
+
+        pool = SessionPool(max_hosts=2)
+
+        session1 = pool.get_session('https://example.com/')
+        pool.get_session('https://example.org/')
+        pool.get_session('https://example.com/')
+        pool.get_session('https://example.net/')
+
+        self.assertIs(pool.get_session('https://example.com/'), session1)
+        self.assertEqual(pool.get_stats()['evicted'], 1)
+        self.assertEqual(pool.get_stats()['hosts'], 2)
+
+    @patch('wirecloud.proxy.pool.time')
+    def test_idle_sessions_are_discarded(self, time_mock):
+
+        pool = SessionPool(idle_timeout=60, max_lifetime=600)
+
+        time_mock.monotonic.return_value = 0
+        session1 = pool.get_session('https://example.com/')
+        time_mock.monotonic.return_value = 50
+        self.assertIs(pool.get_session('https://example.com/'), session1)
+        time_mock.monotonic.return_value = 111
+        self.assertIsNot(pool.get_session('https://example.com/'), session1)
+        self.assertEqual(pool.get_stats()['expired'], 1)
+
+    @patch('wirecloud.proxy.pool.time')
+    def test_sessions_are_recycled_after_max_lifetime(self, time_mock):
+
+        pool = SessionPool(idle_timeout=60, max_lifetime=100)
+
+        time_mock.monotonic.return_value = 0
+        session1 = pool.get_session('https://example.com/')
+        for timestamp in (50, 100):
+            time_mock.monotonic.return_value = timestamp
+            self.assertIs(pool.get_session('https://example.com/'), session1)
+
+        time_mock.monotonic.return_value = 150
+        self.assertIsNot(pool.get_session('https://example.com/'), session1)
+
+    @override_settings(WIRECLOUD_PROXY_POOL={'MAX_HOSTS': 5, 'IDLE_TIMEOUT': 10})
+    def test_pool_options_from_settings(self):
+
+        pool = SessionPool.from_settings()
+
+        self.assertEqual(pool.max_hosts, 5)
+        self.assertEqual(pool.max_connections_per_host, 10)
+        self.assertEqual(pool.idle_timeout, 10)
+        self.assertEqual(pool.max_lifetime, 600)
+
+    def test_pooled_sessions_do_not_store_cookies(self):
+
+        pool = SessionPool()
+        session = pool.get_session('https://example.com/')
+
+        headers = HTTPMessage()
+        headers['Set-Cookie'] = 'name=value'
+        request = requests.Request('GET', 'https://example.com/').prepare()
+        session.cookies.extract_cookies(requests.cookies.MockResponse(headers), requests.cookies.MockRequest(request))
+
+        self.assertEqual(len(session.cookies), 0)
+
+
+@unittest.skipIf(not ASYNC_PROXY_INSTALLED, 'django channels and aiohttp packages not installed')
+class ProxyConsumerTests(TestCase):
+
+    tags = ('wirecloud-proxy', 'wirecloud-proxy-async', 'wirecloud-noselenium')
+
+    def test_run_processor_sync_methods(self):
+
+        processor = Mock(spec=('process_request',))
+        processor.process_request.return_value = None
+
+        async_to_sync(run_processor)(processor, 'process_request', {})
+
+        processor.process_request.assert_called_once_with({})
+
+    def test_run_processor_async_methods(self):
+
+        calls = []
+
+        class AsyncProcessor(object):
+
+            def process_response(self, request, response):
+                raise AssertionError('sync method should not be called')
+
+            async def aprocess_response(self, request, response):
+                calls.append((request, response))
+                return response
+
+        self.assertEqual(async_to_sync(run_processor)(AsyncProcessor(), 'process_response', {}, 'response'), 'response')
+        self.assertEqual(calls, [({}, 'response')])
+
+    def test_get_ssl_option(self):
+
+        with override_settings(WIRECLOUD_HTTPS_VERIFY=True):
+            self.assertIsNone(get_ssl_option())
+
+        with override_settings(WIRECLOUD_HTTPS_VERIFY=False):
+            self.assertIs(get_ssl_option(), False)
+
+    def test_get_response_headers(self):
+
+        response = HttpResponse('content', content_type='text/plain')
+        response.set_cookie('name', 'value', path='/cdp/http/example.com/')
+
+        headers = get_response_headers(response)
+
+        self.assertIn((b'Content-Type', b'text/plain'), headers)
+        self.assertIn((b'Set-Cookie', b'name=value; Path=/cdp/http/example.com/'), headers)
+
+    def test_invalid_protocol(self):
+
+        responses = []
+
+        async def send_django_response(response, metrics=None):
+            responses.append(response)
+
+        consumer = ProxyConsumer({'type': 'http'})
+        consumer.send_django_response = send_django_response
+
+        request = Mock(method='GET')
+        async_to_sync(consumer.proxy_request)(request, 'ftp', 'example.com', '/path')
+
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(responses[0].status_code, 422)
+
+    def test_upstream_errors_after_sending_headers(self):
+
+        messages = []
+
+        async def base_send(message):
+            messages.append(message)
+
+        consumer = ProxyConsumer({
+            'type': 'http',
+            'user': Mock(),
+            'session': Mock(),
+            'url_route': {'kwargs': {'protocol': 'http', 'domain': 'example.com', 'path': '/path'}},
+        })
+        consumer.base_send = base_send
+
+        async def proxy_request(request, protocol, domain, path, metrics):
+            await consumer.send_headers(status=200, headers=[])
+            await consumer.send_body(b'partial', more_body=True)
+            raise aiohttp.ClientPayloadError('Response payload is not completed')
+
+        consumer.proxy_request = proxy_request
+        with patch('wirecloud.proxy.consumers.AsgiRequest', return_value=Mock(method='GET')), patch('wirecloud.proxy.consumers.log_error') as log_error_mock:
+            async_to_sync(consumer.handle)(b'')
+
+        # The response is ended instead of starting a new one
+        self.assertEqual([message['type'] for message in messages], ['http.response.start', 'http.response.body', 'http.response.body'])
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(messages[2], {'type': 'http.response.body', 'body': b'', 'more_body': False})
+        log_error_mock.assert_called_once()
+
+    def test_upstream_errors_before_sending_headers(self):
+
+        messages = []
+
+        async def base_send(message):
+            messages.append(message)
+
+        consumer = ProxyConsumer({
+            'type': 'http',
+            'user': Mock(),
+            'session': Mock(),
+            'url_route': {'kwargs': {'protocol': 'http', 'domain': 'example.com', 'path': '/path'}},
+        })
+        consumer.base_send = base_send
+
+        async def proxy_request(request, protocol, domain, path, metrics):
+            raise Exception('error')
+
+        consumer.proxy_request = proxy_request
+        request = RequestFactory().get('/cdp/http/example.com/path', HTTP_ACCEPT='application/json')
+        with patch('wirecloud.proxy.consumers.AsgiRequest', return_value=request), patch('wirecloud.proxy.consumers.log_error'):
+            async_to_sync(consumer.handle)(b'')
+
+        self.assertEqual(messages[0]['type'], 'http.response.start')
+        self.assertEqual(messages[0]['status'], 500)
+
+    def test_rejected_requests_are_recorded(self):
+
+        responses = []
+
+        async def send_response(status, body, headers=None):
+            responses.append(status)
+
+        consumer = ProxyConsumer({'type': 'http'})
+        consumer.send_response = send_response
+        metrics = ProxyMetrics(enabled=True)
+
+        request = Mock(method='GET')
+        async_to_sync(consumer.proxy_request)(request, 'ftp', 'example.com', '/path', metrics.start('GET', 'example.com'))
+
+        self.assertEqual(responses, [422])
+        self.assertIn('wirecloud_proxy_requests_total{domain="example.com",method="GET",status="422"} 1', metrics.render_prometheus())
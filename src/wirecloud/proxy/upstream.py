@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Future Internet Consulting and Development Solutions S.L.
+
+# This file is part of Wirecloud.
+
+# Wirecloud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Wirecloud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import OrderedDict
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+import requests
+
+
+DEFAULT_UPSTREAM_OPTIONS = {
+    'CONNECT_TIMEOUT': 60,
+    'READ_TIMEOUT': 60,
+    'RETRIES': 0,
+    'BACKOFF_FACTOR': 0.5,
+    'FAILURE_THRESHOLD': 0,
+    'RECOVERY_TIMEOUT': 30,
+}
+
+IDEMPOTENT_METHODS = ('DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT', 'TRACE')
+
+# Upstream responses considered as a backend failure by the circuit breakers
+FAILURE_STATUS_CODES = (502, 503, 504)
+
+RETRIABLE_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+DEFAULT_MAX_BREAKERS = 1000
+
+
+class CircuitOpenError(Exception):
+
+    def __init__(self, domain, retry_after):
+        self.domain = domain
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return 'Circuit breaker for %s is open' % self.domain
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker tracking the health of an upstream domain. The circuit is
+    opened after ``failure_threshold`` consecutive failures, rejecting
+    requests until ``recovery_timeout`` seconds have passed. After that, a
+    single trial request is allowed (half-open state), closing the circuit if
+    it succeeds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, domain, failure_threshold, recovery_timeout):
+
+        self.domain = domain
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.failure_threshold > 0
+
+    def before_request(self, now):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = now - self.opened_at
+                if elapsed < self.recovery_timeout:
+                    raise CircuitOpenError(self.domain, self.recovery_timeout - elapsed)
+
+                self.state = self.HALF_OPEN
+
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_progress:
+                    raise CircuitOpenError(self.domain, self.recovery_timeout)
+
+                self.trial_in_progress = True
+
+    def record_success(self):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def cancel_trial(self):
+
+        with self._lock:
+            self.trial_in_progress = False
+
+    def record_failure(self, now):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.failures += 1
+            self.trial_in_progress = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = now
+
+    def get_status(self, now):
+
+        with self._lock:
+            status = {
+                'state': self.state,
+                'failures': self.failures,
+            }
+
+            if self.state == self.OPEN:
+                status['retry_after'] = max(self.recovery_timeout - (now - self.opened_at), 0)
+
+        return status
+
+
+# Shared by all the domains not using a circuit breaker
+DISABLED_BREAKER = CircuitBreaker(None, 0, 0)
+
+
+class UpstreamManager(object):
+    """
+    Applies the per-domain request policies (timeouts, retries and circuit
+    breakers) to the requests sent by the WireCloud proxy.
+    """
+
+    def __init__(self, default_options=None, domain_options=None, max_breakers=DEFAULT_MAX_BREAKERS, sleep=time.sleep):
+
+        self.default_options = dict(DEFAULT_UPSTREAM_OPTIONS)
+        self.default_options.update(default_options or {})
+        self.domain_options = {domain.lower(): options for domain, options in (domain_options or {}).items()}
+        self.max_breakers = max_breakers
+        self.sleep = sleep
+
+        self._breakers = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+
+        options = getattr(settings, 'WIRECLOUD_PROXY_UPSTREAMS', {})
+        return cls(options.get('DEFAULT'), options.get('DOMAINS'), options.get('MAX_BREAKERS', DEFAULT_MAX_BREAKERS))
+
+    def get_options(self, domain):
+        """
+        Returns the options to use for a given domain. Options defined for a
+        domain also apply to its subdomains, the most specific definition
+        taking precedence.
+        """
+
+        options = dict(self.default_options)
+
+        parts = domain.split('.')
+        for i in range(len(parts) - 1, -1, -1):
+            options.update(self.domain_options.get('.'.join(parts[i:]), {}))
+
+        return options
+
+    def get_breaker(self, domain, options):
+
+        # Domains are controlled by the users, so breakers are only created
+        # when enabled and the number of tracked domains is limited
+        if options['FAILURE_THRESHOLD'] <= 0:
+            return DISABLED_BREAKER
+
+        with self._lock:
+            breaker = self._breakers.get(domain)
+            if breaker is None:
+                breaker = self._breakers[domain] = CircuitBreaker(domain, options['FAILURE_THRESHOLD'], options['RECOVERY_TIMEOUT'])
+                while len(self._breakers) > self.max_breakers:
+                    self._breakers.popitem(last=False)
+            else:
+                self._breakers.move_to_end(domain)
+
+        return breaker
+
+    def prepare_request(self, method, url, kwargs):
+
+        domain = (urlparse(url).hostname or '').lower()
+        options = self.get_options(domain)
+        breaker = self.get_breaker(domain, options)
+
+        # Requests with a body cannot be retried as the body is consumed by the
+        # first attempt
+        retries = options['RETRIES'] if method in IDEMPOTENT_METHODS and kwargs.get('data') is None else 0
+        kwargs['timeout'] = (options['CONNECT_TIMEOUT'], options['READ_TIMEOUT'])
+
+        # Retries are part of the same request, so they are not taken into
+        # account individually by the circuit breaker
+        breaker.before_request(time.monotonic())
+
+        return options, breaker, retries
+
+    def request(self, send, method, url, **kwargs):
+        """
+        Sends a request using the ``send`` function, applying the policy of the
+        target domain. Raises ``CircuitOpenError`` if the circuit breaker of
+        the target domain is open.
+        """
+
+        options, breaker, retries = self.prepare_request(method, url, kwargs)
+
+        attempt = 0
+        while True:
+            try:
+                response = send(method, url, **kwargs)
+            except RETRIABLE_EXCEPTIONS:
+                if attempt >= retries:
+                    breaker.record_failure(time.monotonic())
+                    raise
+            except Exception:
+                # Not related to the health of the upstream server
+                breaker.cancel_trial()
+                raise
+            else:
+                if response.status_code in FAILURE_STATUS_CODES:
+                    breaker.record_failure(time.monotonic())
+                else:
+                    breaker.record_success()
+                return response
+
+            self.sleep(options['BACKOFF_FACTOR'] * (2 ** attempt))
+            attempt += 1
+
+    async def arequest(self, send, method, url, retriable_exceptions, **kwargs):
+        """
+        Coroutine version of ``request`` used by the asynchronous proxy.
+        ``send`` must be a coroutine function returning an aiohttp response
+        and ``retriable_exceptions`` the exceptions raised by ``send`` on
+        connection errors and timeouts. The timeout is passed to ``send`` as
+        a (connect timeout, read timeout) tuple.
+        """
+
+        options, breaker, retries = self.prepare_request(method, url, kwargs)
+
+        attempt = 0
+        while True:
+            try:
+                response = await send(method, url, **kwargs)
+            except retriable_exceptions:
+                if attempt >= retries:
+                    breaker.record_failure(time.monotonic())
+                    raise
+            except Exception:
+                # Not related to the health of the upstream server
+                breaker.cancel_trial()
+                raise
+            else:
+                if response.status in FAILURE_STATUS_CODES:
+                    breaker.record_failure(time.monotonic())
+                else:
+                    breaker.record_success()
+                return response
+
+            await asyncio.sleep(options['BACKOFF_FACTOR'] * (2 ** attempt))
+            attempt += 1
+
+    def get_status(self):
+
+        now = time.monotonic()
+        with self._lock:
+            breakers = list(self._breakers.values())
+
+        return {breaker.domain: breaker.get_status(now) for breaker in breakers if breaker.enabled}
+
+    def clear(self):
+
+        with self._lock:
+            self._breakers.clear()
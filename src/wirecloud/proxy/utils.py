@@ -17,6 +17,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+
 from wirecloud.commons.utils.http import build_error_response
 
 
@@ -28,6 +33,12 @@ BLACKLISTED_HEADERS = {
 }
 
 
+class ProxyError(Exception):
+
+    def __init__(self, response):
+        self.response = response
+
+
 class ValidationError(Exception):
 
     def __init__(self, msg):
@@ -39,3 +50,48 @@ class ValidationError(Exception):
 
 def is_valid_response_header(header):
     return header not in BLACKLISTED_HEADERS
+
+
+def replace_body_patterns(data, replacements, chunk_size=64 * 1024):
+    """
+    Replaces all the occurrences of the given patterns on a request body in a
+    single pass. ``replacements`` is a dict mapping the patterns to their
+    values (both as bytes).
+
+    The body is read by chunks and the result is spooled into a temporary
+    file, keeping the memory usage bounded by the
+    ``FILE_UPLOAD_MAX_MEMORY_SIZE`` setting. Returns the new body and its
+    length.
+    """
+
+    patterns = sorted(replacements, key=len, reverse=True)
+    pattern_re = re.compile(b'|'.join(re.escape(pattern) for pattern in patterns))
+    # Number of bytes that must be kept between chunks for detecting patterns
+    # crossing chunk boundaries
+    overlap = len(patterns[0]) - 1
+
+    output = SpooledTemporaryFile(max_size=getattr(settings, 'FILE_UPLOAD_MAX_MEMORY_SIZE', 2621440))
+    length = 0
+    pending = b''
+    eof = False
+    while not eof:
+        chunk = data.read(chunk_size)
+        eof = len(chunk) == 0
+        buffer = pending + chunk
+        limit = len(buffer) if eof else len(buffer) - overlap
+
+        position = 0
+        for match in pattern_re.finditer(buffer):
+            if match.start() >= limit:
+                break
+
+            length += output.write(buffer[position:match.start()])
+            length += output.write(replacements[match.group()])
+            position = match.end()
+
+        boundary = max(position, limit)
+        length += output.write(buffer[position:boundary])
+        pending = buffer[boundary:]
+
+    output.seek(0)
+    return output, length
@@ -17,24 +17,35 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Wirecloud.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 from http.cookies import SimpleCookie
+import json
 import logging
 import re
 import requests
 import socket
 import sys
+import time
 from urllib.parse import unquote, urlparse
 
 from django.conf import settings
-from django.http import StreamingHttpResponse
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
 from django.urls import resolve, reverse
 from django.utils.encoding import iri_to_uri
+from django.utils.functional import SimpleLazyObject
 from django.utils.translation import ugettext as _
 
-from wirecloud.commons.utils.http import build_error_response, get_current_domain
+from wirecloud.commons.baseviews import Resource
+from wirecloud.commons.utils.cache import get_cache_version
+from wirecloud.commons.utils.http import authentication_required, build_error_response, get_current_domain
 from wirecloud.platform.models import Workspace
 from wirecloud.platform.plugins import get_request_proxy_processors, get_response_proxy_processors
-from wirecloud.proxy.utils import is_valid_response_header, ValidationError
+from wirecloud.proxy.cache import ProxyCache
+from wirecloud.proxy.metrics import NULL_REQUEST_METRICS, ProxyMetrics
+from wirecloud.proxy.pool import SessionPool
+from wirecloud.proxy.upstream import CircuitOpenError, UpstreamManager
+from wirecloud.proxy.utils import is_valid_response_header, ProxyError, ValidationError
 
 
 request_logger = logging.getLogger('django.request')
@@ -96,6 +107,49 @@ def parse_request_headers(request, request_data):
             request_data['headers'][fixed_name] = header[1]
 
 
+def get_accessible_workspace(request, owner, name):
+    """
+    Returns the workspace identified by owner and name, raising an exception if
+    it is not accessible by the user of the request.
+
+    Access decisions are cached per session and invalidated when the metadata
+    of the workspace changes, so in the common case this check doesn't
+    require any database query and the workspace is only retrieved if used.
+    """
+
+    session_id = request.COOKIES[settings.SESSION_COOKIE_NAME]
+    key_data = '\n'.join((session_id, str(request.user.pk), owner, name))
+    key = '_proxy_workspace_access/' + hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+    entry = cache.get(key)
+    if entry is not None:
+        workspace_id, version, accessible = entry
+        if version == get_cache_version(Workspace.build_cache_version_key(workspace_id, 'metadata')):
+            if not accessible:
+                raise Exception()
+
+            def get_workspace():
+                try:
+                    return Workspace.objects.get(pk=workspace_id)
+                except Workspace.DoesNotExist:
+                    # The workspace has been removed after checking the
+                    # cached access decision
+                    cache.delete(key)
+                    raise ProxyError(build_error_response(request, 403, _("Invalid request")))
+
+            return SimpleLazyObject(get_workspace)
+
+    workspace = Workspace.objects.get(creator__username=owner, name=name)
+    version = workspace.get_cache_version('metadata')
+    accessible = bool(workspace.is_accessible_by(request.user))
+    cache.set(key, (workspace.id, version, accessible), getattr(settings, 'WIRECLOUD_PROXY_ACCESS_CACHE_TIMEOUT', 60))
+
+    if not accessible:
+        raise Exception()
+
+    return workspace
+
+
 def parse_context_from_referer(request, request_method="GET"):
     parsed_referer = urlparse(request.META["HTTP_REFERER"])
     if request.get_host() != parsed_referer[1]:
@@ -104,9 +158,7 @@ def parse_context_from_referer(request, request_method="GET"):
     referer_view_info = resolve(parsed_referer.path)
     if referer_view_info.url_name == 'wirecloud.workspace_view':
 
-        workspace = Workspace.objects.get(creator__username=unquote(referer_view_info.kwargs['owner']), name=unquote(referer_view_info.kwargs['name']))
-        if not workspace.is_accessible_by(request.user):
-            raise Exception()
+        workspace = get_accessible_workspace(request, unquote(referer_view_info.kwargs['owner']), unquote(referer_view_info.kwargs['name']))
 
     elif referer_view_info.url_name == 'wirecloud.showcase_media' or referer_view_info.url_name == 'wirecloud|proxy':
 
@@ -140,7 +192,13 @@ class Proxy():
     # set the timeout to 60 seconds
     socket.setdefaulttimeout(60)
 
-    def do_request(self, request, url, method, request_data):
+    def __init__(self):
+        self.session_pool = SessionPool.from_settings()
+        self.cache = ProxyCache.from_settings()
+        self.upstreams = UpstreamManager.from_settings()
+        self.metrics = ProxyMetrics.from_settings()
+
+    def prepare_request(self, request, url, method, request_data):
 
         url = iri_to_uri(url)
 
@@ -155,9 +213,6 @@ class Proxy():
         request_data.setdefault("cookies", SimpleCookie())
         request_data.setdefault("user", request.user)
 
-        # Request creation
-        proto, host, cgi, param, query = urlparse(url)[:5]
-
         # Build the Via header
         protocolVersion = self.protocolRE.match(request.META['SERVER_PROTOCOL'])
         if protocolVersion is not None:
@@ -177,12 +232,9 @@ class Proxy():
         else:
             request_data['headers']['x-forwarded-for'] = request.META['REMOTE_ADDR']
 
-        # Pass proxy processors to the new request
-        try:
-            for processor in get_request_proxy_processors():
-                processor.process_request(request_data)
-        except ValidationError as e:
-            return e.get_response(request)
+        return via_header
+
+    def finish_request(self, request_data):
 
         # Cookies
         cookie_header_content = ', '.join([request_data['cookies'][key].OutputString() for key in request_data['cookies']])
@@ -197,53 +249,144 @@ class Proxy():
             if 'content-type' in request_data['headers']:
                 del request_data['headers']['content-type']
 
-        # Open the request
-        try:
-            res = requests.request(request_data['method'], request_data['url'], headers=request_data['headers'], data=request_data['data'], stream=True, verify=getattr(settings, 'WIRECLOUD_HTTPS_VERIFY', True))
-        except requests.exceptions.Timeout as e:
-            return build_error_response(request, 504, _('Gateway Timeout'), details=str(e))
-        except requests.exceptions.SSLError as e:
-            return build_error_response(request, 502, _('SSL Error'), details=str(e))
-        except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError, requests.exceptions.TooManyRedirects) as e:
-            return build_error_response(request, 504, _('Connection Error'), details=str(e))
+    def build_response(self, via_header, status, reason, headers, cookies, content):
 
         # Build a Django response
-        response = StreamingHttpResponse(res.raw.stream(4096, decode_content=False), status=res.status_code, reason=res.reason)
+        response = StreamingHttpResponse(content, status=status, reason=reason)
 
         # Add all the headers received from the response
-        for header in res.headers:
+        for header in headers:
 
             header_lower = header.lower()
             if header_lower == 'set-cookie':
 
-                for cookie in res.cookies:
+                for cookie in cookies:
                     response.set_cookie(cookie.name, value=cookie.value, expires=cookie.expires, path=cookie.path)
 
             elif header_lower == 'via':
 
-                via_header = via_header + ', ' + res.headers[header]
+                via_header = via_header + ', ' + headers[header]
 
             elif is_valid_response_header(header_lower):
-                response[header] = res.headers[header]
+                response[header] = headers[header]
+
+        return response, via_header
+
+    def build_cached_response(self, via_header, entry):
+
+        response, via_header = self.build_response(via_header, entry.status, entry.reason, entry.headers, (), (entry.content,))
+        response['Age'] = "%d" % entry.get_age(time.time())
+
+        return response, via_header
+
+    def do_request(self, request, url, method, request_data):
+
+        via_header = self.prepare_request(request, url, method, request_data)
+        metrics = request_data.get('metrics', NULL_REQUEST_METRICS)
+
+        # Pass proxy processors to the new request
+        try:
+            with metrics.phase('request_processors'):
+                for processor in get_request_proxy_processors():
+                    processor.process_request(request_data)
+        except ValidationError as e:
+            return e.get_response(request)
+
+        self.finish_request(request_data)
+        if request_data['data'] is not None:
+            metrics.add_sent_bytes(int(request_data['headers']['content-length']))
+
+        cacheable = self.cache.is_cacheable_request(request_data)
+        cache_entry, fresh = self.cache.prepare_request(request_data) if cacheable else (None, False)
+
+        if fresh:
+            response, via_header = self.build_cached_response(via_header, cache_entry)
+        else:
+            # Open the request
+            try:
+                with metrics.phase('upstream'), metrics.activate():
+                    res = self.upstreams.request(self.session_pool.request, request_data['method'], request_data['url'], headers=request_data['headers'], data=request_data['data'], stream=True, verify=getattr(settings, 'WIRECLOUD_HTTPS_VERIFY', True))
+            except CircuitOpenError as e:
+                return build_error_response(request, 503, _('Service Unavailable'), details=str(e), headers={'Retry-After': '%d' % max(e.retry_after, 1)})
+            except requests.exceptions.Timeout as e:
+                return build_error_response(request, 504, _('Gateway Timeout'), details=str(e))
+            except requests.exceptions.SSLError as e:
+                return build_error_response(request, 502, _('SSL Error'), details=str(e))
+            except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError, requests.exceptions.TooManyRedirects) as e:
+                return build_error_response(request, 504, _('Connection Error'), details=str(e))
+
+            if cache_entry is not None and res.status_code == 304:
+                # The stored response is still valid
+                res.close()
+                self.cache.revalidate(request_data, cache_entry, res.headers)
+                response, via_header = self.build_cached_response(via_header, cache_entry)
+            else:
+                if cache_entry is not None:
+                    self.cache.record('misses')
+
+                content = res.raw.stream(4096, decode_content=False)
+                new_entry = self.cache.get_cacheable_entry(res.status_code, res.reason, res.headers, time.time()) if cacheable else None
+                if new_entry is not None:
+                    content = self.cache.cache_stream(request_data, new_entry, content)
+
+                response, via_header = self.build_response(via_header, res.status_code, res.reason, res.headers, res.cookies, content)
 
         # Pass proxy processors to the response
-        for processor in get_response_proxy_processors():
-            response = processor.process_response(request_data, response)
+        with metrics.phase('response_processors'):
+            for processor in get_response_proxy_processors():
+                response = processor.process_response(request_data, response)
 
         response['Via'] = via_header
 
         return response
 
+    def get_status(self):
+
+        return {
+            'cache': self.cache.get_stats(),
+            'pool': self.session_pool.get_stats(),
+            'upstreams': self.upstreams.get_status(),
+        }
+
 
 WIRECLOUD_PROXY = Proxy()
 
 
-def proxy_request(request, protocol, domain, path):
+class ProxyStatusEntry(Resource):
+
+    @authentication_required
+    def read(self, request):
+
+        if not request.user.is_superuser:
+            return build_error_response(request, 403, _('You are not allowed to read the status of the proxy'))
+
+        return HttpResponse(json.dumps(WIRECLOUD_PROXY.get_status(), sort_keys=True), content_type='application/json; charset=UTF-8')
+
+
+class ProxyMetricsEntry(Resource):
+
+    def read(self, request):
+
+        metrics = WIRECLOUD_PROXY.metrics
+        if request.META.get('REMOTE_ADDR') not in metrics.allowed_ips and not request.user.is_superuser:
+            return build_error_response(request, 403, _('You are not allowed to read the metrics of the proxy'))
+
+        if not metrics.enabled:
+            return build_error_response(request, 404, _('Proxy metrics are disabled'))
+
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def parse_proxy_request(request, protocol, domain, path):
+    """
+    Validates a proxy request, returning the target URL and the proxy context.
+    Raises a ProxyError if the request is not valid.
+    """
 
     # TODO improve proxy security
     request_method = request.method.upper()
     if protocol not in ('http', 'https'):
-        return build_error_response(request, 422, _("Invalid protocol: %s") % protocol)
+        raise ProxyError(build_error_response(request, 422, _("Invalid protocol: %s") % protocol))
 
     try:
         if settings.SESSION_COOKIE_NAME not in request.COOKIES:
@@ -252,31 +395,53 @@ def proxy_request(request, protocol, domain, path):
         context = parse_context_from_referer(request, request_method)
 
     except Exception:
-        return build_error_response(request, 403, _("Invalid request"))
+        raise ProxyError(build_error_response(request, 403, _("Invalid request")))
 
     url = protocol + '://' + domain + path
     if len(request.GET) > 0:
         url += '?' + request.GET.urlencode()
 
+    return url, context
+
+
+def fix_response_cookies(response, protocol, domain, path):
+
+    for key in response.cookies:
+        cookie = response.cookies[key]
+
+        if cookie['path'] == '':
+            cookie['path'] = reverse('wirecloud|proxy', kwargs={'protocol': protocol, 'domain': domain, 'path': path})
+        else:
+            cookie['path'] = reverse('wirecloud|proxy', kwargs={'protocol': protocol, 'domain': domain, 'path': cookie['path']})
+
+
+def proxy_request(request, protocol, domain, path):
+
+    metrics = WIRECLOUD_PROXY.metrics.start(request.method.upper(), domain)
+
+    try:
+        with metrics.phase('context'):
+            url, context = parse_proxy_request(request, protocol, domain, path)
+    except ProxyError as e:
+        return metrics.wrap_response(e.response)
+
+    context['metrics'] = metrics
+
     try:
         # Extract headers from META
         parse_request_headers(request, context)
 
-        response = WIRECLOUD_PROXY.do_request(request, url, request_method, context)
+        response = WIRECLOUD_PROXY.do_request(request, url, request.method.upper(), context)
+    except ProxyError as e:
+        return metrics.wrap_response(e.response)
     except ValidationError as e:
-        return e.get_response(request)
+        return metrics.wrap_response(e.get_response(request))
     except Exception as e:
         log_error(request, sys.exc_info())
         msg = _("Error processing proxy request: %s") % e
-        return build_error_response(request, 500, msg)
+        return metrics.wrap_response(build_error_response(request, 500, msg))
 
     # Process cookies
-    for key in response.cookies:
-        cookie = response.cookies[key]
-
-        if cookie['path'] == '':
-            cookie['path'] = reverse('wirecloud|proxy', kwargs={'protocol': protocol, 'domain': domain, 'path': path})
-        else:
-            cookie['path'] = reverse('wirecloud|proxy', kwargs={'protocol': protocol, 'domain': domain, 'path': cookie['path']})
+    fix_response_cookies(response, protocol, domain, path)
 
-    return response
+    return metrics.wrap_response(response)